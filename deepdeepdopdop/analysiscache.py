@@ -0,0 +1,206 @@
+import logging as log
+
+import hashlib
+import json
+import numpy
+import shutil
+
+from pathlib import Path
+from typing import Any, Callable, Optional, List
+
+from .configuration import Configuration
+from .types import Frame, Face, create_face
+from .faceanalyser import FrameAnalysis
+from .metrics import metrics
+
+def hash_file(file_path : Path, chunk_size : int = 1 << 20) -> str:
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        while chunk := file.read(chunk_size):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+class SourceFaceCache:
+    def __init__(self, configuration : Configuration, image_file_path : Optional[Path] = None):
+        self.configuration = configuration
+        self.image_file_path = image_file_path or self.configuration.source_face_image_file
+
+        # The latent depends on the swapper model, so the model file is a part of the key too.
+        swapper_model_file_path = self.configuration.face_swapper_model_file_path
+        key_parameters = {
+            'source_face_image_file_hash': hash_file(self.image_file_path),
+            'model': self.configuration.face_analyser_model_name,
+            'detection_threshold': self.configuration.face_detection_threshold,
+            'detection_size': self.configuration.face_detection_size,
+            'swapper_model': swapper_model_file_path.name,
+            'swapper_model_size': swapper_model_file_path.stat().st_size if swapper_model_file_path.exists() else 0,
+            'quantization': self.configuration.quantization_key
+        }
+        self.key = hashlib.sha256(json.dumps(key_parameters, sort_keys = True).encode()).hexdigest()
+        self.file_path = self.configuration.cache_directory / 'source-faces' / f'{self.key}.npz'
+
+    def load(self) -> Optional[Face]:
+        if not self.file_path.exists():
+            return None
+
+        log.info(f'Load source face from cache {self.file_path}')
+        with numpy.load(self.file_path) as data:
+            return create_face({name: data[name] for name in data.files})
+
+    def save(self, source_face : Face) -> None:
+        log.info(f'Save source face to cache {self.file_path}')
+
+        self.file_path.parent.mkdir(parents = True, exist_ok = True)
+
+        columns = {name: numpy.asarray(source_face[name]) for name in ('bbox', 'kps', 'det_score', 'embedding', 'latent') if source_face.get(name) is not None}
+
+        temporary_file_path = self.file_path.with_name(f'{self.file_path.name}.tmp')
+        with open(temporary_file_path, 'wb') as file:
+            numpy.savez(file, **columns)
+        temporary_file_path.replace(self.file_path)
+
+class AnalysisCache:
+    def __init__(self, configuration : Configuration):
+        self.configuration = configuration
+
+        # Everything which changes the result of the analysis is a part of the key.
+        key_parameters = {
+            'input_file_hash': hash_file(self.configuration.input_file),
+            'model': self.configuration.face_analyser_model_name,
+            'modules': self.configuration.face_analyser_modules,
+            'detection_threshold': self.configuration.face_detection_threshold,
+            'detection_size': self.configuration.face_detection_size,
+            'detection_interval': self.configuration.detection_interval,
+            'tracking_min_confidence': self.configuration.tracking_min_confidence,
+            'tracking_iou_threshold': self.configuration.tracking_iou_threshold,
+            # Frames which reuse the analysis of the frame before them are stored, they depend on the threshold.
+            'static_frame_threshold': self.configuration.static_frame_threshold if self.configuration.reuse_static_frames else None,
+            'quantization': self.configuration.quantization_key
+        }
+        self.key = hashlib.sha256(json.dumps(key_parameters, sort_keys = True).encode()).hexdigest()
+
+        directory = self.configuration.analysis_cache_directory or self.configuration.input_file.parent
+        self.directory_path = directory / f'{self.configuration.input_file.name}.faces-{self.key[:16]}'
+
+    def exists(self) -> bool:
+        return (self.directory_path / 'frame_offsets.npy').exists()
+
+    def load(self) -> 'AnalysisCacheReader':
+        log.info(f'Load face analysis from cache {self.directory_path}')
+        return AnalysisCacheReader(self.directory_path)
+
+    def save(self, frame_analyses : List[FrameAnalysis]) -> None:
+        log.info(f'Save face analysis of {len(frame_analyses)} frames to cache {self.directory_path}')
+
+        faces = [face for frame_analysis in frame_analyses for face in frame_analysis.faces]
+
+        # A static frame has the same analysis object as the frame before it, it refers to the frame which was analyzed.
+        key_frame_indices : List[int] = []
+        for frame_index, frame_analysis in enumerate(frame_analyses):
+            reused = frame_index > 0 and frame_analysis is frame_analyses[frame_index - 1]
+            key_frame_indices.append(key_frame_indices[-1] if reused else frame_index)
+
+        # One row per face, the faces of frame N are rows frame_offsets[N] to frame_offsets[N + 1].
+        columns = {
+            'frame_offsets': numpy.cumsum([0] + [len(frame_analysis.faces) for frame_analysis in frame_analyses], dtype = numpy.int64),
+            'bboxes': numpy.array([face.bbox for face in faces], dtype = numpy.float32).reshape(-1, 4),
+            'kps': numpy.array([face.kps for face in faces], dtype = numpy.float32).reshape(-1, 5, 2),
+            'det_scores': numpy.array([face.det_score for face in faces], dtype = numpy.float32),
+            'embeddings': numpy.array([face.normed_embedding for face in faces], dtype = numpy.float16).reshape(len(faces), -1),
+            'key_frame_indices': numpy.array(key_frame_indices, dtype = numpy.int64)
+        }
+
+        # The cache appears only when it is complete.
+        temporary_directory_path = self.directory_path.with_name(f'{self.directory_path.name}.tmp')
+        shutil.rmtree(temporary_directory_path, ignore_errors = True)
+        temporary_directory_path.mkdir(parents = True)
+
+        for name, column in columns.items():
+            numpy.save(temporary_directory_path / f'{name}.npy', column)
+
+        shutil.rmtree(self.directory_path, ignore_errors = True)
+        temporary_directory_path.rename(self.directory_path)
+
+class AnalysisCacheReader:
+    def __init__(self, directory_path : Path):
+        self.frame_offsets = numpy.load(directory_path / 'frame_offsets.npy')
+        self.bboxes = numpy.load(directory_path / 'bboxes.npy', mmap_mode = 'r')
+        self.kps = numpy.load(directory_path / 'kps.npy', mmap_mode = 'r')
+        self.det_scores = numpy.load(directory_path / 'det_scores.npy', mmap_mode = 'r')
+        self.embeddings = numpy.load(directory_path / 'embeddings.npy', mmap_mode = 'r')
+        # Caches of earlier versions have no key frames, every frame is its own key frame there.
+        key_frame_indices_file_path = directory_path / 'key_frame_indices.npy'
+        self.key_frame_indices : Optional[numpy.ndarray] = numpy.load(key_frame_indices_file_path) if key_frame_indices_file_path.exists() else None
+
+    def __len__(self) -> int:
+        return len(self.frame_offsets) - 1
+
+    def get_key_frame_index(self, frame_index : int) -> int:
+        return int(self.key_frame_indices[frame_index]) if self.key_frame_indices is not None else frame_index
+
+    def get(self, frame_index : int) -> FrameAnalysis:
+        faces : List[Face] = []
+        for row in range(self.frame_offsets[frame_index], self.frame_offsets[frame_index + 1]):
+            faces.append(create_face(bbox = numpy.array(self.bboxes[row]), kps = numpy.array(self.kps[row]), det_score = self.det_scores[row], embedding = self.embeddings[row].astype(numpy.float32)))
+        return FrameAnalysis(faces)
+
+class CachedFrameAnalyzer:
+    # The frame analyzer is created on the first frame which is not in the cache, so its models are not loaded
+    # when the cache has every frame.
+    def __init__(self, analysis_cache : AnalysisCache, create_frame_analyzer : Callable[[], Any]):
+        self.analysis_cache = analysis_cache
+        self.create_frame_analyzer = create_frame_analyzer
+        self.frame_analyzer = None
+        self.reader : Optional[AnalysisCacheReader] = analysis_cache.load() if analysis_cache.exists() else None
+        self.frame_analyses : List[FrameAnalysis] = []
+        self.frame_index : int = 0
+        self.cached_frame_count : int = 0
+        self.reused_frame_count : int = 0
+
+        # The analysis of the last key frame is returned again for static frames after it, so processors reuse their output.
+        self.key_frame_index : int = -1
+        self.key_frame_analysis : Optional[FrameAnalysis] = None
+
+    def analyze_frame(self, frame : Frame) -> FrameAnalysis:
+        # Frames are analyzed in order, so the position in the video is the number of analyzed frames.
+        if self.reader is not None and self.frame_index < len(self.reader):
+            key_frame_index = self.reader.get_key_frame_index(self.frame_index)
+            if key_frame_index == self.key_frame_index and self.key_frame_analysis is not None:
+                frame_analysis = self.key_frame_analysis
+                self.reused_frame_count += 1
+                metrics.count('frames_reused')
+            else:
+                frame_analysis = self.reader.get(self.frame_index)
+                self.key_frame_index = key_frame_index
+                self.key_frame_analysis = frame_analysis
+            self.cached_frame_count += 1
+        else:
+            frame_analysis = self.__get_frame_analyzer().analyze_frame(frame)
+
+        if self.reader is None:
+            self.frame_analyses.append(frame_analysis)
+
+        self.frame_index += 1
+        return frame_analysis
+
+    def __get_frame_analyzer(self):
+        if self.frame_analyzer is None:
+            self.frame_analyzer = self.create_frame_analyzer()
+        return self.frame_analyzer
+
+    def analyze_frames(self, frames : List[Frame]) -> List[FrameAnalysis]:
+        if self.reader is None:
+            frame_analyses = self.__get_frame_analyzer().analyze_frames(frames)
+            self.frame_analyses.extend(frame_analyses)
+            self.frame_index += len(frames)
+            return frame_analyses
+        return [self.analyze_frame(frame) for frame in frames]
+
+    def finish(self) -> None:
+        if self.frame_analyzer is not None:
+            self.frame_analyzer.finish()
+
+        if self.reader is None:
+            self.analysis_cache.save(self.frame_analyses)
+        else:
+            log.info(f'Face analysis cache statistics: cached_frames={self.cached_frame_count}, reused_frames={self.reused_frame_count}, analyzed_frames={self.frame_index - self.cached_frame_count}')
@@ -1,15 +1,24 @@
 import logging as log
-import av
+
+import cProfile
+import io
+import pstats
+
 from contextlib import ContextDecorator
 from typing import Optional
 
 from .configuration import Configuration
 from .faceprocessor import FaceProcessor
-from .faceprocessor import EveryFaceProcessor
+from .faceprocessor import create_face_processor
 from .fileprocessor import FileProcessor
-from .imageprocessor import ImageProcessor
-from .videoprocessor import VideoProcessor
-from .utils import is_image, is_video
+from .batchprocessor import BatchProcessor, create_file_processor
+from .server import Server
+from .benchmark import Benchmark
+from .streamprocessor import StreamProcessor
+from .sessiontuner import SessionTuner
+from .quantizationreport import QuantizationReport
+from .calibration import calibrate_models
+from .metrics import metrics
 
 class Application(ContextDecorator):
     def __init__(self):
@@ -22,24 +31,46 @@ class Application(ContextDecorator):
         return self
 
     def __exit__(self, *args):
+        metrics.log_report()
+        metrics.write(self.configuration.metrics_file, self.configuration.prometheus_file)
         log.info('Finish')
 
-    def __create_face_processor(self) -> FaceProcessor:
-        return EveryFaceProcessor(self.configuration) if self.configuration.process_every_face else FaceProcessor(self.configuration)
-
     def __create_file_processor(self, face_processor : FaceProcessor) -> Optional[FileProcessor]:
-        if is_image(self.configuration.input_file):
-            return ImageProcessor(self.configuration, face_processor)
-        elif is_video(self.configuration.input_file):
-            return VideoProcessor(self.configuration, face_processor)
-
-        return None
+        if self.configuration.serve:
+            return Server(self.configuration, face_processor)
+        elif self.configuration.benchmark:
+            return Benchmark(self.configuration, face_processor)
+        elif self.configuration.tune_sessions:
+            return SessionTuner(self.configuration, face_processor)
+        elif self.configuration.stream_input:
+            return StreamProcessor(self.configuration, face_processor)
+        elif self.configuration.batch_input:
+            return BatchProcessor(self.configuration, face_processor)
+        elif self.configuration.quantization_report_file:
+            return QuantizationReport(self.configuration, face_processor)
+        return create_file_processor(self.configuration, face_processor)
 
     def __process(self) -> None:
-        face_processor = self.__create_face_processor()
+        if self.configuration.quantized_stages and self.configuration.quantization_mode == 'static':
+            calibrate_models(self.configuration)
+
+        face_processor = create_face_processor(self.configuration)
         file_processor = self.__create_file_processor(face_processor)
         if file_processor:
-            file_processor.run()
+            if self.configuration.profile_file:
+                self.__profile(file_processor)
+            else:
+                file_processor.run()
+
+    def __profile(self, file_processor : FileProcessor) -> None:
+        # Only the main thread is profiled, pipeline stages and segment workers run elsewhere.
+        profile = cProfile.Profile()
+        profile.runcall(file_processor.run)
+        profile.dump_stats(str(self.configuration.profile_file))
+
+        statistics = io.StringIO()
+        pstats.Stats(profile, stream = statistics).sort_stats('cumulative').print_stats(20)
+        log.info(f'Profile is written to file {self.configuration.profile_file}\n{statistics.getvalue()}')
 
     def run(self) -> None:
         if self.configuration.parse_command_line():
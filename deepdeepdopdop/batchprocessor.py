@@ -0,0 +1,132 @@
+import logging as log
+
+import copy
+import glob
+import json
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from .configuration import Configuration
+from .fileprocessor import FileProcessor
+from .faceprocessor import FaceProcessor
+from .imageprocessor import ImageProcessor
+from .videoprocessor import VideoProcessor
+from .segmentedvideoprocessor import SegmentedVideoProcessor
+from .smartvideoprocessor import SmartVideoProcessor
+from .utils import is_image, is_video
+
+def create_file_processor(configuration : Configuration, face_processor : FaceProcessor) -> Optional[FileProcessor]:
+    if is_image(configuration.input_file):
+        return ImageProcessor(configuration, face_processor)
+    elif is_video(configuration.input_file):
+        if configuration.smart_render:
+            return SmartVideoProcessor(configuration, face_processor)
+        if configuration.video_segments > 1:
+            return SegmentedVideoProcessor(configuration, face_processor)
+        return VideoProcessor(configuration, face_processor)
+
+    return None
+
+class BatchProcessor(FileProcessor):
+    # Many input files are processed by one process, so models are loaded once for all of them.
+    def __init__(self, configuration : Configuration, face_processor : FaceProcessor):
+        super().__init__(configuration, face_processor)
+
+    def __find_input_files(self) -> list[Path]:
+        batch_input = Path(self.configuration.batch_input)
+
+        if batch_input.is_dir():
+            input_files = [path for path in batch_input.rglob('*') if is_image(path) or is_video(path)]
+        elif batch_input.is_file():
+            # A manifest has a path per line, relative paths are relative to the manifest.
+            lines = [line.strip() for line in batch_input.read_text().splitlines()]
+            input_files = [path if path.is_absolute() else batch_input.parent / path for path in (Path(line) for line in lines if line and not line.startswith('#'))]
+        else:
+            input_files = [Path(path) for path in glob.glob(self.configuration.batch_input, recursive = True)]
+
+        return sorted(set(input_files))
+
+    def __get_output_file(self, input_file : Path) -> Path:
+        output_directory = self.configuration.output_directory
+        if output_directory and self.configuration.batch_input and Path(self.configuration.batch_input).is_dir():
+            # The layout of the input directory is kept in the output directory.
+            output_directory = output_directory / input_file.parent.relative_to(self.configuration.batch_input)
+        return self.configuration.get_default_output_file(input_file, output_directory)
+
+    def __create_file_processor(self, input_file : Path, output_file : Path) -> Optional[FileProcessor]:
+        configuration = copy.copy(self.configuration)
+        configuration.input_file = input_file
+        configuration.output_file = output_file
+
+        return create_file_processor(configuration, self.face_processor.with_configuration(configuration))
+
+    def __process_file(self, input_file : Path, output_file : Path) -> dict:
+        result = { 'input_file': str(input_file), 'output_file': str(output_file) }
+        start_time = time.perf_counter()
+
+        try:
+            file_processor = self.__create_file_processor(input_file, output_file)
+            if file_processor:
+                output_file.parent.mkdir(parents = True, exist_ok = True)
+                file_processor.run()
+                result['status'] = 'processed' if output_file.exists() else 'failed'
+            else:
+                result['status'] = 'unsupported'
+        except Exception as error:
+            log.exception(f'Failed to process input file {input_file}')
+            result['status'] = 'failed'
+            result['error'] = str(error)
+
+        result['elapsed_time'] = round(time.perf_counter() - start_time, 3)
+        log.info(f'Input file {input_file} is {result["status"]} in {result["elapsed_time"]} sec')
+        return result
+
+    def __write_report(self, results : list[dict]) -> None:
+        report_file = self.configuration.batch_report_file or (self.configuration.output_directory or Path('.')) / 'batch-report.json'
+        log.info(f'Write batch report to file {report_file}')
+
+        report_file.parent.mkdir(parents = True, exist_ok = True)
+        with open(report_file, 'w') as file:
+            json.dump(results, file, indent = 2)
+
+    def run(self) -> None:
+        input_files = self.__find_input_files()
+        output_files = [self.__get_output_file(input_file) for input_file in input_files]
+
+        # Outputs of a previous run next to the inputs are not inputs themselves.
+        planned_output_files = set(output_files)
+        files = [(input_file, output_file) for input_file, output_file in zip(input_files, output_files) if input_file not in planned_output_files]
+
+        log.info(f'Process batch {self.configuration.batch_input} of {len(files)} input files')
+
+        results : list[dict] = []
+        pending_files : list[tuple[Path, Path]] = []
+        for input_file, output_file in files:
+            if output_file.exists():
+                results.append({ 'input_file': str(input_file), 'output_file': str(output_file), 'status': 'skipped' })
+            else:
+                pending_files.append((input_file, output_file))
+
+        log.info(f'{len(results)} input files are skipped because their output files exist')
+
+        # The source face and the models are loaded before workers start, so they are not loaded by every worker.
+        if pending_files and not self.face_processor.find_source_face():
+            return
+
+        image_files = [(input_file, output_file) for input_file, output_file in pending_files if is_image(input_file)]
+        other_files = [(input_file, output_file) for input_file, output_file in pending_files if not is_image(input_file)]
+
+        # Images are small, so several of them are processed at the same time, ONNX Runtime releases the GIL.
+        with ThreadPoolExecutor(max_workers = self.configuration.batch_workers) as executor:
+            results += list(executor.map(lambda files : self.__process_file(*files), image_files))
+
+        # Videos use threads or processes of their own.
+        results += [self.__process_file(input_file, output_file) for input_file, output_file in other_files]
+
+        statuses = [result['status'] for result in results]
+        log.info('Batch is processed: ' + ', '.join(f'{status}={statuses.count(status)}' for status in sorted(set(statuses))))
+
+        self.__write_report(results)
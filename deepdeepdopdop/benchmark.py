@@ -0,0 +1,275 @@
+import logging as log
+
+import copy
+import json
+import math
+import time
+
+import cv2
+import numpy
+
+import warnings
+warnings.filterwarnings('ignore', category = FutureWarning, module = 'insightface')
+
+from pathlib import Path
+from typing import Callable, Optional
+
+from .configuration import Configuration
+from .fileprocessor import FileProcessor
+from .faceprocessor import FaceProcessor, create_face_processor
+from .imageio import read_image, write_image
+from .imageprocessor import ImageProcessor
+from .videoprocessor import VideoProcessor
+from .videoio import AVVideoWriter
+from .types import Frame
+from .standinmodels import create_detection_model, create_recognition_model, create_swapper_model, create_restorer_model
+from .metrics import metrics
+from .utils import is_image
+
+# Options of video processing modes compared by the benchmark.
+VIDEO_MODES : dict[str, dict] = {
+    'streaming': { 'process_video_in_memory': False, 'process_video_in_pipeline': False },
+    'pipeline': { 'process_video_in_memory': False, 'process_video_in_pipeline': True },
+    'in-memory': { 'process_video_in_memory': True, 'process_video_in_pipeline': False }
+}
+
+# A face with its bounding box and five keypoints.
+FaceLayout = tuple[numpy.ndarray, numpy.ndarray]
+
+def get_face_layout(frame_width : int, frame_height : int, face_count : int) -> list[FaceLayout]:
+    # Faces are placed in cells of a grid, far enough from each other not to be suppressed by NMS.
+    from insightface.utils import face_align
+
+    columns = math.ceil(math.sqrt(face_count))
+    rows = math.ceil(face_count / columns)
+    cell_width, cell_height = frame_width / columns, frame_height / rows
+    face_size = 0.6 * min(cell_width, cell_height)
+
+    layout : list[FaceLayout] = []
+    for index in range(face_count):
+        left = (index % columns + 0.5) * cell_width - face_size / 2
+        top = (index // columns + 0.5) * cell_height - face_size / 2
+        bbox = numpy.array([left, top, left + face_size, top + face_size], numpy.float32)
+        kps = (face_align.arcface_dst / 112 * face_size + (left, top)).astype(numpy.float32)
+        layout.append((bbox, kps))
+
+    return layout
+
+def get_detection_scale(frame_width : int, frame_height : int, detection_size : tuple[int, int]) -> float:
+    # The same scale as RetinaFace fits a frame into its input with.
+    detection_width, detection_height = detection_size
+    if frame_height / frame_width > detection_height / detection_width:
+        return detection_height / frame_height
+    return int(detection_width * frame_height / frame_width) / frame_height
+
+def create_synthetic_frame(frame_width : int, frame_height : int, layout : list[FaceLayout], background : Frame, frame_index : int, face_image : Optional[Frame] = None) -> Frame:
+    # The background moves from frame to frame, so the encoder has work like with a real video, faces stay.
+    frame = numpy.roll(background, frame_index * 4, axis = 1)
+
+    for index, (bbox, kps) in enumerate(layout):
+        left, top, right, bottom = bbox
+        face_size = right - left
+        if face_image is not None:
+            # A real face for real models, the face image is expected to be a portrait.
+            margin = face_size * 0.3
+            start_x, start_y = max(int(left - margin), 0), max(int(top - margin), 0)
+            end_x, end_y = min(int(right + margin), frame_width), min(int(bottom + margin), frame_height)
+            frame[start_y : end_y, start_x : end_x] = cv2.resize(face_image, (end_x - start_x, end_y - start_y))
+            continue
+
+        color = tuple(int(channel) for channel in numpy.random.default_rng(index).integers(64, 224, 3))
+        center = (int((left + right) / 2), int((top + bottom) / 2))
+        cv2.ellipse(frame, center, (int(face_size * 0.42), int(face_size * 0.5)), 0, 0, 360, color, -1)
+        for x, y in kps[:2]:
+            cv2.circle(frame, (int(x), int(y)), max(int(face_size / 14), 1), (255, 255, 255), -1)
+            cv2.circle(frame, (int(x), int(y)), max(int(face_size / 30), 1), (32, 32, 32), -1)
+        cv2.circle(frame, (int(kps[2][0]), int(kps[2][1])), max(int(face_size / 24), 1), (64, 64, 128), -1)
+        cv2.line(frame, (int(kps[3][0]), int(kps[3][1])), (int(kps[4][0]), int(kps[4][1])), (48, 48, 160), max(int(face_size / 30), 1))
+
+    return frame
+
+class Benchmark(FileProcessor):
+    # Synthetic images and videos with a known number of faces are processed by every processing mode,
+    # the fps, latencies of stages and the peak memory of every run are reported.
+    def __init__(self, configuration : Configuration, face_processor : FaceProcessor):
+        super().__init__(configuration, face_processor)
+
+        self.directory : Path = self.configuration.benchmark_directory / self.configuration.benchmark_models
+        self.stand_in_models : bool = self.configuration.benchmark_models == 'stand-in'
+        self.frame_count : int = self.configuration.benchmark_frame_count
+        # The restorer is measured with stand-in models always and with real models only if it is requested.
+        self.restore_face : bool = self.stand_in_models or self.configuration.restore_face
+        self.results : list[dict] = []
+
+        # Real models do not find drawn faces, so faces of the source face image are placed instead of them.
+        self.face_image : Optional[Frame] = None
+        if not self.stand_in_models and self.configuration.source_face_image_file:
+            self.face_image = read_image(self.configuration.source_face_image_file)
+
+    def __create_stand_in_models(self, configuration : Configuration, layout : list[FaceLayout], frame_width : int, frame_height : int) -> None:
+        if not configuration.face_swapper_model_file_path.exists():
+            create_swapper_model(configuration.face_swapper_model_file_path)
+        if not configuration.face_restorer_onnx_model_file_path.exists():
+            create_restorer_model(configuration.face_restorer_onnx_model_file_path)
+
+        if not (configuration.face_analyser_model_directory / 'det_10g.onnx').exists():
+            detection_scale = get_detection_scale(frame_width, frame_height, configuration.face_detection_size)
+            detection_faces = [(bbox * detection_scale, kps * detection_scale) for bbox, kps in layout]
+            create_detection_model(configuration.face_analyser_model_directory / 'det_10g.onnx', configuration.face_detection_size, detection_faces)
+        if not (configuration.face_analyser_model_directory / 'w600k_r50.onnx').exists():
+            create_recognition_model(configuration.face_analyser_model_directory / 'w600k_r50.onnx')
+
+    def __create_synthetic_files(self, scenario_directory : Path, layout : list[FaceLayout], frame_width : int, frame_height : int) -> tuple[Path, Path, Frame]:
+        # Files are generated from fixed seeds, so they are the same in every run and are kept between runs.
+        background = numpy.random.default_rng(frame_width * frame_height).integers(0, 256, (frame_height, frame_width, 3), dtype = numpy.uint8)
+        background = cv2.GaussianBlur(background, (0, 0), 3)
+
+        image = create_synthetic_frame(frame_width, frame_height, layout, background, 0, self.face_image)
+        image_file = scenario_directory / 'input.png'
+        if not image_file.exists():
+            write_image(image_file, image)
+
+        video_file = scenario_directory / f'input-{self.frame_count}-frames.mp4'
+        if not video_file.exists():
+            log.info(f'Write synthetic video {video_file}')
+            with AVVideoWriter(video_file, 'libx264', 25, frame_width, frame_height) as video_writer:
+                for frame_index in range(self.frame_count):
+                    video_writer.write(create_synthetic_frame(frame_width, frame_height, layout, background, frame_index, self.face_image))
+
+        return image_file, video_file, image
+
+    def __create_configuration(self, scenario_directory : Path, image_file : Path) -> Configuration:
+        configuration = copy.copy(self.configuration)
+        configuration.cache_directory = self.configuration.benchmark_directory / 'cache'
+        configuration.source_face_image_file = self.configuration.source_face_image_file if self.face_image is not None else image_file
+        configuration.face_mappings = []
+
+        if self.stand_in_models:
+            configuration.face_analyser_model_directory = scenario_directory / 'models'
+            configuration.face_swapper_model_file_path = self.directory / 'models' / 'inswapper_128.onnx'
+            configuration.face_restorer_onnx_model_file_path = self.directory / 'models' / 'gfpgan_1.4.onnx'
+            configuration.face_restorer_engine = 'onnx'
+
+        return configuration
+
+    def __measure(self, scenario : str, name : str, frame_count : int, function : Callable[[], None]) -> dict:
+        metrics.reset()
+        start_time = time.perf_counter()
+        function()
+        elapsed_time = time.perf_counter() - start_time
+
+        summary = metrics.to_dict()
+        result = {
+            'scenario': scenario,
+            'name': name,
+            'frame_count': frame_count,
+            'elapsed_time': round(elapsed_time, 3),
+            'fps': round(frame_count / elapsed_time, 2) if elapsed_time > 0 else 0,
+            'stages': { stage: { key: histogram[key] for key in ('count', 'sum', 'mean', 'p50', 'p95', 'max') } for stage, histogram in summary['stages'].items() },
+            'startup_times': summary['startup_times'],
+            'faces_per_frame': summary['distributions'].get('faces_per_frame', {}).get('mean'),
+            'counters': summary['counters'],
+            # The peak is the maximum of the process so far, not of this run only.
+            'peak_rss_bytes': summary['peak_rss_bytes']['self']
+        }
+        self.results.append(result)
+
+        log.info(f'Benchmark {scenario} {name}: {frame_count} frames in {result["elapsed_time"]} sec, fps={result["fps"]}, peak_rss={result["peak_rss_bytes"] // (1024 * 1024)} MB')
+        return result
+
+    def __run_stages(self, scenario : str, face_processor : FaceProcessor, frame : Frame) -> None:
+        # Stages are measured on the same frame again and again, without decoding and encoding.
+        self.__measure(scenario, 'startup', 0, lambda : (face_processor.face_analyser, face_processor.face_swapper, face_processor.face_restorer if self.restore_face else None))
+
+        source_face = face_processor.find_source_face()
+        target_faces = [(face, frame) for face in face_processor.face_analyser.analyze_frame(frame).faces]
+        if not source_face or not target_faces:
+            log.error(f'Benchmark {scenario}: no faces are found, stages are not measured')
+            return
+
+        def swap() -> None:
+            for _ in range(self.frame_count):
+                output_frame = frame.copy()
+                for swapped_face in face_processor.face_swapper.swap_faces(source_face, target_faces):
+                    output_frame = face_processor.face_swapper.paste_back(output_frame, swapped_face)
+
+        def restore() -> None:
+            for _ in range(self.frame_count):
+                output_frame = frame.copy()
+                for restored_face in face_processor.face_restorer.restore_faces(target_faces):
+                    output_frame = face_processor.face_restorer.paste_back(output_frame, restored_face)
+
+        self.__measure(scenario, 'analyser', self.frame_count, lambda : [face_processor.face_analyser.analyze_frame(frame) for _ in range(self.frame_count)])
+        self.__measure(scenario, 'swapper', self.frame_count, swap)
+        if self.restore_face:
+            self.__measure(scenario, 'restorer', self.frame_count, restore)
+
+    def __run_file_processor(self, scenario : str, name : str, configuration : Configuration, face_processor : FaceProcessor, input_file : Path, frame_count : int, options : Optional[dict] = None) -> None:
+        configuration = copy.copy(configuration)
+        for option, value in (options or {}).items():
+            setattr(configuration, option, value)
+        configuration.input_file = input_file
+        configuration.output_file = input_file.parent / 'output' / f'{name}{input_file.suffix}'
+        configuration.output_file.parent.mkdir(parents = True, exist_ok = True)
+        if configuration.output_file.exists():
+            configuration.output_file.unlink()
+
+        file_processor_class = ImageProcessor if is_image(input_file) else VideoProcessor
+        file_processor = file_processor_class(configuration, face_processor.with_configuration(configuration))
+        self.__measure(scenario, name, frame_count, file_processor.run)
+
+    def __run_scenario(self, frame_width : int, frame_height : int, face_count : int) -> None:
+        scenario = f'{frame_width}x{frame_height}-{face_count}-faces'
+        scenario_directory = self.directory / scenario
+        scenario_directory.mkdir(parents = True, exist_ok = True)
+        log.info(f'Run benchmark {scenario}')
+
+        layout = get_face_layout(frame_width, frame_height, face_count)
+        image_file, video_file, image = self.__create_synthetic_files(scenario_directory, layout, frame_width, frame_height)
+
+        configuration = self.__create_configuration(scenario_directory, image_file)
+        if self.stand_in_models:
+            # Every scenario has its own detector which finds its faces, so models are loaded for it.
+            self.__create_stand_in_models(configuration, layout, frame_width, frame_height)
+            face_processor = create_face_processor(configuration)
+        else:
+            face_processor = self.face_processor.with_configuration(configuration)
+
+        self.__run_stages(scenario, face_processor, image)
+        self.__run_file_processor(scenario, 'image', configuration, face_processor, image_file, 1)
+        for mode, options in VIDEO_MODES.items():
+            self.__run_file_processor(scenario, f'video-{mode}', configuration, face_processor, video_file, self.frame_count, options)
+
+    def __write_report(self) -> None:
+        report_file = self.configuration.benchmark_report_file or self.configuration.benchmark_directory / 'benchmark-report.json'
+        log.info(f'Write benchmark report to file {report_file}')
+
+        report = {
+            'models': self.configuration.benchmark_models,
+            'execution_provider': self.configuration.execution_provider,
+            'inference_batch_size': self.configuration.inference_batch_size,
+            'restore_face': self.configuration.restore_face,
+            'video_reader': self.configuration.video_reader,
+            'video_writer': self.configuration.video_writer,
+            'frame_count': self.frame_count,
+            'results': self.results
+        }
+
+        report_file.parent.mkdir(parents = True, exist_ok = True)
+        with open(report_file, 'w') as file:
+            json.dump(report, file, indent = 2)
+
+    def run(self) -> None:
+        log.info(f'Run benchmark with {self.configuration.benchmark_models} models: resolutions={self.configuration.benchmark_resolutions}, face_counts={self.configuration.benchmark_face_counts}, frame_count={self.frame_count}')
+
+        if not self.stand_in_models and self.face_image is None:
+            log.warning('Faces drawn in synthetic files are found only by stand-in models, set the source face image file for real models')
+
+        for frame_width, frame_height in self.configuration.benchmark_resolutions:
+            for face_count in self.configuration.benchmark_face_counts:
+                self.__run_scenario(frame_width, frame_height, face_count)
+
+        for result in self.results:
+            log.info(f'{result["scenario"]:<24} {result["name"]:<20} fps={result["fps"]:>9.2f}   elapsed={result["elapsed_time"]:>8.3f} sec   peak_rss={result["peak_rss_bytes"] // (1024 * 1024):>6} MB')
+
+        self.__write_report()
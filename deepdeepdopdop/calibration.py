@@ -0,0 +1,103 @@
+import logging as log
+
+import copy
+
+import numpy
+
+from tqdm import tqdm
+from pathlib import Path
+
+from .configuration import Configuration
+from .types import Frame
+from .faceprocessor import create_face_processor
+from .faceanalyser import get_face_analyser_model_directory
+from .imageio import read_image
+from .sessions import get_model_taskname
+from .quantization import get_quantized_model_file_path, quantize_model_statically
+from .videoio import AVVideoReader
+from .utils import download, is_image
+
+class RecordingSession:
+    # Passes runs to the session and keeps their inputs item by item, because quantized models have batch size 1.
+    def __init__(self, session):
+        self.session = session
+        self.input_feeds : list[dict[str, numpy.ndarray]] = []
+
+    def __getattr__(self, name : str):
+        return getattr(self.session, name)
+
+    def run(self, output_names, input_feed : dict[str, numpy.ndarray], run_options = None) -> list[numpy.ndarray]:
+        item_count = len(next(iter(input_feed.values())))
+        for index in range(item_count):
+            self.input_feeds.append({name: numpy.array(value[index : index + 1]) for name, value in input_feed.items()})
+        return self.session.run(output_names, input_feed, run_options)
+
+def read_sample_frames(file_path : Path, frame_count : int) -> list[Frame]:
+    # Frames evenly spread over the video, or the image itself.
+    if is_image(file_path):
+        return [read_image(file_path)]
+
+    frames : list[Frame] = []
+    with AVVideoReader(file_path) as video_reader:
+        if video_reader:
+            for index in range(frame_count):
+                if video_reader.read_at(int(video_reader.duration * (index + 0.5) / frame_count * 1000)):
+                    frames.append(video_reader.frame.copy())
+
+    log.info(f'Read {len(frames)} sample frames from file {file_path}')
+    return frames
+
+def get_model_file_paths(configuration : Configuration) -> dict[str, Path]:
+    # The same models as the face analyser loads, the first model of every task in the directory.
+    model_file_paths : dict[str, Path] = {}
+    for model_file_path in sorted(get_face_analyser_model_directory(configuration).glob('*.onnx')):
+        taskname = get_model_taskname(model_file_path)
+        if taskname in ('detection', 'recognition') and taskname not in model_file_paths:
+            model_file_paths[taskname] = model_file_path
+    # Names of quantized copies are made from the models, so the face swapper model is downloaded before it is loaded.
+    download(configuration.face_swapper_model_file_url, configuration.face_swapper_model_file_path)
+    model_file_paths['swapper'] = configuration.face_swapper_model_file_path
+    return model_file_paths
+
+def calibrate_models(configuration : Configuration) -> None:
+    # Inputs of FP32 models are recorded while they process sample frames of the input file,
+    # then statically quantized models are made from them for the stages which have none yet.
+    model_file_paths = get_model_file_paths(configuration)
+    stages = [stage for stage in configuration.quantized_stages if not get_quantized_model_file_path(model_file_paths[stage], configuration).exists()]
+    if not stages:
+        return
+
+    if not configuration.input_file:
+        log.warning(f'Statically quantized models of stages {stages} are calibrated on frames of an input file, FP32 models are used')
+        return
+
+    frames = read_sample_frames(configuration.input_file, configuration.quantization_frame_count)
+
+    fp32_configuration = copy.copy(configuration)
+    fp32_configuration.quantized_stages = []
+    face_processor = create_face_processor(fp32_configuration)
+    source_face = face_processor.find_source_face()
+    if isinstance(source_face, list):
+        source_face = source_face[0] if source_face else None
+
+    face_analyser = face_processor.face_analyser
+    face_swapper = face_processor.face_swapper
+    models = {
+        'detection': face_analyser.detection_model,
+        'recognition': face_analyser.models.get('recognition'),
+        'swapper': face_swapper.face_swapper
+    }
+    for stage in stages:
+        models[stage].session = RecordingSession(models[stage].session)
+
+    for frame in tqdm(frames, desc = 'Calibrating models', unit = 'frames'):
+        faces = face_analyser.analyze_frame(frame).faces
+        if source_face and faces:
+            face_swapper.swap_faces(source_face, [(face, frame) for face in faces])
+
+    for stage in stages:
+        input_feeds = models[stage].session.input_feeds
+        if not input_feeds:
+            log.warning(f'Sample frames gave no calibration inputs for stage {stage}, FP32 model is used')
+            continue
+        quantize_model_statically(model_file_paths[stage], get_quantized_model_file_path(model_file_paths[stage], configuration), input_feeds, configuration.input_file)
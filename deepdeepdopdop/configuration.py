@@ -2,33 +2,161 @@ import logging as log
 
 import os
 import argparse
-import onnxruntime
 
 from pathlib import Path
+from typing import Optional
 
 from .utils import is_image, is_video
 
+# Encoder settings bundled for previews and final renders, explicit settings take precedence over them.
+ENCODE_PRESETS : dict[str, dict] = {
+    'fast': { 'video_codec': 'libx264', 'video_preset': 'veryfast', 'video_crf': 28 },
+    'quality': { 'video_codec': 'libx264', 'video_preset': 'slow', 'video_crf': 18 }
+}
+
+def parse_resolution(value : str) -> tuple[int, int]:
+    # A resolution like 1280x720.
+    try:
+        width, height = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{value} is not a resolution like 1280x720')
+    return width, height
+
 class Configuration:
     def __init__(self):
         self.source_face_image_file : Path = None
         self.input_file : Path = None
         self.output_file : Path = None
 
+        # A directory, a glob pattern or a manifest file with a path per line of many input files processed by one process.
+        self.batch_input : str = None
+        self.output_directory : Path = None
+        self.batch_workers : int = 4
+        self.batch_report_file : Path = None
+
+        # Models are loaded once and jobs are taken over a local HTTP API on a TCP port or a Unix socket.
+        self.serve : bool = False
+        self.server_host : str = '127.0.0.1'
+        self.server_port : int = 8765
+        self.server_socket : Path = None
+        self.server_workers : int = 1
+        self.server_queue_size : int = 64
+
+        # Benchmark on synthetic images and videos.
+        self.benchmark : bool = False
+        self.benchmark_models : str = 'stand-in'
+        self.benchmark_directory : Path = Path('./benchmark')
+        self.benchmark_resolutions : list[tuple[int, int]] = [(640, 360), (1280, 720), (1920, 1080)]
+        self.benchmark_face_counts : list[int] = [1, 4]
+        self.benchmark_frame_count : int = 60
+        self.benchmark_report_file : Path = None
+
+        # A live stream is read from stdin, a pipe, a device or a URL and written to stdout, a pipe or a URL,
+        # frames are dropped and processing is degraded to keep the latency within the budget.
+        self.stream_input : str = None
+        self.stream_input_format : str = None
+        self.stream_output : str = '-'
+        self.stream_output_format : str = 'rawvideo'
+        self.stream_frame_size : tuple[int, int] = None
+        self.stream_fps : float = None
+        self.stream_pixel_format : str = 'bgr24'
+        self.stream_latency_budget : int = 100
+        self.stream_queue_size : int = 2
+
+        # Pairs of source and reference face image files, every reference face is swapped with the source face of its pair.
+        self.face_mappings : list[tuple[Path, Path]] = []
+
         self.restore_face : bool = False
         self.process_every_face : bool = False
         self.process_video_in_memory : bool = False
+        self.process_video_in_pipeline : bool = False
+        self.pipeline_queue_size : int = 8
+        self.video_writer : str = 'av'
+        self.video_reader : str = 'opencv'
+        self.video_decoder_threads : int = 0
+        self.video_segments : int = 1
+        self.segment_codec : str = 'libx264'
+        self.smart_render : bool = False
+        self.smart_render_interval : int = 5
+
+        # The codec of the input video is used if the video codec is not set.
+        self.encode_preset : str = None
+        self.video_codec : str = None
+        self.video_preset : str = None
+        self.video_crf : int = None
+        self.video_bitrate : int = None
+        self.video_encoder_threads : int = 0
+        self.video_gop : int = None
+        self.video_pixel_format : str = 'yuv420p'
+
+        self.frame_store_window_size : int = 64
+        self.frame_store_directory : Path = None
 
         self.reference_face_position : int = 0
         self.reference_frame_time : int = 0
 
         self.similar_face_distance : float = 0.85
 
-        self.execution_provider : str = None
-        self.gfpgan_device : str = None
+        self.inference_batch_size : int = 4
+
+        # The swapping needs only detection keypoints and recognition embeddings,
+        # the other insightface models of buffalo_l are loaded only when requested.
+        self.face_attributes : bool = False
+        self.face_analyser_model_name : str = 'buffalo_l'
+        self.face_analyser_modules : list[str] = ['detection', 'recognition']
+        self.face_detection_threshold : float = 0.5
+        self.face_detection_size : tuple[int, int] = (640, 640)
+        self.face_analyser_model_directory : Path = None
+
+        self.analysis_cache : bool = False
+        self.analysis_cache_directory : Path = None
+
+        self.detection_interval : int = 1
+        self.tracking_min_confidence : float = 0.8
+        self.tracking_iou_threshold : float = 0.5
+
+        self.reuse_static_frames : bool = False
+        self.static_frame_threshold : float = 2.0
+
+        # Stage latencies, faces per frame, queue depths and peak RSS are written at the end of the run.
+        self.metrics_file : Path = None
+        self.prometheus_file : Path = None
+        self.profile_file : Path = None
+
+        self.requested_execution_provider : str = None
+        self.__execution_provider : str = None
+
+        # Options of sessions of all models, thread counts of the session tuning file are used if they are not set,
+        # 0 threads means the default of ONNX Runtime.
+        self.intra_op_threads : int = None
+        self.inter_op_threads : int = None
+        self.execution_mode : str = 'sequential'
+        self.graph_optimization_level : str = 'all'
+        self.cpu_memory_arena : bool = True
+        self.memory_pattern : bool = True
+        self.thread_spinning : bool = True
+        self.io_binding : bool = False
+        self.tune_sessions : bool = False
+        self.session_tuning_file : Path = None
+
+        # Models of the given stages run quantized to INT8, quantized models are stored next to the face swapper model,
+        # static quantization is calibrated on frames of the input file.
+        self.quantized_stages : list[str] = []
+        self.quantization_mode : str = 'dynamic'
+        self.quantization_frame_count : int = 16
+        self.quantization_report_file : Path = None
 
         self.face_swapper_model_file_url : str = 'https://github.com/facefusion/facefusion-assets/releases/download/models/inswapper_128.onnx'
         self.face_swapper_model_file_path : Path = Path('./model/inswapper_128.onnx')
 
+        # Source faces and optimized models are cached there between runs.
+        self.cache_directory : Path = Path('./cache')
+
+        # The ONNX engine aligns faces by the known keypoints, the GFPGAN engine detects them again by PyTorch.
+        self.face_restorer_engine : str = 'onnx'
+        self.face_restorer_onnx_model_file_url : str = 'https://github.com/facefusion/facefusion-assets/releases/download/models/gfpgan_1.4.onnx'
+        self.face_restorer_onnx_model_file_path : Path = Path('./model/gfpgan_1.4.onnx')
+
         self.face_restorer_model_file_url : str = 'https://github.com/facefusion/facefusion-assets/releases/download/models/GFPGANv1.4.pth'
         self.face_restorer_model_file_path : Path = Path('./model/GFPGANv1.4.pth')
 
@@ -45,77 +173,424 @@ class Configuration:
         self.log_level = log.DEBUG
         self.log_format : str = '%(asctime)s   %(levelname)s   %(message)s'
 
-    def parse_command_line(self) -> bool:
-        log.info('Parse command line')
-
+    @staticmethod
+    def create_argument_parser() -> argparse.ArgumentParser:
         parser = argparse.ArgumentParser(
             prog = 'deepdeepdobdob',
             description = 'Deepfake tool.',
             formatter_class = lambda prog : argparse.HelpFormatter(prog, max_help_position = 100)
         )
 
-        parser.add_argument('--source-face-image-file', help = 'a path to an image file with a source face', dest = 'source_face_image_file', type = Path, required = True)
-        parser.add_argument('--input-file', help = 'a peth to an input image or video file to process', dest = 'input_file', type = Path, required = True)
+        parser.add_argument('--source-face-image-file', help = 'a path to an image file with a source face', dest = 'source_face_image_file', type = Path)
+        parser.add_argument('--input-file', help = 'a peth to an input image or video file to process', dest = 'input_file', type = Path)
+        parser.add_argument('--batch', help = 'a directory, a glob pattern or a manifest file with a path per line of input files processed with models loaded once', dest = 'batch_input')
+        parser.add_argument('--output-directory', help = 'a path to a directory for output files of batch, the directory of every input file by default', dest = 'output_directory', type = Path)
+        parser.add_argument('--batch-workers', help = 'the number of images of batch processed at the same time', dest = 'batch_workers', type = int, default = 4)
+        parser.add_argument('--batch-report-file', help = 'a path to a JSON file with the result of every file of batch', dest = 'batch_report_file', type = Path)
+        parser.add_argument('--serve', help = 'load models once and process jobs taken over a local HTTP API', dest = 'serve', action = 'store_true')
+        parser.add_argument('--server-host', help = 'a host of the server', dest = 'server_host', default = '127.0.0.1')
+        parser.add_argument('--server-port', help = 'a port of the server', dest = 'server_port', type = int, default = 8765)
+        parser.add_argument('--server-socket', help = 'a path to a Unix socket of the server instead of the host and the port', dest = 'server_socket', type = Path)
+        parser.add_argument('--server-workers', help = 'the number of jobs processed at the same time', dest = 'server_workers', type = int, default = 1)
+        parser.add_argument('--server-queue-size', help = 'the maximum number of queued jobs', dest = 'server_queue_size', type = int, default = 64)
+        parser.add_argument('--benchmark', help = 'measure fps, stage latencies and peak memory on synthetic images and videos instead of processing input files', dest = 'benchmark', action = 'store_true')
+        parser.add_argument('--benchmark-models', help = 'models of benchmark, stand-in models have the same inputs and outputs as real ones and run offline', dest = 'benchmark_models', default = 'stand-in', choices = ['stand-in', 'real'])
+        parser.add_argument('--benchmark-directory', help = 'a path to a directory for synthetic files, stand-in models and outputs of benchmark', dest = 'benchmark_directory', type = Path, default = Path('./benchmark'))
+        parser.add_argument('--benchmark-resolutions', help = 'resolutions of synthetic files like 1280x720', dest = 'benchmark_resolutions', type = parse_resolution, nargs = '+', default = [(640, 360), (1280, 720), (1920, 1080)])
+        parser.add_argument('--benchmark-face-counts', help = 'numbers of faces in synthetic files', dest = 'benchmark_face_counts', type = int, nargs = '+', default = [1, 4])
+        parser.add_argument('--benchmark-frame-count', help = 'the number of frames of synthetic videos and of repetitions of every stage', dest = 'benchmark_frame_count', type = int, default = 60)
+        parser.add_argument('--benchmark-report-file', help = 'a path to a JSON file with results of benchmark', dest = 'benchmark_report_file', type = Path)
+        parser.add_argument('--stream-input', help = 'a live stream to process instead of an input file, - for raw or encoded frames from stdin, a path to a pipe or a device, or a URL', dest = 'stream_input')
+        parser.add_argument('--stream-input-format', help = 'a format of the input stream like rawvideo, nut, mpegts or v4l2, it is probed by default', dest = 'stream_input_format')
+        parser.add_argument('--stream-output', help = 'an output stream, - for stdout, a path to a pipe or a URL', dest = 'stream_output', default = '-')
+        parser.add_argument('--stream-output-format', help = 'a format of the output stream, rawvideo writes raw frames, other formats are encoded by the video codec', dest = 'stream_output_format', default = 'rawvideo')
+        parser.add_argument('--stream-frame-size', help = 'a frame size of raw input stream like 1280x720', dest = 'stream_frame_size', type = parse_resolution)
+        parser.add_argument('--stream-fps', help = 'a frame rate of the stream, the rate of the input stream by default', dest = 'stream_fps', type = float)
+        parser.add_argument('--stream-pixel-format', help = 'a pixel format of raw input and output frames', dest = 'stream_pixel_format', default = 'bgr24')
+        parser.add_argument('--stream-latency-budget', help = 'the target latency of a frame from reading to writing in milliseconds', dest = 'stream_latency_budget', type = int, default = 100)
+        parser.add_argument('--stream-queue-size', help = 'the number of input frames waiting for processing, older frames are dropped', dest = 'stream_queue_size', type = int, default = 2)
+        parser.add_argument('--face-mapping', help = 'a pair of source and reference face image files, it may be repeated to swap several faces in one pass instead of the source face and the reference face position', dest = 'face_mappings', nargs = 2, metavar = ('SOURCE_FACE_IMAGE_FILE', 'REFERENCE_FACE_IMAGE_FILE'), type = Path, action = 'append')
         parser.add_argument('--output-file', help = 'a path to an output file', dest = 'output_file', type = Path)
 
         parser.add_argument('--restore-face', help = 'restore face after swapping', dest = 'restore_face', action = 'store_true')
+        parser.add_argument('--face-restorer-engine', help = 'a face restorer engine, ONNX runs GFPGAN on faces aligned by the known keypoints, GFPGAN runs it by PyTorch', dest = 'face_restorer_engine', default = 'onnx', choices = ['onnx', 'gfpgan'])
+        parser.add_argument('--face-attributes', help = 'estimate gender and age of faces', dest = 'face_attributes', action = 'store_true')
         parser.add_argument('--process-every-face', help = 'process every face', dest = 'process_every_face', action = 'store_true')
         parser.add_argument('--process-video-in-memory', help = 'process video in memory', dest = 'process_video_in_memory', action = 'store_true')
+        parser.add_argument('--process-video-in-pipeline', help = 'decode, analyse, process and encode video frames on separate threads', dest = 'process_video_in_pipeline', action = 'store_true')
+        parser.add_argument('--video-reader', help = 'a video reader, PyAV decodes video in multiple threads and hands frames off without copying', dest = 'video_reader', default = 'opencv', choices = ['opencv', 'av'])
+        parser.add_argument('--video-decoder-threads', help = 'a number of threads of PyAV video decoder, 0 means auto', dest = 'video_decoder_threads', default = 0, type = int)
+        parser.add_argument('--video-writer', help = 'a video writer, PyAV writes video with audio in a single pass, OpenCV writes video without audio which is mixed in afterwards', dest = 'video_writer', default = 'av', choices = ['av', 'opencv'])
+        parser.add_argument('--encode-preset', help = 'bundled encoder settings, fast for previews and quality for final renders', dest = 'encode_preset', choices = list(ENCODE_PRESETS.keys()))
+        parser.add_argument('--video-codec', help = 'a video encoder name, the codec of the input video by default', dest = 'video_codec')
+        parser.add_argument('--video-preset', help = 'a video encoder preset like ultrafast, veryfast, medium or slow', dest = 'video_preset')
+        parser.add_argument('--video-crf', help = 'a constant rate factor of video encoder', dest = 'video_crf', type = int)
+        parser.add_argument('--video-bitrate', help = 'a video bitrate in kbit/s instead of constant rate factor', dest = 'video_bitrate', type = int)
+        parser.add_argument('--video-encoder-threads', help = 'a number of threads of video encoder, 0 means auto', dest = 'video_encoder_threads', type = int, default = 0)
+        parser.add_argument('--video-gop', help = 'a maximum number of frames between keyframes', dest = 'video_gop', type = int)
+        parser.add_argument('--video-pixel-format', help = 'a pixel format of encoded video', dest = 'video_pixel_format', default = 'yuv420p')
+        parser.add_argument('--video-segments', help = 'the number of video segments rendered in parallel processes', dest = 'video_segments', type = int, default = 1)
+        parser.add_argument('--smart-render', help = 'render only GOPs of video with target faces and copy the others from the input without re-encoding', dest = 'smart_render', action = 'store_true')
+        parser.add_argument('--smart-render-interval', help = 'check presence of target faces in every Nth video frame before smart render', dest = 'smart_render_interval', type = int, default = 5)
+        parser.add_argument('--frame-store-window-size', help = 'the number of frames kept in RAM when video is processed in memory', dest = 'frame_store_window_size', type = int, default = 64)
+        parser.add_argument('--frame-store-directory', help = 'a path to a directory for frames spilled to disk when video is processed in memory', dest = 'frame_store_directory', type = Path)
+        parser.add_argument('--pipeline-queue-size', help = 'the number of frames buffered between pipeline stages', dest = 'pipeline_queue_size', type = int, default = 8)
 
         parser.add_argument('--reference-face-position', help = 'the position of the reference face', dest = 'reference_face_position', type = int, default = 0)
         parser.add_argument('--reference-frame-time', help = 'the time of the reference frame in milliseconds', dest = 'reference_frame_time', type = int, default = -1)
         parser.add_argument('--similar-face-distance', help = 'a face distance used for recognition', dest = 'similar_face_distance', type = float, default = 0.85)
+        parser.add_argument('--detection-interval', help = 'detect faces in every Nth video frame and track them in between', dest = 'detection_interval', type = int, default = 1)
+        parser.add_argument('--tracking-min-confidence', help = 'a face tracking confidence below which faces are detected again', dest = 'tracking_min_confidence', type = float, default = 0.8)
+        parser.add_argument('--tracking-iou-threshold', help = 'the minimum overlap of a detected face with a tracked face to keep the recognition of the tracked face', dest = 'tracking_iou_threshold', type = float, default = 0.5)
+        parser.add_argument('--reuse-static-frames', help = 'reuse the analysis and the output of the previous changed video frame for frames which do not differ from it', dest = 'reuse_static_frames', action = 'store_true')
+        parser.add_argument('--static-frame-threshold', help = 'the maximum difference of mean brightness of blocks of a static video frame from the previous changed frame', dest = 'static_frame_threshold', type = float, default = 2.0)
+        parser.add_argument('--analysis-cache', help = 'store face analysis of video next to it and reuse it in later runs', dest = 'analysis_cache', action = 'store_true')
+        parser.add_argument('--analysis-cache-directory', help = 'a path to a directory for the face analysis cache instead of the input file directory', dest = 'analysis_cache_directory', type = Path)
+        parser.add_argument('--cache-directory', help = 'a path to a directory for cached source faces and optimized models', dest = 'cache_directory', type = Path, default = Path('./cache'))
+        parser.add_argument('--inference-batch-size', help = 'the number of faces swapped or recognized by one model call', dest = 'inference_batch_size', type = int, default = 4)
         
-        execution_providers = onnxruntime.get_available_providers();
-        default_execution_provider = 'CUDAExecutionProvider' if 'CUDAExecutionProvider' in execution_providers else 'CPUExecutionProvider'
+        parser.add_argument('--metrics-file', help = 'a path to a JSON file with stage latencies, faces per frame, queue depths and peak RSS', dest = 'metrics_file', type = Path)
+        parser.add_argument('--prometheus-file', help = 'a path to a Prometheus textfile with the same metrics', dest = 'prometheus_file', type = Path)
+        parser.add_argument('--profile', help = 'profile processing of the main thread by cProfile and write statistics to a file', dest = 'profile_file', type = Path, nargs = '?', const = Path('./deepdeepdopdop.prof'))
+
+        # Available providers are known only after importing onnxruntime, that is deferred until the first model is loaded.
+        parser.add_argument('--execution-provider', help = 'ONNX runtime execution provider, CUDA if it is available by default', dest = 'execution_provider')
+        parser.add_argument('--intra-op-threads', help = 'the number of threads running an operator of a model, 0 means the default of ONNX Runtime, the tuned number by default', dest = 'intra_op_threads', type = int)
+        parser.add_argument('--inter-op-threads', help = 'the number of threads running operators of a model in parallel execution mode, 0 means the default of ONNX Runtime', dest = 'inter_op_threads', type = int)
+        parser.add_argument('--execution-mode', help = 'an execution mode of models, parallel runs independent operators at the same time', dest = 'execution_mode', default = 'sequential', choices = ['sequential', 'parallel'])
+        parser.add_argument('--graph-optimization-level', help = 'a graph optimization level of models, optimized models are cached', dest = 'graph_optimization_level', default = 'all', choices = ['disable', 'basic', 'extended', 'all'])
+        parser.add_argument('--disable-cpu-memory-arena', help = 'allocate tensors on CPU without the memory arena, which keeps memory it has once allocated', dest = 'cpu_memory_arena', action = 'store_false')
+        parser.add_argument('--disable-memory-pattern', help = 'do not preallocate memory by the pattern of the previous run of a model', dest = 'memory_pattern', action = 'store_false')
+        parser.add_argument('--disable-thread-spinning', help = 'let idle threads of models sleep instead of spinning, which frees CPU for other jobs of the host', dest = 'thread_spinning', action = 'store_false')
+        parser.add_argument('--io-binding', help = 'run models with inputs and outputs bound to buffers reused between runs', dest = 'io_binding', action = 'store_true')
+        parser.add_argument('--tune-sessions', help = 'measure models with different thread counts and write the fastest ones for this host to the session tuning file', dest = 'tune_sessions', action = 'store_true')
+        parser.add_argument('--quantize', help = 'run models of the given stages quantized to INT8', dest = 'quantized_stages', nargs = '+', default = [], choices = ['detection', 'recognition', 'swapper'])
+        parser.add_argument('--quantization-mode', help = 'a quantization mode, dynamic quantizes weights only, static quantizes activations too by calibration on frames of the input file', dest = 'quantization_mode', default = 'dynamic', choices = ['dynamic', 'static'])
+        parser.add_argument('--quantization-frame-count', help = 'the number of frames of the input file for calibration and the quantization report', dest = 'quantization_frame_count', type = int, default = 16)
+        parser.add_argument('--quantization-report-file', help = 'compare quantized models with FP32 ones on frames of the input file and write a JSON report instead of processing it', dest = 'quantization_report_file', type = Path)
+        parser.add_argument('--session-tuning-file', help = 'a path to a JSON file with tuned thread counts, session-tuning.json in the cache directory by default', dest = 'session_tuning_file', type = Path)
 
-        parser.add_argument('--execution-provider', help = 'ONNX runtime execution provider', dest = 'execution_provider', default = default_execution_provider, choices = execution_providers)
+        return parser
 
-        args = parser.parse_args()
+    def parse_command_line(self) -> bool:
+        log.info('Parse command line')
+
+        args = self.create_argument_parser().parse_args()
 
         self.source_face_image_file = args.source_face_image_file
         self.input_file = args.input_file
         self.output_file = args.output_file
+        self.batch_input = args.batch_input
+        self.output_directory = args.output_directory
+        self.batch_workers = args.batch_workers
+        self.batch_report_file = args.batch_report_file
+        self.serve = args.serve
+        self.server_host = args.server_host
+        self.server_port = args.server_port
+        self.server_socket = args.server_socket
+        self.server_workers = args.server_workers
+        self.server_queue_size = args.server_queue_size
+        self.benchmark = args.benchmark
+        self.benchmark_models = args.benchmark_models
+        self.benchmark_directory = args.benchmark_directory
+        self.benchmark_resolutions = args.benchmark_resolutions
+        self.benchmark_face_counts = args.benchmark_face_counts
+        self.benchmark_frame_count = args.benchmark_frame_count
+        self.benchmark_report_file = args.benchmark_report_file
+        self.stream_input = args.stream_input
+        self.stream_input_format = args.stream_input_format
+        self.stream_output = args.stream_output
+        self.stream_output_format = args.stream_output_format
+        self.stream_frame_size = args.stream_frame_size
+        self.stream_fps = args.stream_fps
+        self.stream_pixel_format = args.stream_pixel_format
+        self.stream_latency_budget = args.stream_latency_budget
+        self.stream_queue_size = args.stream_queue_size
+        self.face_mappings = [tuple(face_mapping) for face_mapping in args.face_mappings or []]
         self.restore_face = args.restore_face
+        self.face_restorer_engine = args.face_restorer_engine
+        self.face_attributes = args.face_attributes
         self.process_every_face = args.process_every_face
         self.process_video_in_memory = args.process_video_in_memory
+        self.process_video_in_pipeline = args.process_video_in_pipeline
+        self.pipeline_queue_size = args.pipeline_queue_size
+        self.video_writer = args.video_writer
+        self.video_reader = args.video_reader
+        self.video_decoder_threads = args.video_decoder_threads
+        self.encode_preset = args.encode_preset
+        self.video_codec = args.video_codec
+        self.video_preset = args.video_preset
+        self.video_crf = args.video_crf
+        self.video_bitrate = args.video_bitrate
+        self.video_encoder_threads = args.video_encoder_threads
+        self.video_gop = args.video_gop
+        self.video_pixel_format = args.video_pixel_format
+        self.video_segments = args.video_segments
+        self.smart_render = args.smart_render
+        self.smart_render_interval = args.smart_render_interval
+        self.frame_store_window_size = args.frame_store_window_size
+        self.frame_store_directory = args.frame_store_directory
         self.reference_face_position = args.reference_face_position
         self.reference_frame_time = args.reference_frame_time
         self.similar_face_distance = args.similar_face_distance
-        self.execution_provider = args.execution_provider
+        self.detection_interval = args.detection_interval
+        self.tracking_min_confidence = args.tracking_min_confidence
+        self.tracking_iou_threshold = args.tracking_iou_threshold
+        self.reuse_static_frames = args.reuse_static_frames
+        self.static_frame_threshold = args.static_frame_threshold
+        self.analysis_cache = args.analysis_cache or args.analysis_cache_directory is not None
+        self.analysis_cache_directory = args.analysis_cache_directory
+        self.cache_directory = args.cache_directory
+        self.inference_batch_size = args.inference_batch_size
+        self.metrics_file = args.metrics_file
+        self.prometheus_file = args.prometheus_file
+        self.profile_file = args.profile_file
+        self.requested_execution_provider = args.execution_provider
+        self.intra_op_threads = args.intra_op_threads
+        self.inter_op_threads = args.inter_op_threads
+        self.execution_mode = args.execution_mode
+        self.graph_optimization_level = args.graph_optimization_level
+        self.cpu_memory_arena = args.cpu_memory_arena
+        self.memory_pattern = args.memory_pattern
+        self.thread_spinning = args.thread_spinning
+        self.io_binding = args.io_binding
+        self.tune_sessions = args.tune_sessions
+        self.session_tuning_file = args.session_tuning_file or self.cache_directory / 'session-tuning.json'
+        self.quantized_stages = args.quantized_stages
+        self.quantization_mode = args.quantization_mode
+        self.quantization_frame_count = args.quantization_frame_count
+        self.quantization_report_file = args.quantization_report_file
+
+        if not self.output_file and self.input_file:
+            self.output_file = self.get_default_output_file(self.input_file)
+
+        if self.encode_preset:
+            for name, value in ENCODE_PRESETS[self.encode_preset].items():
+                if getattr(self, name) is None:
+                    setattr(self, name, value)
 
-        if not self.output_file:
-            postfix = 'swapped-restored' if self.restore_face else 'swapped'
-            self.output_file = self.input_file.with_stem(f'{video_input_file_path.stem}-{postfix}')
+        if self.face_attributes:
+            self.face_analyser_modules = self.face_analyser_modules + ['genderage']
 
-        self.gfpgan_device = 'cpu'
+        return self.validate();
+
+    def get_default_output_file(self, input_file : Path, output_directory : Optional[Path] = None) -> Path:
+        postfix = 'swapped-restored' if self.restore_face else 'swapped'
+        return (output_directory or input_file.parent) / f'{input_file.stem}-{postfix}{input_file.suffix}'
+
+    @property
+    def execution_provider(self) -> str:
+        if self.__execution_provider is None:
+            import onnxruntime
+
+            execution_providers = onnxruntime.get_available_providers()
+            default_execution_provider = 'CUDAExecutionProvider' if 'CUDAExecutionProvider' in execution_providers else 'CPUExecutionProvider'
+
+            if self.requested_execution_provider and self.requested_execution_provider not in execution_providers:
+                log.warning(f'Execution provider {self.requested_execution_provider} is not available, use {default_execution_provider} instead of it, available providers are {execution_providers}')
+                self.__execution_provider = default_execution_provider
+            else:
+                self.__execution_provider = self.requested_execution_provider or default_execution_provider
+
+        return self.__execution_provider
+
+    @property
+    def video_encoder_options(self) -> dict[str, str]:
+        # Private options of the encoder, the bitrate takes precedence over the constant rate factor.
+        options : dict[str, str] = {}
+        if self.video_preset:
+            options['preset'] = self.video_preset
+        if self.video_crf is not None and self.video_bitrate is None:
+            options['crf'] = str(self.video_crf)
+        return options
+
+    @property
+    def quantization_key(self) -> Optional[list]:
+        # Quantized models change faces and latents, so caches made by them are kept apart.
+        if self.quantized_stages:
+            return [sorted(self.quantized_stages), self.quantization_mode]
+        return None
+
+    @property
+    def gfpgan_device(self) -> str:
         if 'CUDAExecutionProvider' == self.execution_provider:
-            self.gfpgan_device = 'cuda'
+            return 'cuda'
         elif 'CoreMLExecutionProvider' == self.execution_provider:
-            self.gfpgan_device = 'mps'
-
-        return self.__validate();
+            return 'mps'
+        return 'cpu'
 
-    def __validate(self) -> bool:
+    def validate(self) -> bool:
         log.info('Validate configuration')
 
-        if not self.source_face_image_file.exists():
-            log.error(f'Source face image file {self.source_face_image_file} does not exist')
+        if not self.source_face_image_file and not self.face_mappings and not self.serve and not self.benchmark and not self.tune_sessions:
+            log.error('Source face image file or face mappings must be set')
+            return False
+
+        face_image_files = [self.source_face_image_file] if self.source_face_image_file else []
+        face_image_files += [face_image_file for face_mapping in self.face_mappings for face_image_file in face_mapping]
+
+        for face_image_file in face_image_files:
+            if not face_image_file.exists():
+                log.error(f'Face image file {face_image_file} does not exist')
+                return False
+
+            if not is_image(face_image_file):
+                log.error(f'Face image file {face_image_file} is not image')
+                return False
+
+        if not self.input_file and not self.batch_input and not self.serve and not self.benchmark and not self.stream_input and not self.tune_sessions:
+            log.error('Input file, batch, server, benchmark, stream input or session tuning must be set')
             return False
 
-        if not is_image(self.source_face_image_file):
-            log.error(f'Source face image file {self.source_face_image_file} is not image')
+        if self.input_file and self.batch_input:
+            log.error('Input file and batch must not be set together')
             return False
 
-        if not self.input_file.exists():
+        if self.input_file and not self.input_file.exists():
             log.error(f'Input file {self.input_file} does not exist')
             return False
 
-        if not is_image(self.input_file) and not is_video(self.input_file):
+        if self.input_file and not is_image(self.input_file) and not is_video(self.input_file):
             log.error(f'Input file {self.input_file} is not image or video')
             return False
 
-        if self.output_file.exists():
+        if self.serve and (self.input_file or self.batch_input):
+            log.error('Server takes input files from jobs, input file and batch must not be set')
+            return False
+
+        if self.benchmark and (self.input_file or self.batch_input or self.serve):
+            log.error('Benchmark makes its own input files, input file, batch and server must not be set')
+            return False
+
+        if self.benchmark and (min(self.benchmark_face_counts) < 1 or self.benchmark_frame_count < 1):
+            log.error(f'Benchmark face counts {self.benchmark_face_counts} and frame count {self.benchmark_frame_count} must be positive')
+            return False
+
+        # Synthetic videos are encoded in yuv420p, which has chroma planes of half the size.
+        if self.benchmark and any(width < 2 or height < 2 or width % 2 or height % 2 for width, height in self.benchmark_resolutions):
+            log.error(f'Benchmark resolutions {self.benchmark_resolutions} must have positive even widths and heights')
+            return False
+
+        if self.stream_input and (self.input_file or self.batch_input or self.serve or self.benchmark):
+            log.error('Stream input must not be set together with input file, batch, server or benchmark')
+            return False
+
+        if self.stream_input and self.reference_frame_time >= 0:
+            log.error('Stream has no reference frame, the reference face is found in every frame of it')
+            return False
+
+        if self.stream_input and self.stream_input_format == 'rawvideo' and (not self.stream_frame_size or not self.stream_fps):
+            log.error('Frame size and fps of raw input stream must be set')
+            return False
+
+        if self.stream_fps is not None and self.stream_fps <= 0:
+            log.error(f'Stream fps {self.stream_fps} must be positive')
+            return False
+
+        if self.stream_latency_budget < 1:
+            log.error(f'Stream latency budget {self.stream_latency_budget} must be positive')
+            return False
+
+        if self.stream_queue_size < 1:
+            log.error(f'Stream queue size {self.stream_queue_size} must be positive')
+            return False
+
+        if self.tune_sessions and (self.input_file or self.batch_input or self.serve or self.benchmark or self.stream_input):
+            log.error('Session tuning processes no files, input file, batch, server, benchmark and stream input must not be set')
+            return False
+
+        if any(threads is not None and threads < 0 for threads in (self.intra_op_threads, self.inter_op_threads)):
+            log.error(f'Intra-op threads {self.intra_op_threads} and inter-op threads {self.inter_op_threads} must not be negative')
+            return False
+
+        if self.quantization_frame_count < 1:
+            log.error(f'Quantization frame count {self.quantization_frame_count} must be positive')
+            return False
+
+        if self.quantization_report_file and (not self.input_file or not self.quantized_stages):
+            log.error('Quantization report compares quantized models on frames of the input file, input file and quantized stages must be set')
+            return False
+
+        if self.server_workers < 1:
+            log.error(f'The number of server workers {self.server_workers} must be positive')
+            return False
+
+        if self.server_queue_size < 1:
+            log.error(f'Server queue size {self.server_queue_size} must be positive')
+            return False
+
+        if self.batch_workers < 1:
+            log.error(f'The number of batch workers {self.batch_workers} must be positive')
+            return False
+
+        if self.pipeline_queue_size < 1:
+            log.error(f'Pipeline queue size {self.pipeline_queue_size} must be positive')
+            return False
+
+        if self.detection_interval < 1:
+            log.error(f'Detection interval {self.detection_interval} must be positive')
+            return False
+
+        if self.tracking_iou_threshold <= 0 or self.tracking_iou_threshold > 1:
+            log.error(f'Tracking IoU threshold {self.tracking_iou_threshold} must be greater than 0 and not greater than 1')
+            return False
+
+        if self.static_frame_threshold < 0:
+            log.error(f'Static frame threshold {self.static_frame_threshold} must not be negative')
+            return False
+
+        if self.analysis_cache_directory and not self.analysis_cache_directory.is_dir():
+            log.error(f'Analysis cache directory {self.analysis_cache_directory} does not exist')
+            return False
+
+        if self.inference_batch_size < 1:
+            log.error(f'Inference batch size {self.inference_batch_size} must be positive')
+            return False
+
+        if self.video_decoder_threads < 0:
+            log.error(f'The number of video decoder threads {self.video_decoder_threads} must not be negative')
+            return False
+
+        if self.video_encoder_threads < 0:
+            log.error(f'The number of video encoder threads {self.video_encoder_threads} must not be negative')
+            return False
+
+        if self.video_bitrate is not None and self.video_bitrate < 1:
+            log.error(f'Video bitrate {self.video_bitrate} must be positive')
+            return False
+
+        if self.video_gop is not None and self.video_gop < 1:
+            log.error(f'Video GOP size {self.video_gop} must be positive')
+            return False
+
+        if self.video_writer == 'opencv' and (self.video_codec or self.video_preset or self.video_crf is not None or self.video_bitrate is not None or self.video_gop is not None):
+            log.warning('Encoder settings are applied only by PyAV video writer')
+
+        if self.video_segments < 1:
+            log.error(f'The number of video segments {self.video_segments} must be positive')
+            return False
+
+        if self.smart_render and self.video_segments > 1:
+            log.error('Smart render and video segments must not be set together')
+            return False
+
+        if self.smart_render and self.video_writer != 'av':
+            log.error('Smart render writes video by PyAV video writer only')
+            return False
+
+        if self.smart_render_interval < 1:
+            log.error(f'Smart render interval {self.smart_render_interval} must be positive')
+            return False
+
+        if self.frame_store_window_size < 0:
+            log.error(f'Frame store window size {self.frame_store_window_size} must not be negative')
+            return False
+
+        if self.frame_store_directory and not self.frame_store_directory.is_dir():
+            log.error(f'Frame store directory {self.frame_store_directory} does not exist')
+            return False
+
+        if self.output_file and self.output_file.exists():
             log.error(f'Output file {self.output_file} already exists')
             return False
 
@@ -2,92 +2,216 @@ import logging as log
 
 import numpy
 
-import insightface
 import warnings
 warnings.filterwarnings('ignore', category = FutureWarning, module = 'insightface')
 
+from pathlib import Path
 from typing import Optional, List
 
 from .configuration import Configuration
-from .types import Frame, Face
-from .imageio import read_image
+from .types import Frame, Face, create_face
+from .imageio import read_image, write_image
+from .facematcher import FaceMatcher
+from .sessions import get_model_taskname, has_dynamic_batch, load_model
+from .quantization import get_session_model_file_path
 from .videoio import VideoReader
+from .videoio import AVVideoReader
+from .metrics import metrics
+
+def describe_face(face : Face) -> str:
+    description = f'det_score={face.det_score}, bbox={face.bbox}'
+    # Gender and age are only known when the face attributes model is loaded.
+    if face.gender is not None:
+        description += f', gender={face.gender}, age={face.age}'
+    return description
+
+def get_face_analyser_model_directory(configuration : Configuration) -> Path:
+    if configuration.face_analyser_model_directory is None:
+        from insightface.utils.storage import ensure_available
+
+        return Path(ensure_available('models', configuration.face_analyser_model_name, root = '~/.insightface'))
+    return configuration.face_analyser_model_directory
+
+class FrameAnalysis:
+    def __init__(self, faces : List[Face]):
+        # Faces in the order of detection and sorted from left to right.
+        self.faces = faces
+        self.sorted_faces = sorted(faces, key = lambda x: x.bbox[0])
+
+    def __bool__(self) -> bool:
+        return len(self.faces) > 0
+
+    def __len__(self) -> int:
+        return len(self.faces)
+
+    def find_face(self, position : int) -> Optional[Face]:
+        if self.faces:
+            try:
+                return self.faces[position] if position >= 0 else self.sorted_faces[0]
+            except IndexError:
+                return None
+        return None
+
+def find_similar_face(frame_analysis : FrameAnalysis, reference_face : Face, similar_face_distance : float) -> Optional[Face]:
+    # The closest face, not the first one under the distance.
+    if reference_face.embedding is None:
+        return None
+    matches = FaceMatcher([reference_face], similar_face_distance).match(frame_analysis.sorted_faces)
+    return matches[0][1] if matches else None
 
 class FaceAnalyser:
     def __init__(self, configuration : Configuration):
         self.configuration = configuration
+        self.batch_size = self.configuration.inference_batch_size
+
+        log.info(f'Prepare face analyser: provider={self.configuration.execution_provider}, modules={self.configuration.face_analyser_modules}, batch_size={self.batch_size}')
+        self.models = self.__load_models()
+        self.detection_model = self.models['detection']
+
+        # Faces are recognized in batches only if the recognition model takes them, this is decided once for all threads.
+        recognition_model = self.models.get('recognition')
+        if self.batch_size > 1 and recognition_model is not None and not has_dynamic_batch(recognition_model.session):
+            log.warning('Face recognition model has a fixed batch size, faces are recognized one by one')
+            self.batch_size = 1
+
+    def __load_models(self) -> dict:
+        # Models of the pack are loaded like insightface FaceAnalysis does, but through
+        # the sessions of this application and only for the requested modules.
+        model_directory = get_face_analyser_model_directory(self.configuration)
+        modules = self.configuration.face_analyser_modules
+
+        models = {}
+        for model_file_path in sorted(model_directory.glob('*.onnx')):
+            taskname = get_model_taskname(model_file_path)
+            if taskname is None or taskname in models:
+                continue
+            if taskname not in modules and not (taskname == 'landmark' and any(module.startswith('landmark') for module in modules)):
+                continue
+
+            model = load_model(model_file_path, self.configuration, get_session_model_file_path(model_file_path, taskname, self.configuration))
+            if model.taskname not in modules or model.taskname in models:
+                continue
+
+            log.info(f'Face analyser model {model_file_path} is loaded: taskname={model.taskname}')
+            if model.taskname == 'detection':
+                model.prepare(0, input_size = self.configuration.face_detection_size, det_thresh = self.configuration.face_detection_threshold)
+            else:
+                model.prepare(0)
+            models[model.taskname] = model
 
-        log.info(f'Prepare face analyser: provider={self.configuration.execution_provider}')
-        self.face_analyser = insightface.app.FaceAnalysis(name = 'buffalo_l', providers = [self.configuration.execution_provider])
-        self.face_analyser.prepare(ctx_id = 0, det_thresh = 0.5, det_size = (640, 640))
+        if 'detection' not in models:
+            raise ValueError(f'Face detection model is not found in {model_directory}')
 
-    def find_faces(self, frame : Frame) -> Optional[List[Face]]:
+        return models
+
+    @metrics.measured('detection')
+    def detect_faces(self, frame : Frame) -> List[Face]:
         try:
-            faces = self.face_analyser.get(frame)
-            return sorted(faces, key = lambda x: x.bbox[0])
+            bboxes, kpss = self.detection_model.detect(frame, max_num = 0, metric = 'default')
         except ValueError:
-            return None
+            return []
 
-    def __find_face(self, frame : Frame, position : int) -> Optional[Face]:
-        faces = self.face_analyser.get(frame)
-        if faces:
-            try:
-                return faces[position] if position >= 0 else min(faces, key = lambda x: x.bbox[0])
-            except IndexError:
-                return None
-        return None
+        faces : List[Face] = []
+        for index in range(bboxes.shape[0]):
+            faces.append(create_face(bbox = bboxes[index, 0:4], kps = kpss[index] if kpss is not None else None, det_score = bboxes[index, 4]))
+        return faces
+
+    def __recognize(self, recognition_model, aligned_faces : List[Frame]) -> numpy.ndarray:
+        if self.batch_size > 1 and len(aligned_faces) > 1:
+            return recognition_model.get_feat(aligned_faces)
+        return numpy.concatenate([recognition_model.get_feat(aligned_face) for aligned_face in aligned_faces])
+
+    @metrics.measured('recognition')
+    def recognize_faces(self, target_faces : List[tuple[Face, Frame]]) -> None:
+        # Embeddings of faces from all given frames are computed by one model call per batch.
+        recognition_model = self.models.get('recognition')
+        if recognition_model is None:
+            return
+
+        from insightface.utils import face_align
+
+        for start in range(0, len(target_faces), max(self.batch_size, 1)):
+            batch = target_faces[start : start + max(self.batch_size, 1)]
+            aligned_faces = [face_align.norm_crop(frame, landmark = face.kps, image_size = recognition_model.input_size[0]) for face, frame in batch]
+
+            embeddings = self.__recognize(recognition_model, aligned_faces)
+            for (face, _), embedding in zip(batch, embeddings):
+                face.embedding = embedding.flatten()
 
-    def find_source_face_in_image(self) -> Optional[Face]:
-        log.info(f'Find source face in image file {self.configuration.source_face_image_file}')
+    def annotate_faces(self, target_faces : List[tuple[Face, Frame]]) -> None:
+        for face, frame in target_faces:
+            for taskname, model in self.models.items():
+                if taskname not in ('detection', 'recognition'):
+                    model.get(frame, face)
+
+    def analyze_frames(self, frames : List[Frame]) -> List[FrameAnalysis]:
+        # The only place where detection and recognition are run for frames,
+        # the result is passed through all further processing steps.
+        frame_faces = [self.detect_faces(frame) for frame in frames]
+
+        target_faces = [(face, frame) for faces, frame in zip(frame_faces, frames) for face in faces]
+        self.recognize_faces(target_faces)
+        self.annotate_faces(target_faces)
+
+        return [FrameAnalysis(faces) for faces in frame_faces]
+
+    def analyze_frame(self, frame : Frame) -> FrameAnalysis:
+        return self.analyze_frames([frame])[0]
+
+    def finish(self) -> None:
+        pass
+
+    def find_faces(self, frame : Frame) -> List[Face]:
+        return self.analyze_frame(frame).sorted_faces
+
+    def find_source_face_in_image(self, image_file_path : Optional[Path] = None) -> Optional[Face]:
+        image_file_path = image_file_path or self.configuration.source_face_image_file
+        log.info(f'Find source face in image file {image_file_path}')
         source_face : Face = None
 
-        face_image = read_image(self.configuration.source_face_image_file)
+        face_image = read_image(image_file_path)
         if face_image.any():
-            source_face = self.__find_face(face_image, 0)
+            source_face = self.analyze_frame(face_image).find_face(0)
             if source_face:
-                log.info(f'Source face found: det_score={source_face["det_score"]}, gender={source_face["gender"]}, age={source_face["age"]}, bbox={source_face["bbox"]}')
+                log.info(f'Source face found: {describe_face(source_face)}')
             else:
                 log.error('Source face not found')
 
         return source_face
 
-    def find_reference_face_in_image(self, frame : Frame) -> Optional[Face]:
+    def find_reference_face_in_image(self, frame_analysis : FrameAnalysis) -> Optional[Face]:
         log.info(f'Find reference face at position #{self.configuration.reference_face_position} in image')
 
-        reference_face = self.__find_face(frame, self.configuration.reference_face_position)
+        reference_face = frame_analysis.find_face(self.configuration.reference_face_position)
         if reference_face:
-            log.info(f'Reference face found: det_score={reference_face["det_score"]}, gender={reference_face["gender"]}, age={reference_face["age"]}, bbox={reference_face["bbox"]}')
+            log.info(f'Reference face found: {describe_face(reference_face)}')
         else:
             log.error('Reference face not found')
 
         return reference_face
 
-    def find_reference_face_in_video_frame(self, frame : Frame) -> Optional[Face]:
+    def find_reference_face_in_video_frame(self, frame_analysis : FrameAnalysis) -> Optional[Face]:
         # No logging because this function is called in loop.
-        return self.__find_face(frame, self.configuration.reference_face_position)
+        return frame_analysis.find_face(self.configuration.reference_face_position)
 
-    def find_reference_face_in_video(self) -> Optional[Face]:
+    def find_reference_face_in_video(self, input_file : Optional[Path] = None, output_file : Optional[Path] = None) -> Optional[Face]:
+        input_file = input_file or self.configuration.input_file
+        output_file = output_file or self.configuration.output_file
         log.info(f'Find reference face at position #{self.configuration.reference_face_position} in video frame at {self.configuration.reference_frame_time} msec')
         reference_face : Face = None
 
-        frame = VideoReader.read_frame(self.configuration.input_file, self.configuration.reference_frame_time)
-        if frame:
-            imageio.write_image(f'{self.configuration.output_file}.reference_face_frame_at_{self.configuration.reference_frame_time}_msec.png', frame)
+        video_reader_class = AVVideoReader if self.configuration.video_reader == 'av' else VideoReader
+        frame = video_reader_class.read_frame(input_file, self.configuration.reference_frame_time)
+        if frame is not None:
+            write_image(f'{output_file}.reference_face_frame_at_{self.configuration.reference_frame_time}_msec.png', frame)
 
-            reference_face = self.find_reference_face_in_video_frame(frame)
+            reference_face = self.find_reference_face_in_video_frame(self.analyze_frame(frame))
             if reference_face:
-                log.info(f'Reference face found in frame at {self.configuration.reference_frame_time} msec: det_score={reference_face["det_score"]}, gender={reference_face["gender"]}, age={reference_face["age"]}, bbox={reference_face["bbox"]}')
+                log.info(f'Reference face found in frame at {self.configuration.reference_frame_time} msec: {describe_face(reference_face)}')
             else:
                 log.error(f'Reference face not found in frame at {self.configuration.reference_frame_time} msec')
 
         return reference_face
 
-    def find_similar_face(self, frame : Frame, reference_face : Face) -> Optional[Face]:
-        faces = self.find_faces(frame)
-        if faces:
-            for face in faces:
-                if hasattr(face, 'normed_embedding') and hasattr(reference_face, 'normed_embedding'):
-                    distance = numpy.sum(numpy.square(face.normed_embedding - reference_face.normed_embedding))
-                    if distance < self.configuration.similar_face_distance:
-                        return face
-        return None
+    def find_similar_face(self, frame_analysis : FrameAnalysis, reference_face : Face) -> Optional[Face]:
+        return find_similar_face(frame_analysis, reference_face, self.configuration.similar_face_distance)
@@ -0,0 +1,41 @@
+import numpy
+
+from scipy.optimize import linear_sum_assignment
+
+from .types import Face
+from .metrics import metrics
+
+class FaceMatcher:
+    def __init__(self, reference_faces : list[Face], similar_face_distance : float):
+        self.reference_faces = reference_faces
+        self.similar_face_distance = similar_face_distance
+
+        # Normed embeddings of all reference faces are rows of one matrix.
+        embeddings = [reference_face.normed_embedding for reference_face in reference_faces]
+        self.gallery : numpy.ndarray = numpy.stack(embeddings).astype(numpy.float32) if embeddings else numpy.empty((0, 0), numpy.float32)
+
+    def __bool__(self) -> bool:
+        return len(self.reference_faces) > 0
+
+    def __len__(self) -> int:
+        return len(self.reference_faces)
+
+    @metrics.measured('matching')
+    def match(self, faces : list[Face]) -> list[tuple[int, Face]]:
+        # Every reference face is matched with at most one face and every face with at most one reference face,
+        # the sum of distances of all matches is minimal.
+        faces = [face for face in faces if face.embedding is not None]
+        if not faces or not self.reference_faces:
+            return []
+
+        embeddings = numpy.stack([face.normed_embedding for face in faces]).astype(numpy.float32)
+
+        # The squared distance between normed embeddings by one matrix multiplication.
+        distances = 2 - 2 * (embeddings @ self.gallery.T)
+
+        # Pairs which are too far never win over a valid one.
+        too_far = distances >= self.similar_face_distance
+        face_indices, reference_indices = linear_sum_assignment(numpy.where(too_far, 4 + distances, distances))
+
+        matches = [(int(reference_index), faces[face_index]) for face_index, reference_index in zip(face_indices, reference_indices) if not too_far[face_index, reference_index]]
+        return sorted(matches, key = lambda match : match[0])
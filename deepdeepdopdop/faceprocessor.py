@@ -1,12 +1,22 @@
 import logging as log
 
+import copy
+import threading
+
 from tqdm import tqdm
+from pathlib import Path
+from typing import Callable, Optional, Union
 
 from .configuration import Configuration
-from .types import Frame, Frames, Face, TargetFaces
-from .faceanalyser import FaceAnalyser
+from .types import Frame, Frames, Face, TargetFaces, create_face
+from .faceanalyser import FaceAnalyser, FrameAnalysis, find_similar_face
+from .facetracker import FaceTracker
+from .analysiscache import AnalysisCache, CachedFrameAnalyzer, SourceFaceCache
+from .staticframes import StaticFrameAnalyzer
+from .facematcher import FaceMatcher
 from .faceswapper import FaceSwapper
-from .facerestorer import FaceRestorer
+from .facerestorer import FaceRestorer, create_face_restorer
+from .metrics import metrics
 
 class FaceProcessor:
     def __init__(self, configuration : Configuration):
@@ -14,94 +24,225 @@ class FaceProcessor:
 
         log.info('Prepare face processors')
 
-        self.face_analyser = FaceAnalyser(configuration)
-        self.face_swapper = FaceSwapper(configuration)
-        self.face_restorer = FaceRestorer(configuration)
-
-    def process_frame(self, source_face : Face, target_face : Face, frame : Frame) -> Frame:
-        frame = self.face_swapper.process(source_face, target_face, frame)
-        frame = self.face_restorer.process(target_face, frame)
+        # Models are loaded the first time they are needed and shared with copies made for other files.
+        self.__lock = threading.Lock()
+        self.__models : dict[str, Union[FaceAnalyser, FaceSwapper, FaceRestorer]] = {}
+
+    def __get_model(self, name : str, create_model : Callable[[Configuration], Union[FaceAnalyser, FaceSwapper, FaceRestorer]]):
+        with self.__lock:
+            if name not in self.__models:
+                with metrics.measure_startup(name):
+                    self.__models[name] = create_model(self.configuration)
+            return self.__models[name]
+
+    @property
+    def face_analyser(self) -> FaceAnalyser:
+        return self.__get_model('Face analyser', FaceAnalyser)
+
+    @property
+    def face_swapper(self) -> FaceSwapper:
+        return self.__get_model('Face swapper', FaceSwapper)
+
+    @property
+    def face_restorer(self) -> FaceRestorer:
+        return self.__get_model('Face restorer', create_face_restorer)
+
+    def with_configuration(self, configuration : Configuration) -> 'FaceProcessor':
+        # A processor of another input file, models stay loaded once.
+        face_processor = copy.copy(self)
+        face_processor.configuration = configuration
+        return face_processor
+
+    def find_face_in_image(self, image_file_path : Path) -> Optional[Face]:
+        # The face with the latent of the swapper is reused by later runs with the same image.
+        source_face_cache = SourceFaceCache(self.configuration, image_file_path)
+
+        source_face = source_face_cache.load()
+        if source_face is None:
+            source_face = self.face_analyser.find_source_face_in_image(image_file_path)
+            if not source_face:
+                return None
+
+        if source_face.latent is None:
+            source_face.latent = self.face_swapper.get_latent(source_face)
+            source_face_cache.save(source_face)
+
+        return source_face
+
+    def find_source_face(self) -> Optional[Face]:
+        return self.find_face_in_image(self.configuration.source_face_image_file)
+
+    def find_reference_face_in_image(self, frame_analysis : FrameAnalysis) -> Optional[Face]:
+        return self.face_analyser.find_reference_face_in_image(frame_analysis)
+
+    def find_reference_face_in_video(self) -> Optional[Face]:
+        return self.face_analyser.find_reference_face_in_video(self.configuration.input_file, self.configuration.output_file)
+
+    def find_reference_face_in_video_frame(self, frame_analysis : FrameAnalysis, reference_face : Optional[Face]) -> Optional[Face]:
+        # The reference face is found in every frame if there is no reference frame. Frames are matched
+        # without the face analyser, so its models are not loaded while the analysis is replayed from the cache.
+        if self.configuration.reference_frame_time < 0:
+            return frame_analysis.find_face(self.configuration.reference_face_position)
+        return reference_face
+
+    def select_source_faces(self, source_face : Face, target_faces : list[Face]) -> Union[Face, list[Face]]:
+        return source_face
+
+    def create_frame_analyzer(self) -> Union[FaceAnalyser, FaceTracker, StaticFrameAnalyzer, CachedFrameAnalyzer]:
+        # Frames of a video are analyzed in order, so faces can be tracked between detections,
+        # static frames can reuse the analysis of the frame before them
+        # and the analysis can be replayed from the cache of a previous run, then models are loaded only if it misses frames.
+        if self.configuration.analysis_cache:
+            return CachedFrameAnalyzer(AnalysisCache(self.configuration), self.__create_frame_analyzer)
+        return self.__create_frame_analyzer()
+
+    def __create_frame_analyzer(self) -> Union[FaceAnalyser, FaceTracker, StaticFrameAnalyzer]:
+        frame_analyzer = self.face_analyser
+        if self.configuration.detection_interval > 1:
+            frame_analyzer = FaceTracker(self.configuration, frame_analyzer)
+        if self.configuration.reuse_static_frames:
+            frame_analyzer = StaticFrameAnalyzer(self.configuration, frame_analyzer)
+        return frame_analyzer
+
+    def process_frame(self, source_face : Face, target_faces : list[Face], frame : Frame) -> Frame:
+        frame = self.face_swapper.process_faces(self.select_source_faces(source_face, target_faces), target_faces, frame)
+        if self.configuration.restore_face:
+            frame = self.face_restorer.process_faces(target_faces, frame)
         return frame
 
-    def process(self, source_face : Face, reference_face : Face, frame : Frame) -> Frame:
-        target_face = self.face_analyser.find_similar_face(frame, reference_face)
-        if target_face:
-            return self.process_frame(source_face, target_face, frame)
+    def find_target_faces(self, frame_analysis : FrameAnalysis, reference_face : Face) -> list[Face]:
+        target_face = find_similar_face(frame_analysis, reference_face, self.configuration.similar_face_distance)
+        return [target_face] if target_face else []
+
+    def process(self, source_face : Face, reference_face : Face, frame : Frame, frame_analysis : FrameAnalysis) -> Frame:
+        target_faces = self.find_target_faces(frame_analysis, reference_face)
+        if target_faces:
+            return self.process_frame(source_face, target_faces, frame)
         return frame
 
-    def analyze(self, frames : Frames, reference_face : Face) -> None:
+    def analyze(self, frames : Frames, reference_face : Face, reused_frames : Optional[list[tuple[int, int]]] = None) -> TargetFaces:
+        # Static frames are listed with the changed frame before them in reused frames if it is given,
+        # they get no target faces, because their output is a copy of the output of that frame.
         target_faces : TargetFaces = []
         frame_index : int = 0
+        key_frame_index : int = 0
+        previous_frame_analysis : Optional[FrameAnalysis] = None
+
+        batch_size = max(self.configuration.inference_batch_size, 1)
+        frame_analyzer = self.create_frame_analyzer()
 
         with tqdm(desc = 'Analyzing faces', total = len(frames), unit = 'frames') as progress:
-            for frame in frames:
-                if self.configuration.reference_frame_time < 0:
-                    reference_face = self.face_analyser.find_reference_face_in_video_frame(frame)
+            for start in range(0, len(frames), batch_size):
+                batch = [frames[index] for index in range(start, min(start + batch_size, len(frames)))]
+
+                for frame_analysis in frame_analyzer.analyze_frames(batch):
+                    metrics.observe('faces_per_frame', len(frame_analysis))
+                    if reused_frames is not None and frame_analysis is previous_frame_analysis:
+                        reused_frames.append((frame_index, key_frame_index))
+                        frame_index += 1
+                        continue
 
-                if reference_face:
-                    target_face = self.face_analyser.find_similar_face(frame, reference_face)
-                    if target_face:
-                        target_faces.append((frame_index, [target_face]))
+                    key_frame_index = frame_index
+                    previous_frame_analysis = frame_analysis
+                    frame_reference_face = self.find_reference_face_in_video_frame(frame_analysis, reference_face)
+                    if frame_reference_face:
+                        frame_target_faces = self.find_target_faces(frame_analysis, frame_reference_face)
+                        if frame_target_faces:
+                            target_faces.append((frame_index, frame_target_faces))
 
-                frame_index += 1
+                    frame_index += 1
 
-                progress.update(1)
+                progress.update(len(batch))
+
+        frame_analyzer.finish()
 
         return target_faces
 
     def swap(self, frames : Frames, target_faces : TargetFaces, source_face : Face) -> None:
+        batch_size = max(self.configuration.inference_batch_size, 1)
+
         with tqdm(desc = 'Swaping faces', total = len(target_faces), unit = 'frames') as progress:
-            for target_face_tuple in target_faces:
-                frame_index = target_face_tuple[0]
-                frame_target_faces = target_face_tuple[1]
-            
-                for target_face in frame_target_faces:
-                    frames[frame_index] = self.face_swapper.process(source_face, target_face, frames[frame_index])
+            for start in range(0, len(target_faces), batch_size):
+                batch = target_faces[start : start + batch_size]
+
+                # Faces of several frames are swapped together and pasted back frame by frame.
+                frame_faces = [(frame_index, target_face) for frame_index, frame_target_faces in batch for target_face in frame_target_faces]
+                source_faces = self.select_source_faces(source_face, [target_face for _, target_face in frame_faces])
+                swapped_faces = self.face_swapper.swap_faces(source_faces, [(target_face, frames[frame_index]) for frame_index, target_face in frame_faces])
 
-                frame_index += 1
+                for (frame_index, _), swapped_face in zip(frame_faces, swapped_faces):
+                    frames[frame_index] = self.face_swapper.paste_back(frames[frame_index], swapped_face)
 
-                progress.update(1)
+                progress.update(len(batch))
+
+    def restore(self, frames : Frames, target_faces : TargetFaces) -> None:
+        batch_size = max(self.configuration.inference_batch_size, 1)
 
-    def restore(self, frames : Frames,  target_faces : TargetFaces) -> None:
         with tqdm(desc = 'Restoring faces', total = len(target_faces), unit = 'frames') as progress:
-            for target_face_tuple in target_faces:
-                frame_index = target_face_tuple[0]
-                frame_target_faces = target_face_tuple[1]
+            for start in range(0, len(target_faces), batch_size):
+                batch = target_faces[start : start + batch_size]
 
-                for target_face in frame_target_faces:
-                    frames[frame_index] = self.face_restorer.process(target_face, frames[frame_index])
+                # Faces of several frames are restored together and pasted back frame by frame.
+                frame_faces = [(frame_index, target_face) for frame_index, frame_target_faces in batch for target_face in frame_target_faces]
+                restored_faces = self.face_restorer.restore_faces([(target_face, frames[frame_index]) for frame_index, target_face in frame_faces])
 
-                frame_index += 1
+                for (frame_index, _), restored_face in zip(frame_faces, restored_faces):
+                    frames[frame_index] = self.face_restorer.paste_back(frames[frame_index], restored_face)
 
-                progress.update(1)
+                progress.update(len(batch))
 
 class EveryFaceProcessor(FaceProcessor):
     def __init__(self, configuration : Configuration):
         super().__init__(configuration)
 
-    def process(self, source_face : Face, reference_face : Face, frame : Frame) -> Frame:
-        target_faces = self.face_analyser.find_faces(frame)
-        if target_faces:
-            for target_face in target_faces:
-                frame = self.process_frame(source_face, target_face, frame)
-        return frame
-
-    def analyze(self, frames : Frames, reference_face : Face) -> None:
-        target_faces : TargetFaces = []
-        frame_index : int = 0
-
-        with tqdm(desc = 'Analyzing faces', total = len(frames), unit = 'frames') as progress:
-            for frame in frames:
-                if self.configuration.reference_frame_time < 0:
-                    reference_face = self.face_analyser.find_reference_face_in_video_frame(frame)
+    def find_target_faces(self, frame_analysis : FrameAnalysis, reference_face : Face) -> list[Face]:
+        return frame_analysis.sorted_faces
 
-                if reference_face:
-                    frame_target_faces = self.face_analyser.find_faces(frame)
-                    if frame_target_faces:
-                        target_faces.append((frame_index, frame_target_faces))
-
-                frame_index += 1
-
-                progress.update(1)
+class GalleryFaceProcessor(FaceProcessor):
+    # Several identities are swapped in one pass, every face of the reference gallery is swapped with the source face of its pair.
+    def __init__(self, configuration : Configuration):
+        super().__init__(configuration)
 
-        return target_faces
+        self.__face_matcher_lock = threading.Lock()
+        self.__face_matcher : Optional[FaceMatcher] = None
+
+    @property
+    def face_matcher(self) -> FaceMatcher:
+        with self.__face_matcher_lock:
+            if self.__face_matcher is None:
+                log.info(f'Prepare reference face gallery of {len(self.configuration.face_mappings)} faces')
+                reference_faces = [self.find_face_in_image(reference_face_image_file) for _, reference_face_image_file in self.configuration.face_mappings]
+                if all(reference_faces):
+                    self.__face_matcher = FaceMatcher(reference_faces, self.configuration.similar_face_distance)
+                else:
+                    log.error('Not every reference face of the gallery is found')
+                    self.__face_matcher = FaceMatcher([], self.configuration.similar_face_distance)
+            return self.__face_matcher
+
+    def find_source_face(self) -> Optional[list[Face]]:
+        source_faces = [self.find_face_in_image(source_face_image_file) for source_face_image_file, _ in self.configuration.face_mappings]
+        if not all(source_faces):
+            log.error('Not every source face of the gallery is found')
+            return None
+        return source_faces
+
+    def find_reference_face_in_image(self, frame_analysis : FrameAnalysis) -> FaceMatcher:
+        return self.face_matcher
+
+    def find_reference_face_in_video(self) -> FaceMatcher:
+        return self.face_matcher
+
+    def find_reference_face_in_video_frame(self, frame_analysis : FrameAnalysis, reference_face : Optional[FaceMatcher]) -> FaceMatcher:
+        return self.face_matcher
+
+    def find_target_faces(self, frame_analysis : FrameAnalysis, reference_face : FaceMatcher) -> list[Face]:
+        # Matched faces are copied with the index of their identity, faces of the analysis stay intact.
+        return [create_face(dict(face, identity = identity)) for identity, face in reference_face.match(frame_analysis.sorted_faces)]
+
+    def select_source_faces(self, source_face : list[Face], target_faces : list[Face]) -> list[Face]:
+        return [source_face[target_face.identity] for target_face in target_faces]
+
+def create_face_processor(configuration : Configuration) -> FaceProcessor:
+    if configuration.face_mappings:
+        return GalleryFaceProcessor(configuration)
+    return EveryFaceProcessor(configuration) if configuration.process_every_face else FaceProcessor(configuration)
@@ -1,29 +1,178 @@
 import logging as log
 
-from gfpgan.utils import GFPGANer
+import cv2
+import numpy
+
 import warnings
-warnings.filterwarnings('ignore', category = UserWarning, module = 'torchvision')
+
+from typing import Union
 
 from .configuration import Configuration
 from .types import Frame, Face
+from .onnxutils import make_batch_dynamic
+from .sessions import create_session, has_dynamic_batch
+from .pasteback import blend_region, get_paste_back_region
 from .utils import download
+from .metrics import metrics
+
+# A restored face and the matrix or the bounding box to paste it back with.
+RestoredFace = tuple[Frame, numpy.ndarray]
 
-class FaceRestorer:
+class GFPGANFaceRestorer:
     def __init__(self, configuration : Configuration):
         self.configuration = configuration
 
         log.info('Prepare face restorer model')
         download(self.configuration.face_restorer_model_file_url, self.configuration.face_restorer_model_file_path)
 
+        # Torch and GFPGAN take seconds to import, so they are imported only when face restoration is requested.
+        warnings.filterwarnings('ignore', category = UserWarning, module = 'torchvision')
+        from gfpgan.utils import GFPGANer
+
         log.info(f'Prepare face restorer: model={self.configuration.face_restorer_model_file_path}, device={self.configuration.gfpgan_device}')
         self.face_restorer = GFPGANer(model_path = str(self.configuration.face_restorer_model_file_path), upscale = 1, device = self.configuration.gfpgan_device)
 
-    def process(self, target_face : Face, frame : Frame) -> Frame:
-        start_x, start_y, end_x, end_y = map(int, target_face['bbox'])
+    @metrics.measured('restore')
+    def restore_faces(self, target_faces : list[tuple[Face, Frame]]) -> list[RestoredFace]:
+        restored_faces : list[RestoredFace] = []
+        for target_face, frame in target_faces:
+            start_x, start_y, end_x, end_y = map(int, target_face['bbox'])
+
+            # GFPGANer detects the face in the crop again and pastes the restored face back into the crop.
+            face_for_restoration = frame[start_y : end_y, start_x : end_x]
+            if face_for_restoration.size:
+                _, _, restored_face = self.face_restorer.enhance(face_for_restoration, paste_back = True)
+                restored_faces.append((restored_face, numpy.array([start_x, start_y, end_x, end_y])))
+            else:
+                restored_faces.append((None, None))
 
-        face_for_restoration = frame[start_y : end_y, start_x : end_x]
-        if face_for_restoration.size:
-            _, _, restored_face = self.face_restorer.enhance(face_for_restoration, paste_back = True)
+        return restored_faces
+
+    @metrics.measured('restore_paste')
+    def paste_back(self, frame : Frame, restored_face : RestoredFace) -> Frame:
+        restored_face, bbox = restored_face
+        if restored_face is not None:
+            start_x, start_y, end_x, end_y = bbox
             frame[start_y : end_y, start_x : end_x] = restored_face
+        return frame
 
+    def process_faces(self, target_faces : list[Face], frame : Frame) -> Frame:
+        for target_face in target_faces:
+            frame = self.process(target_face, frame)
         return frame
+
+    def process(self, target_face : Face, frame : Frame) -> Frame:
+        return self.paste_back(frame, self.restore_faces([(target_face, frame)])[0])
+
+class ONNXFaceRestorer:
+    # Five landmarks of FFHQ aligned faces, which GFPGAN is trained on, for 512x512 crops.
+    FFHQ_TEMPLATE = numpy.array([
+        [0.37691676, 0.46864664],
+        [0.62285697, 0.46912813],
+        [0.50123859, 0.61331904],
+        [0.39308822, 0.72541100],
+        [0.61150205, 0.72490465]
+    ], dtype = numpy.float32) * 512
+
+    def __init__(self, configuration : Configuration):
+        self.configuration = configuration
+
+        log.info('Prepare face restorer model')
+        download(self.configuration.face_restorer_onnx_model_file_url, self.configuration.face_restorer_onnx_model_file_path)
+
+        self.batch_size = self.configuration.inference_batch_size
+        model_file_path = self.configuration.face_restorer_onnx_model_file_path
+        session_model_file_path = model_file_path
+        if self.batch_size > 1:
+            session_model_file_path = model_file_path.with_suffix('.batched.onnx')
+            make_batch_dynamic(model_file_path, session_model_file_path)
+
+        log.info(f'Prepare face restorer: model={session_model_file_path}, provider={self.configuration.execution_provider}, batch_size={self.batch_size}')
+        self.session = create_session(session_model_file_path, self.configuration)
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_names = [output.name for output in self.session.get_outputs()]
+        self.input_size = 512
+
+        if self.batch_size > 1 and not has_dynamic_batch(self.session):
+            log.warning('Face restorer model has a fixed batch size, faces are restored one by one')
+            self.batch_size = 1
+
+        # Masks of paste back are reused between faces.
+        self.box_mask : numpy.ndarray = self.__create_box_mask(self.input_size, 0.3)
+
+    @staticmethod
+    def __create_box_mask(size : int, blur : float) -> numpy.ndarray:
+        # The restored crop fades out towards its borders.
+        blur_amount = int(size * 0.5 * blur)
+        blur_area = max(blur_amount // 2, 1)
+        box_mask = numpy.ones((size, size), numpy.float32)
+        box_mask[: blur_area, :] = 0
+        box_mask[-blur_area :, :] = 0
+        box_mask[:, : blur_area] = 0
+        box_mask[:, -blur_area :] = 0
+        return cv2.GaussianBlur(box_mask, (0, 0), blur_amount * 0.25)
+
+    def __align(self, frame : Frame, kps : numpy.ndarray) -> tuple[Frame, numpy.ndarray]:
+        matrix = cv2.estimateAffinePartial2D(kps.astype(numpy.float32), self.FFHQ_TEMPLATE, method = cv2.RANSAC, ransacReprojThreshold = 100)[0]
+        aligned_face = cv2.warpAffine(frame, matrix, (self.input_size, self.input_size), borderMode = cv2.BORDER_REPLICATE, flags = cv2.INTER_AREA)
+        return aligned_face, matrix
+
+    def __run(self, blob : numpy.ndarray) -> numpy.ndarray:
+        if self.batch_size > 1 and len(blob) > 1:
+            return self.session.run(self.output_names, {self.input_name: blob})[0]
+        return numpy.concatenate([self.session.run(self.output_names, {self.input_name: blob[index : index + 1]})[0] for index in range(len(blob))])
+
+    @metrics.measured('restore')
+    def restore_faces(self, target_faces : list[tuple[Face, Frame]]) -> list[RestoredFace]:
+        # Faces are aligned by the keypoints of the face analyser, there is no detection in the crops.
+        aligned_faces = [self.__align(frame, target_face.kps) for target_face, frame in target_faces]
+
+        restored_faces : list[RestoredFace] = []
+        for start in range(0, len(aligned_faces), max(self.batch_size, 1)):
+            batch = aligned_faces[start : start + max(self.batch_size, 1)]
+
+            # BGR crops are converted to RGB planes in range [-1, 1].
+            blob = cv2.dnn.blobFromImages([aligned_face for aligned_face, _ in batch], 1.0 / 127.5, (self.input_size, self.input_size), (127.5, 127.5, 127.5), swapRB = True)
+
+            predictions = numpy.clip(self.__run(blob), -1, 1).transpose((0, 2, 3, 1))
+            for prediction, (_, matrix) in zip(predictions, batch):
+                restored_face = numpy.rint((prediction + 1) * 127.5).astype(numpy.uint8)[:, :, ::-1]
+                restored_faces.append((restored_face, matrix))
+
+        return restored_faces
+
+    @metrics.measured('restore_paste')
+    def paste_back(self, frame : Frame, restored_face : RestoredFace) -> Frame:
+        # Like the swapped face, the restored face is blended only in the region around it in place.
+        restored_face, matrix = restored_face
+
+        if not frame.flags.writeable:
+            frame = frame.copy()
+
+        region = get_paste_back_region(frame, matrix, self.input_size, self.input_size)
+        if region is None:
+            return frame
+
+        left, top, right, bottom, inverse_matrix = region
+        roi_size = (right - left, bottom - top)
+
+        restored_face = cv2.warpAffine(restored_face, inverse_matrix, roi_size, borderMode = cv2.BORDER_REPLICATE)
+        mask = cv2.warpAffine(self.box_mask, inverse_matrix, roi_size).clip(0, 1)[:, :, numpy.newaxis]
+
+        blend_region(frame, region, restored_face, mask)
+        return frame
+
+    def process_faces(self, target_faces : list[Face], frame : Frame) -> Frame:
+        for restored_face in self.restore_faces([(target_face, frame) for target_face in target_faces]):
+            frame = self.paste_back(frame, restored_face)
+        return frame
+
+    def process(self, target_face : Face, frame : Frame) -> Frame:
+        return self.process_faces([target_face], frame)
+
+FaceRestorer = Union[ONNXFaceRestorer, GFPGANFaceRestorer]
+
+def create_face_restorer(configuration : Configuration) -> FaceRestorer:
+    if configuration.face_restorer_engine == 'gfpgan':
+        return GFPGANFaceRestorer(configuration)
+    return ONNXFaceRestorer(configuration)
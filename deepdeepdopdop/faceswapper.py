@@ -1,15 +1,24 @@
 import logging as log
 
-import onnx
-import onnxruntime
+import cv2
+import numpy
+
+from typing import Union
 
-import insightface
 import warnings
 warnings.filterwarnings('ignore', category = FutureWarning, module = 'insightface')
 
 from .configuration import Configuration
 from .types import Frame, Face
+from .onnxutils import make_batch_dynamic
+from .sessions import has_dynamic_batch, load_model
+from .quantization import get_session_model_file_path
+from .pasteback import blend_region, get_paste_back_region
 from .utils import download
+from .metrics import metrics
+
+# A swapped face, the aligned target face crop and the matrix of the alignment.
+SwappedFace = tuple[Frame, Frame, numpy.ndarray]
 
 class FaceSwapper:
     def __init__(self, configuration : Configuration):
@@ -18,11 +27,133 @@ class FaceSwapper:
         log.info('Prepare face swapper model')
         download(self.configuration.face_swapper_model_file_url, self.configuration.face_swapper_model_file_path)
 
-        log.info(f'Prepare face swapper: model={self.configuration.face_swapper_model_file_path}, provider={self.configuration.execution_provider}')
-        self.face_swapper = insightface.model_zoo.get_model(str(self.configuration.face_swapper_model_file_path), providers = [self.configuration.execution_provider])
+        self.batch_size = self.configuration.inference_batch_size
+        model_file_path = self.configuration.face_swapper_model_file_path
+        session_model_file_path = get_session_model_file_path(model_file_path, 'swapper', self.configuration)
+        if self.batch_size > 1:
+            batched_model_file_path = session_model_file_path.with_suffix('.batched.onnx')
+            make_batch_dynamic(session_model_file_path, batched_model_file_path)
+            session_model_file_path = batched_model_file_path
+
+        log.info(f'Prepare face swapper: model={session_model_file_path}, provider={self.configuration.execution_provider}, batch_size={self.batch_size}')
+        self.face_swapper = load_model(model_file_path, self.configuration, session_model_file_path)
+        self.input_size = self.face_swapper.input_size[0]
+
+        if self.batch_size > 1 and not has_dynamic_batch(self.face_swapper.session):
+            log.warning('Face swapper model has a fixed batch size, faces are swapped one by one')
+            self.batch_size = 1
+
+        # Masks and kernels of paste back are reused between faces of the same size.
+        self.white_masks : dict[tuple[int, int], numpy.ndarray] = {}
+        self.kernels : dict[int, numpy.ndarray] = {}
+
+    def get_latent(self, source_face : Face) -> numpy.ndarray:
+        # The latent may come with the source face from the cache.
+        if source_face.latent is not None:
+            return source_face.latent
+
+        latent = source_face.normed_embedding.reshape((1, -1))
+        latent = numpy.dot(latent, self.face_swapper.emap)
+        latent /= numpy.linalg.norm(latent)
+        return latent
+
+    def __run(self, blob : numpy.ndarray, latents : numpy.ndarray) -> numpy.ndarray:
+        input_names = self.face_swapper.input_names
+        output_names = self.face_swapper.output_names
+        session = self.face_swapper.session
+
+        if self.batch_size > 1 and len(blob) > 1:
+            return session.run(output_names, {input_names[0]: blob, input_names[1]: latents})[0]
+        return numpy.concatenate([session.run(output_names, {input_names[0]: blob[index : index + 1], input_names[1]: latents[index : index + 1]})[0] for index in range(len(blob))])
+
+    @metrics.measured('swap')
+    def swap_faces(self, source_face : Union[Face, list[Face]], target_faces : list[tuple[Face, Frame]]) -> list[SwappedFace]:
+        # Aligned crops of all target faces are swapped by one model call per batch,
+        # either with one source face or with a source face per target face.
+        from insightface.utils import face_align
+
+        if isinstance(source_face, list):
+            latents = numpy.concatenate([self.get_latent(face) for face in source_face]) if source_face else numpy.empty((0, 0), numpy.float32)
+        else:
+            latents = numpy.repeat(self.get_latent(source_face), len(target_faces), axis = 0)
+        aligned_faces = [face_align.norm_crop2(frame, target_face.kps, self.input_size) for target_face, frame in target_faces]
+
+        swapped_faces : list[SwappedFace] = []
+        for start in range(0, len(aligned_faces), max(self.batch_size, 1)):
+            batch = aligned_faces[start : start + max(self.batch_size, 1)]
+
+            mean = self.face_swapper.input_mean
+            blob = cv2.dnn.blobFromImages([aligned_face for aligned_face, _ in batch], 1.0 / self.face_swapper.input_std, (self.input_size, self.input_size), (mean, mean, mean), swapRB = True)
+
+            predictions = self.__run(blob, latents[start : start + len(batch)]).transpose((0, 2, 3, 1))
+            for prediction, (aligned_face, matrix) in zip(predictions, batch):
+                bgr_fake = numpy.clip(255 * prediction, 0, 255).astype(numpy.uint8)[:, :, ::-1]
+                swapped_faces.append((bgr_fake, aligned_face, matrix))
+
+        return swapped_faces
+
+    def __get_white_mask(self, size : tuple[int, int]) -> numpy.ndarray:
+        white_mask = self.white_masks.get(size)
+        if white_mask is None:
+            white_mask = numpy.full(size, 255, dtype = numpy.float32)
+            self.white_masks[size] = white_mask
+        return white_mask
+
+    def __get_kernel(self, size : int) -> numpy.ndarray:
+        kernel = self.kernels.get(size)
+        if kernel is None:
+            kernel = numpy.ones((size, size), numpy.uint8)
+            self.kernels[size] = kernel
+        return kernel
+
+    @metrics.measured('paste')
+    def paste_back(self, frame : Frame, swapped_face : SwappedFace) -> Frame:
+        # The same blending as INSwapper.get(paste_back = True) does, without the difference
+        # mask which INSwapper computes but never uses. Only the region of the frame around
+        # the face is warped and blended, the frame is changed in place.
+        bgr_fake, aligned_face, matrix = swapped_face
+        aligned_height, aligned_width = aligned_face.shape[:2]
+
+        if not frame.flags.writeable:
+            frame = frame.copy()
+
+        # The region is padded by more than the blur radius, so the mask is the same as in the whole frame.
+        region = get_paste_back_region(frame, matrix, aligned_width, aligned_height, padding_ratio = 0.05, padding = 8)
+        if region is None:
+            return frame
+
+        left, top, right, bottom, inverse_matrix = region
+        roi_size = (right - left, bottom - top)
+
+        img_white = self.__get_white_mask((aligned_height, aligned_width))
+        bgr_fake = cv2.warpAffine(bgr_fake, inverse_matrix, roi_size, borderValue = 0.0)
+        img_white = cv2.warpAffine(img_white, inverse_matrix, roi_size, borderValue = 0.0)
+        img_white[img_white > 20] = 255
+
+        img_mask = img_white
+        mask_h_inds, mask_w_inds = numpy.where(img_mask == 255)
+        if len(mask_h_inds) == 0:
+            return frame
+        mask_h = numpy.max(mask_h_inds) - numpy.min(mask_h_inds)
+        mask_w = numpy.max(mask_w_inds) - numpy.min(mask_w_inds)
+        mask_size = int(numpy.sqrt(mask_h * mask_w))
+
+        k = max(mask_size // 10, 10)
+        img_mask = cv2.erode(img_mask, self.__get_kernel(k), iterations = 1)
+
+        k = max(mask_size // 20, 5)
+        img_mask = cv2.GaussianBlur(img_mask, (2 * k + 1, 2 * k + 1), 0)
+
+        img_mask /= 255
+        img_mask = img_mask[:, :, numpy.newaxis]
+
+        blend_region(frame, region, bgr_fake, img_mask)
+        return frame
 
-        log.info(f'Set ONNX Runtime logger severity to {self.configuration.onnxruntime_logging_severity}')
-        onnxruntime.set_default_logger_severity(self.configuration.onnxruntime_logging_severity)
+    def process_faces(self, source_face : Union[Face, list[Face]], target_faces : list[Face], frame : Frame) -> Frame:
+        for swapped_face in self.swap_faces(source_face, [(target_face, frame) for target_face in target_faces]):
+            frame = self.paste_back(frame, swapped_face)
+        return frame
 
     def process(self, source_face : Face, target_face : Face, frame : Frame) -> Frame:
-        return self.face_swapper.get(frame, target_face, source_face, paste_back = True)
+        return self.process_faces(source_face, [target_face], frame)
@@ -0,0 +1,118 @@
+import logging as log
+
+import cv2
+import numpy
+
+from typing import Optional, List
+
+from .configuration import Configuration
+from .types import Frame, Face, create_face
+from .faceanalyser import FaceAnalyser, FrameAnalysis
+from .metrics import metrics
+
+def bbox_iou(bbox1 : numpy.ndarray, bbox2 : numpy.ndarray) -> float:
+    width = min(bbox1[2], bbox2[2]) - max(bbox1[0], bbox2[0])
+    height = min(bbox1[3], bbox2[3]) - max(bbox1[1], bbox2[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    union = (bbox1[2] - bbox1[0]) * (bbox1[3] - bbox1[1]) + (bbox2[2] - bbox2[0]) * (bbox2[3] - bbox2[1]) - intersection
+    return float(intersection / union) if union > 0 else 0.0
+
+class FaceTracker:
+    def __init__(self, configuration : Configuration, face_analyser : FaceAnalyser):
+        self.configuration = configuration
+        self.face_analyser = face_analyser
+
+        # Faces of the previous frame in the order of detection, each one is a track.
+        self.tracks : List[Face] = []
+        self.previous_gray_frame : Frame = None
+        self.frames_since_detection : int = 0
+
+        self.detected_frame_count : int = 0
+        self.tracked_frame_count : int = 0
+
+        log.info(f'Prepare face tracker: detection_interval={self.configuration.detection_interval}, min_confidence={self.configuration.tracking_min_confidence}, iou_threshold={self.configuration.tracking_iou_threshold}')
+
+    def __detect(self, frame : Frame) -> FrameAnalysis:
+        faces = self.face_analyser.detect_faces(frame)
+
+        # Detected faces which overlap a track keep the embedding of the track, only new faces are recognized.
+        new_faces : List[tuple[Face, Frame]] = []
+        for face in faces:
+            track = max(self.tracks, key = lambda track: bbox_iou(track.bbox, face.bbox), default = None)
+            if track is not None and track.embedding is not None and bbox_iou(track.bbox, face.bbox) >= self.configuration.tracking_iou_threshold:
+                for key, value in track.items():
+                    if key not in ('bbox', 'kps', 'det_score'):
+                        face[key] = value
+            else:
+                new_faces.append((face, frame))
+
+        self.face_analyser.recognize_faces(new_faces)
+        self.face_analyser.annotate_faces(new_faces)
+
+        self.tracks = faces
+        self.frames_since_detection = 0
+        self.detected_frame_count += 1
+        return FrameAnalysis(faces)
+
+    @metrics.measured('tracking')
+    def __track(self, gray_frame : Frame) -> Optional[FrameAnalysis]:
+        # Keypoints are propagated by sparse optical flow, tracking is rejected
+        # if the flow is not consistent forward and backward for any face.
+        points = numpy.concatenate([track.kps for track in self.tracks]).astype(numpy.float32).reshape(-1, 1, 2)
+
+        next_points, status, _ = cv2.calcOpticalFlowPyrLK(self.previous_gray_frame, gray_frame, points, None, winSize = (21, 21), maxLevel = 3)
+        back_points, back_status, _ = cv2.calcOpticalFlowPyrLK(gray_frame, self.previous_gray_frame, next_points, None, winSize = (21, 21), maxLevel = 3)
+        errors = numpy.linalg.norm((points - back_points).reshape(-1, 2), axis = 1)
+        valid = (status.reshape(-1) == 1) & (back_status.reshape(-1) == 1)
+
+        faces : List[Face] = []
+        for index, track in enumerate(self.tracks):
+            keypoints = slice(index * 5, index * 5 + 5)
+            face_size = max(track.bbox[2] - track.bbox[0], track.bbox[3] - track.bbox[1])
+
+            confidence = numpy.mean(valid[keypoints] & (errors[keypoints] < max(1.0, face_size * 0.02)))
+            if confidence < self.configuration.tracking_min_confidence:
+                return None
+
+            matrix, _ = cv2.estimateAffinePartial2D(points[keypoints], next_points[keypoints])
+            if matrix is None:
+                return None
+
+            corners = numpy.array([[track.bbox[0], track.bbox[1]], [track.bbox[2], track.bbox[1]], [track.bbox[0], track.bbox[3]], [track.bbox[2], track.bbox[3]]], dtype = numpy.float32)
+            corners = cv2.transform(corners.reshape(-1, 1, 2), matrix).reshape(-1, 2)
+
+            face = create_face(track)
+            face.bbox = numpy.concatenate([corners.min(axis = 0), corners.max(axis = 0)]).astype(numpy.float32)
+            face.kps = next_points[keypoints].reshape(5, 2)
+            faces.append(face)
+
+        self.tracks = faces
+        self.frames_since_detection += 1
+        self.tracked_frame_count += 1
+        return FrameAnalysis(faces)
+
+    def analyze_frame(self, frame : Frame) -> FrameAnalysis:
+        gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        frame_analysis : Optional[FrameAnalysis] = None
+        if self.previous_gray_frame is not None and self.frames_since_detection + 1 < self.configuration.detection_interval:
+            if self.tracks:
+                frame_analysis = self.__track(gray_frame)
+            else:
+                frame_analysis = FrameAnalysis([])
+                self.frames_since_detection += 1
+                self.tracked_frame_count += 1
+
+        if frame_analysis is None:
+            frame_analysis = self.__detect(frame)
+
+        self.previous_gray_frame = gray_frame
+        return frame_analysis
+
+    def analyze_frames(self, frames : List[Frame]) -> List[FrameAnalysis]:
+        return [self.analyze_frame(frame) for frame in frames]
+
+    def finish(self) -> None:
+        log.info(f'Face tracker statistics: detected_frames={self.detected_frame_count}, tracked_frames={self.tracked_frame_count}')
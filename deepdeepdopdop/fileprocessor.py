@@ -1,5 +1,7 @@
 import logging as log
 
+from typing import Callable, Optional
+
 from .configuration import Configuration
 from .faceprocessor import FaceProcessor
 
@@ -8,5 +10,12 @@ class FileProcessor:
         self.configuration = configuration
         self.face_processor = face_processor
 
+        # Receives the stage, the number of done and total items, the server reports the progress of jobs by it.
+        self.progress_callback : Optional[Callable[[str, int, int], None]] = None
+
+    def report_progress(self, stage : str, done : int = 0, total : int = 0) -> None:
+        if self.progress_callback:
+            self.progress_callback(stage, done, total)
+
     def run(self) -> None:
         pass
@@ -0,0 +1,102 @@
+import logging as log
+
+import numpy
+import tempfile
+
+from collections import OrderedDict
+from collections.abc import Sequence
+from contextlib import ContextDecorator
+from pathlib import Path
+from typing import Iterator, Optional
+
+from .types import Frame
+
+class FrameStore(Sequence, ContextDecorator):
+    def __init__(self, frame_width : int, frame_height : int, frame_count : int, window_size : int, directory : Optional[Path] = None):
+        self.frame_shape : tuple[int, int, int] = (frame_height, frame_width, 3)
+        self.frame_size : int = frame_height * frame_width * 3
+        self.window_size : int = window_size
+        self.temporary_directory = tempfile.TemporaryDirectory(prefix = 'deepdeepdopdop-frames-', dir = directory)
+        self.file_path = Path(self.temporary_directory.name) / 'frames.raw'
+        self.frames : numpy.memmap = None
+        self.capacity : int = 0
+        self.length : int = 0
+
+        # Recently written frames which are not spilled to the file yet.
+        self.window : OrderedDict[int, Frame] = OrderedDict()
+
+        self.file_path.touch()
+        self.__reserve(max(frame_count, 1))
+
+        log.info(f'Frame store is created in {self.file_path}: frame_width={frame_width}, frame_height={frame_height}, window_size={window_size}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self) -> Iterator[Frame]:
+        for index in range(self.length):
+            yield self[index]
+
+    def __index(self, index : int) -> int:
+        if index < 0:
+            index += self.length
+        if index < 0 or index >= self.length:
+            raise IndexError(f'Frame index {index} is out of range')
+        return index
+
+    def __reserve(self, capacity : int) -> None:
+        if capacity <= self.capacity:
+            return
+
+        if self.frames is not None:
+            self.frames.flush()
+
+        # Frames handed out earlier keep the previous mapping alive, it refers to the same file.
+        with open(self.file_path, 'r+b') as file:
+            file.truncate(capacity * self.frame_size)
+
+        self.frames = numpy.memmap(self.file_path, dtype = numpy.uint8, mode = 'r+', shape = (capacity,) + self.frame_shape)
+        self.capacity = capacity
+
+    def __spill(self) -> None:
+        while len(self.window) > self.window_size:
+            index, frame = self.window.popitem(last = False)
+            self.frames[index] = frame
+
+    def __is_stored(self, index : int, frame : Frame) -> bool:
+        stored_frame = self.frames[index]
+        return isinstance(frame, numpy.ndarray) and frame.shape == stored_frame.shape and frame.ctypes.data == stored_frame.ctypes.data
+
+    def __getitem__(self, index : int) -> Frame:
+        index = self.__index(index)
+        if index in self.window:
+            return self.window[index]
+        # A view into the file, so modifications are written back in place.
+        return self.frames[index]
+
+    def __setitem__(self, index : int, frame : Frame) -> None:
+        index = self.__index(index)
+        if index in self.window:
+            self.window[index] = frame
+            self.window.move_to_end(index)
+        elif not self.__is_stored(index, frame):
+            self.frames[index] = frame
+
+    def append(self, frame : Frame) -> None:
+        if self.length == self.capacity:
+            self.__reserve(self.capacity + max(self.capacity // 4, 1))
+
+        self.window[self.length] = frame
+        self.length += 1
+        self.__spill()
+
+    def close(self) -> None:
+        self.window.clear()
+        self.frames = None
+        self.temporary_directory.cleanup()
@@ -12,14 +12,19 @@ class ImageProcessor(FileProcessor):
     def run(self) -> None:
         log.info(f'Process input image file {self.configuration.input_file}')
 
-        source_face = self.face_processor.face_analyser.find_source_face_in_image()
+        self.report_progress('finding faces')
+        source_face = self.face_processor.find_source_face()
         if source_face:
             input_image = read_image(self.configuration.input_file)
             if input_image.any():
-                reference_face = self.face_processor.face_analyser.find_reference_face_in_image(input_image)
+                self.report_progress('analyzing')
+                frame_analysis = self.face_processor.face_analyser.analyze_frame(input_image)
+                reference_face = self.face_processor.find_reference_face_in_image(frame_analysis)
                 if reference_face:
                     log.info('Processing faces...')
-                    output_image = self.face_processor.process(source_face, reference_face, input_image)
+                    self.report_progress('processing')
+                    output_image = self.face_processor.process(source_face, reference_face, input_image, frame_analysis)
 
                     log.info('Write result into output file')
+                    self.report_progress('writing')
                     write_image(self.configuration.output_file, output_image)
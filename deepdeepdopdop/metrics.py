@@ -0,0 +1,219 @@
+import logging as log
+
+import bisect
+import functools
+import json
+import resource
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Optional
+
+# Upper bounds of histogram buckets, the last bucket has no bound.
+TIME_BUCKETS : list[float] = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+COUNT_BUCKETS : list[float] = [0, 1, 2, 3, 4, 6, 8, 12, 16, 32, 64]
+
+class Histogram:
+    def __init__(self, buckets : list[float]):
+        self.buckets = buckets
+        self.bucket_counts : list[int] = [0] * (len(buckets) + 1)
+        self.count : int = 0
+        self.sum : float = 0.0
+        self.min : float = float('inf')
+        self.max : float = float('-inf')
+
+    def observe(self, value : float) -> None:
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q : float) -> float:
+        # The upper bound of the bucket with the quantile, the maximum for the last bucket.
+        rank = q * self.count
+        cumulative_count = 0
+        for bound, bucket_count in zip(self.buckets + [self.max], self.bucket_counts):
+            cumulative_count += bucket_count
+            if cumulative_count >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def merge(self, other : dict) -> None:
+        self.bucket_counts = [count + other_count for count, other_count in zip(self.bucket_counts, other['bucket_counts'])]
+        self.count += other['count']
+        self.sum += other['sum']
+        if other['count']:
+            self.min = min(self.min, other['min'])
+            self.max = max(self.max, other['max'])
+
+    def to_dict(self) -> dict:
+        return {
+            'buckets': self.buckets,
+            'bucket_counts': self.bucket_counts,
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min if self.count else 0,
+            'max': self.max if self.count else 0,
+            'mean': self.sum / self.count if self.count else 0,
+            'p50': self.quantile(0.5) if self.count else 0,
+            'p95': self.quantile(0.95) if self.count else 0
+        }
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        # Stage latencies in seconds, distributions of counts like faces per frame or queue depths,
+        # counters of events like reused frames, and startup times.
+        self.stages : dict[str, Histogram] = {}
+        self.distributions : dict[str, Histogram] = {}
+        self.counters : dict[str, int] = {}
+        self.startup_times : dict[str, float] = {}
+        self.start_time : float = time.perf_counter()
+
+    def __observe(self, histograms : dict[str, Histogram], name : str, value : float, buckets : list[float]) -> None:
+        with self.lock:
+            histogram = histograms.get(name)
+            if histogram is None:
+                histogram = histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def observe_stage(self, stage : str, elapsed_time : float) -> None:
+        self.__observe(self.stages, stage, elapsed_time, TIME_BUCKETS)
+
+    def observe(self, name : str, value : float) -> None:
+        self.__observe(self.distributions, name, value, COUNT_BUCKETS)
+
+    def count(self, name : str, value : int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def measure(self, stage : str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - start_time)
+
+    def measured(self, stage : str) -> Callable:
+        # Decorates a function to measure every call of it as the stage.
+        def decorator(function : Callable) -> Callable:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.measure(stage):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def measure_startup(self, component : str):
+        start_time = time.perf_counter()
+        yield
+        elapsed_time = time.perf_counter() - start_time
+        with self.lock:
+            self.startup_times[component] = self.startup_times.get(component, 0.0) + elapsed_time
+        log.info(f'{component} is ready in {elapsed_time:.3f} sec')
+
+    @staticmethod
+    def get_peak_rss() -> dict[str, int]:
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS, child processes render video segments.
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return {
+            'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+        }
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                'elapsed_time': time.perf_counter() - self.start_time,
+                'startup_times': dict(self.startup_times),
+                'stages': {name: histogram.to_dict() for name, histogram in self.stages.items()},
+                'distributions': {name: histogram.to_dict() for name, histogram in self.distributions.items()},
+                'counters': dict(self.counters),
+                'peak_rss_bytes': self.get_peak_rss()
+            }
+
+    def merge(self, other : dict) -> None:
+        # Metrics of other processes, like workers rendering video segments.
+        with self.lock:
+            for histograms, other_histograms, buckets in ((self.stages, other['stages'], TIME_BUCKETS), (self.distributions, other['distributions'], COUNT_BUCKETS)):
+                for name, other_histogram in other_histograms.items():
+                    histograms.setdefault(name, Histogram(buckets)).merge(other_histogram)
+            for name, value in other['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_prometheus(self) -> str:
+        summary = self.to_dict()
+        lines : list[str] = []
+
+        def write_histogram(metric : str, name : str, histogram : dict) -> None:
+            cumulative_count = 0
+            for bound, bucket_count in zip(histogram['buckets'] + ['+Inf'], histogram['bucket_counts']):
+                cumulative_count += bucket_count
+                lines.append(f'{metric}_bucket{{name="{name}",le="{bound}"}} {cumulative_count}')
+            lines.append(f'{metric}_sum{{name="{name}"}} {histogram["sum"]}')
+            lines.append(f'{metric}_count{{name="{name}"}} {histogram["count"]}')
+
+        lines.append('# TYPE deepdeepdopdop_stage_seconds histogram')
+        for name, histogram in summary['stages'].items():
+            write_histogram('deepdeepdopdop_stage_seconds', name, histogram)
+
+        lines.append('# TYPE deepdeepdopdop_distribution histogram')
+        for name, histogram in summary['distributions'].items():
+            write_histogram('deepdeepdopdop_distribution', name, histogram)
+
+        lines.append('# TYPE deepdeepdopdop_events_total counter')
+        for name, value in summary['counters'].items():
+            lines.append(f'deepdeepdopdop_events_total{{name="{name}"}} {value}')
+
+        lines.append('# TYPE deepdeepdopdop_startup_seconds gauge')
+        for component, elapsed_time in summary['startup_times'].items():
+            lines.append(f'deepdeepdopdop_startup_seconds{{component="{component}"}} {elapsed_time}')
+
+        lines.append('# TYPE deepdeepdopdop_peak_rss_bytes gauge')
+        for process, peak_rss in summary['peak_rss_bytes'].items():
+            lines.append(f'deepdeepdopdop_peak_rss_bytes{{process="{process}"}} {peak_rss}')
+
+        return '\n'.join(lines) + '\n'
+
+    def log_report(self) -> None:
+        summary = self.to_dict()
+
+        if summary['startup_times']:
+            report = ', '.join(f'{component}={elapsed_time:.3f} sec' for component, elapsed_time in summary['startup_times'].items())
+            log.info(f'Startup time report: {report}, total={sum(summary["startup_times"].values()):.3f} sec')
+
+        for name, histogram in summary['stages'].items():
+            log.info(f'Stage {name}: count={histogram["count"]}, total={histogram["sum"]:.3f} sec, mean={histogram["mean"] * 1000:.1f} msec, p95<={histogram["p95"] * 1000:.1f} msec, max={histogram["max"] * 1000:.1f} msec')
+
+        for name, histogram in summary['distributions'].items():
+            log.info(f'Distribution {name}: count={histogram["count"]}, mean={histogram["mean"]:.2f}, max={histogram["max"]}')
+
+        if summary['counters']:
+            log.info('Counters: ' + ', '.join(f'{name}={value}' for name, value in summary['counters'].items()))
+
+        log.info(f'Peak RSS: self={summary["peak_rss_bytes"]["self"] // (1024 * 1024)} MB, children={summary["peak_rss_bytes"]["children"] // (1024 * 1024)} MB')
+
+    def write(self, json_file_path : Optional[Path], prometheus_file_path : Optional[Path]) -> None:
+        if json_file_path:
+            log.info(f'Write metrics to file {json_file_path}')
+            with open(json_file_path, 'w') as file:
+                json.dump(self.to_dict(), file, indent = 2)
+
+        if prometheus_file_path:
+            # The textfile collector may read the file at any time, so it is replaced at once.
+            log.info(f'Write Prometheus metrics to file {prometheus_file_path}')
+            temporary_file_path = prometheus_file_path.with_name(f'{prometheus_file_path.name}.tmp')
+            temporary_file_path.write_text(self.to_prometheus())
+            temporary_file_path.replace(prometheus_file_path)
+
+# Metrics of the whole process.
+metrics = Metrics()
@@ -0,0 +1,27 @@
+import logging as log
+
+import onnx
+
+from pathlib import Path
+
+def make_batch_dynamic(model_file_path : Path, batched_model_file_path : Path) -> None:
+    if batched_model_file_path.exists():
+        log.info(f'{model_file_path} already has a copy with dynamic batch dimension in {batched_model_file_path}')
+        return
+
+    log.info(f'Make batch dimension of {model_file_path} dynamic in {batched_model_file_path}')
+
+    model = onnx.load(str(model_file_path))
+
+    initializer_names = set(initializer.name for initializer in model.graph.initializer)
+    for value in list(model.graph.input) + list(model.graph.output):
+        if value.name in initializer_names:
+            continue
+        dims = value.type.tensor_type.shape.dim
+        if len(dims):
+            dims[0].dim_param = 'batch'
+
+    # Intermediate shapes were inferred for batch size 1, let ONNX Runtime infer them again.
+    del model.graph.value_info[:]
+
+    onnx.save(model, str(batched_model_file_path))
@@ -0,0 +1,42 @@
+import cv2
+import numpy
+
+from typing import Optional
+
+from .types import Frame
+
+# The region of the frame a crop is pasted back into, from left, top, right and bottom,
+# and the inverse matrix of the alignment moved to the region.
+PasteBackRegion = tuple[int, int, int, int, numpy.ndarray]
+
+def get_paste_back_region(frame : Frame, matrix : numpy.ndarray, crop_width : int, crop_height : int, padding_ratio : float = 0, padding : int = 1) -> Optional[PasteBackRegion]:
+    # The region is the bounding box of the crop corners in the frame, padded by a part of its size and some pixels,
+    # so only the region is warped and blended instead of the whole frame.
+    inverse_matrix = cv2.invertAffineTransform(matrix)
+
+    corners = numpy.array([[0, 0, 1], [crop_width, 0, 1], [0, crop_height, 1], [crop_width, crop_height, 1]], dtype = numpy.float64)
+    frame_corners = corners @ inverse_matrix.T
+    (left, top), (right, bottom) = frame_corners.min(axis = 0), frame_corners.max(axis = 0)
+    padding += int(max(right - left, bottom - top) * padding_ratio)
+
+    frame_height, frame_width = frame.shape[:2]
+    left = max(int(numpy.floor(left)) - padding, 0)
+    top = max(int(numpy.floor(top)) - padding, 0)
+    right = min(int(numpy.ceil(right)) + padding, frame_width)
+    bottom = min(int(numpy.ceil(bottom)) + padding, frame_height)
+    if right <= left or bottom <= top:
+        return None
+
+    inverse_matrix[:, 2] -= (left, top)
+    return left, top, right, bottom, inverse_matrix
+
+def blend_region(frame : Frame, region : PasteBackRegion, face : Frame, mask : numpy.ndarray) -> None:
+    # frame + mask * (face - frame) in place, which needs fewer temporary arrays than the usual mask * face + (1 - mask) * frame.
+    left, top, right, bottom, _ = region
+    roi = frame[top : bottom, left : right]
+    blended = roi.astype(numpy.float32)
+    face = face.astype(numpy.float32)
+    numpy.subtract(face, blended, out = face)
+    numpy.multiply(face, mask, out = face)
+    numpy.add(blended, face, out = blended)
+    roi[:] = blended.astype(numpy.uint8)
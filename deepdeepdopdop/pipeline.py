@@ -0,0 +1,101 @@
+import logging as log
+
+import queue
+import threading
+
+from typing import Any, Callable, Iterable, Optional
+
+from .metrics import metrics
+
+# Marks the end of the stream of items passed between the stages.
+_END = object()
+
+class Pipeline:
+    def __init__(self, queue_size : int):
+        self.queue_size = queue_size
+        self.stages : list[tuple[str, Callable[[Any], Any]]] = []
+        self.error : Optional[BaseException] = None
+        self.stop_event = threading.Event()
+
+    def add_stage(self, name : str, function : Callable[[Any], Any]) -> 'Pipeline':
+        self.stages.append((name, function))
+        return self
+
+    def __fail(self, name : str, error : BaseException) -> None:
+        log.error(f'Pipeline stage {name} failed: {error!r}')
+        if self.error is None:
+            self.error = error
+        self.stop_event.set()
+
+    def __put(self, output_queue : queue.Queue, item : Any, name : Optional[str] = None) -> bool:
+        # Blocks while the next stage is busy, that is the backpressure which keeps memory flat.
+        if name:
+            metrics.observe(f'queue_depth_after_{name}', output_queue.qsize())
+        while not self.stop_event.is_set():
+            try:
+                output_queue.put(item, timeout = 0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __get(self, input_queue : queue.Queue) -> Any:
+        while not self.stop_event.is_set():
+            try:
+                return input_queue.get(timeout = 0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def __produce(self, items : Iterable[Any], output_queue : queue.Queue) -> None:
+        try:
+            for item in items:
+                if not self.__put(output_queue, item, 'source'):
+                    return
+        except BaseException as error:
+            self.__fail('source', error)
+        finally:
+            self.__put(output_queue, _END)
+
+    def __work(self, name : str, function : Callable[[Any], Any], input_queue : queue.Queue, output_queue : queue.Queue) -> None:
+        try:
+            while True:
+                item = self.__get(input_queue)
+                if item is _END:
+                    break
+                if not self.__put(output_queue, function(item), name):
+                    return
+        except BaseException as error:
+            self.__fail(name, error)
+        finally:
+            self.__put(output_queue, _END)
+
+    def run(self, items : Iterable[Any], consumer : Callable[[Any], None]) -> None:
+        # Every stage is served by exactly one worker and the queues are FIFO,
+        # so items reach the consumer in the order they were produced.
+        queues = [queue.Queue(maxsize = self.queue_size) for _ in range(len(self.stages) + 1)]
+
+        threads = [threading.Thread(target = self.__produce, args = (items, queues[0]), name = 'pipeline-source', daemon = True)]
+        for index, (name, function) in enumerate(self.stages):
+            threads.append(threading.Thread(target = self.__work, args = (name, function, queues[index], queues[index + 1]), name = f'pipeline-{name}', daemon = True))
+
+        log.info(f'Start pipeline: stages={[name for name, _ in self.stages]}, queue_size={self.queue_size}')
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                item = self.__get(queues[-1])
+                if item is _END:
+                    break
+                consumer(item)
+        except BaseException as error:
+            self.__fail('sink', error)
+        finally:
+            self.stop_event.set()
+            for thread in threads:
+                thread.join()
+
+        if self.error is not None:
+            raise self.error
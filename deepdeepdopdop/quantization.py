@@ -0,0 +1,122 @@
+import logging as log
+
+import cv2
+import numpy
+
+import json
+import os
+import tempfile
+
+from pathlib import Path
+from typing import Optional
+
+from .configuration import Configuration
+from .types import Frame
+
+class FeedCalibrationDataReader:
+    # Inputs of a model recorded while FP32 models processed calibration frames. Calibrators only call get_next,
+    # so the reader is not derived from CalibrationDataReader, which would import onnxruntime with this module.
+    def __init__(self, input_feeds : list[dict[str, numpy.ndarray]]):
+        self.input_feeds = iter(input_feeds)
+
+    def get_next(self) -> Optional[dict[str, numpy.ndarray]]:
+        return next(self.input_feeds, None)
+
+def get_quantized_model_file_path(model_file_path : Path, configuration : Configuration) -> Path:
+    # Quantized models of all stages are stored next to the face swapper model, the size and the time of modification
+    # of the model are parts of the name, so a replaced model gets a new quantized copy.
+    model_stat = model_file_path.stat()
+    return configuration.face_swapper_model_file_path.parent / f'{model_file_path.stem}-{model_stat.st_size}-{int(model_stat.st_mtime)}.int8-{configuration.quantization_mode}.onnx'
+
+def get_calibration_file_path(quantized_model_file_path : Path) -> Path:
+    return quantized_model_file_path.with_suffix('.json')
+
+def _create_temporary_file_path(file_path : Path) -> Path:
+    # Several processes may quantize the same model at once, each one writes its own file and the last one replaces the others.
+    file_path.parent.mkdir(parents = True, exist_ok = True)
+    file_descriptor, temporary_file_path = tempfile.mkstemp(suffix = '.tmp', prefix = f'{file_path.name}.', dir = file_path.parent)
+    os.close(file_descriptor)
+    return Path(temporary_file_path)
+
+def quantize_model_dynamically(model_file_path : Path, quantized_model_file_path : Path) -> None:
+    log.info(f'Quantize model {model_file_path} dynamically to {quantized_model_file_path}')
+
+    # Weights are quantized ahead of time and activations on the fly, so no calibration is needed,
+    # ConvInteger of ONNX Runtime takes only unsigned weights.
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    temporary_file_path = _create_temporary_file_path(quantized_model_file_path)
+    try:
+        quantize_dynamic(str(model_file_path), str(temporary_file_path), weight_type = QuantType.QUInt8)
+        temporary_file_path.replace(quantized_model_file_path)
+    finally:
+        temporary_file_path.unlink(missing_ok = True)
+
+def quantize_model_statically(model_file_path : Path, quantized_model_file_path : Path, input_feeds : list[dict[str, numpy.ndarray]], input_file : Path) -> None:
+    log.info(f'Quantize model {model_file_path} statically to {quantized_model_file_path} by {len(input_feeds)} calibration inputs from file {input_file}')
+
+    # Ranges of activations are taken from the calibration inputs, quantize and dequantize nodes
+    # around operators let ONNX Runtime fuse them into integer kernels.
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+
+    temporary_file_path = _create_temporary_file_path(quantized_model_file_path)
+    try:
+        quantize_static(str(model_file_path), str(temporary_file_path), FeedCalibrationDataReader(input_feeds),
+                        quant_format = QuantFormat.QDQ, activation_type = QuantType.QUInt8, weight_type = QuantType.QInt8, per_channel = True)
+        # The copy fits the input it was calibrated on, which is told when the copy is used for other inputs.
+        get_calibration_file_path(quantized_model_file_path).write_text(json.dumps({ 'input_file': str(input_file), 'calibration_inputs': len(input_feeds) }, indent = 4))
+        temporary_file_path.replace(quantized_model_file_path)
+    finally:
+        temporary_file_path.unlink(missing_ok = True)
+
+def describe_calibration(quantized_model_file_path : Path) -> str:
+    try:
+        calibration = json.loads(get_calibration_file_path(quantized_model_file_path).read_text())
+        return f'input_file={calibration["input_file"]}, calibration_inputs={calibration["calibration_inputs"]}'
+    except (OSError, ValueError, KeyError):
+        return 'input_file=unknown'
+
+def get_session_model_file_path(model_file_path : Path, stage : str, configuration : Configuration) -> Path:
+    # The quantized copy of the model if the stage is quantized, dynamically quantized copies are made on demand,
+    # statically quantized ones need calibration frames, which only an input file gives.
+    if stage not in configuration.quantized_stages:
+        return model_file_path
+
+    quantized_model_file_path = get_quantized_model_file_path(model_file_path, configuration)
+    if not quantized_model_file_path.exists():
+        if configuration.quantization_mode == 'static':
+            log.warning(f'Model {model_file_path} has no statically quantized copy {quantized_model_file_path}, it is made by calibration on frames of an input file, FP32 model is used')
+            return model_file_path
+        quantize_model_dynamically(model_file_path, quantized_model_file_path)
+
+    if configuration.quantization_mode == 'static':
+        log.info(f'Model {quantized_model_file_path} statically quantized to INT8 is used for stage {stage}: {describe_calibration(quantized_model_file_path)}')
+    else:
+        log.info(f'Model {quantized_model_file_path} quantized to INT8 is used for stage {stage}')
+    return quantized_model_file_path
+
+def compute_psnr(image1 : Frame, image2 : Frame) -> float:
+    mse = numpy.mean((image1.astype(numpy.float64) - image2.astype(numpy.float64)) ** 2)
+    # Identical images have infinite PSNR, which JSON has no value for.
+    if mse == 0:
+        return 100.0
+    return float(10 * numpy.log10(255 ** 2 / mse))
+
+def compute_ssim(image1 : Frame, image2 : Frame) -> float:
+    # SSIM of grayscale images with the Gaussian window of 11 pixels and sigma 1.5 of the original paper.
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+
+    x = cv2.cvtColor(image1, cv2.COLOR_BGR2GRAY).astype(numpy.float64)
+    y = cv2.cvtColor(image2, cv2.COLOR_BGR2GRAY).astype(numpy.float64)
+
+    def blur(image : numpy.ndarray) -> numpy.ndarray:
+        return cv2.GaussianBlur(image, (11, 11), 1.5)
+
+    mu_x, mu_y = blur(x), blur(y)
+    sigma_x = blur(x * x) - mu_x * mu_x
+    sigma_y = blur(y * y) - mu_y * mu_y
+    sigma_xy = blur(x * y) - mu_x * mu_y
+
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * sigma_xy + c2)) / ((mu_x * mu_x + mu_y * mu_y + c1) * (sigma_x + sigma_y + c2))
+    return float(ssim_map.mean())
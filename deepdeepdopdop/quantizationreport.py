@@ -0,0 +1,102 @@
+import logging as log
+
+import copy
+import json
+import time
+
+import numpy
+
+from .configuration import Configuration
+from .fileprocessor import FileProcessor
+from .faceprocessor import FaceProcessor, create_face_processor
+from .facetracker import bbox_iou
+from .types import create_face
+from .calibration import read_sample_frames
+from .quantization import compute_psnr, compute_ssim
+
+class QuantizationReport(FileProcessor):
+    # Quantized models and FP32 ones process the same sample frames of the input file, every stage gets the same inputs
+    # from FP32 models, so the drift of every stage is measured apart from the drift of stages before it.
+    def __init__(self, configuration : Configuration, face_processor : FaceProcessor):
+        super().__init__(configuration, face_processor)
+
+        fp32_configuration = copy.copy(self.configuration)
+        fp32_configuration.quantized_stages = []
+        self.fp32_face_processor = create_face_processor(fp32_configuration)
+
+        self.times : dict[str, dict[str, float]] = { stage: { 'fp32': 0.0, 'int8': 0.0 } for stage in ('detection', 'recognition', 'swapper') }
+
+    def __timed(self, stage : str, precision : str, function, *args):
+        start_time = time.perf_counter()
+        result = function(*args)
+        self.times[stage][precision] += time.perf_counter() - start_time
+        return result
+
+    def __summarize(self, stage : str, values : dict[str, list[float]]) -> dict:
+        summary = { 'fp32_time': round(self.times[stage]['fp32'], 3), 'int8_time': round(self.times[stage]['int8'], 3) }
+        summary['speedup'] = round(self.times[stage]['fp32'] / self.times[stage]['int8'], 2) if self.times[stage]['int8'] > 0 else 0
+        summary['quantized'] = stage in self.configuration.quantized_stages
+        for name, items in values.items():
+            summary[f'mean_{name}'] = round(float(numpy.mean(items)), 6) if items else None
+            summary[f'worst_{name}'] = round(float(max(items) if name.endswith('drift') else min(items)), 6) if items else None
+        return summary
+
+    def run(self) -> None:
+        log.info(f'Compare models quantized to INT8 with FP32 ones: stages={self.configuration.quantized_stages}, mode={self.configuration.quantization_mode}')
+
+        frames = read_sample_frames(self.configuration.input_file, self.configuration.quantization_frame_count)
+
+        source_face = self.fp32_face_processor.find_source_face()
+        if isinstance(source_face, list):
+            source_face = source_face[0] if source_face else None
+
+        fp32_face_analyser, int8_face_analyser = self.fp32_face_processor.face_analyser, self.face_processor.face_analyser
+        fp32_face_swapper, int8_face_swapper = self.fp32_face_processor.face_swapper, self.face_processor.face_swapper
+
+        detection_values : dict[str, list[float]] = { 'iou': [] }
+        recognition_values : dict[str, list[float]] = { 'cosine_drift': [] }
+        swapper_values : dict[str, list[float]] = { 'psnr': [], 'ssim': [] }
+        fp32_face_count, int8_face_count = 0, 0
+
+        for frame in frames:
+            fp32_faces = self.__timed('detection', 'fp32', fp32_face_analyser.detect_faces, frame)
+            int8_faces = self.__timed('detection', 'int8', int8_face_analyser.detect_faces, frame)
+            fp32_face_count += len(fp32_faces)
+            int8_face_count += len(int8_faces)
+            for fp32_face in fp32_faces:
+                detection_values['iou'].append(max((bbox_iou(fp32_face.bbox, int8_face.bbox) for int8_face in int8_faces), default = 0.0))
+
+            if not fp32_faces:
+                continue
+
+            int8_faces = [create_face(bbox = face.bbox, kps = face.kps, det_score = face.det_score) for face in fp32_faces]
+            self.__timed('recognition', 'fp32', fp32_face_analyser.recognize_faces, [(face, frame) for face in fp32_faces])
+            self.__timed('recognition', 'int8', int8_face_analyser.recognize_faces, [(face, frame) for face in int8_faces])
+            for fp32_face, int8_face in zip(fp32_faces, int8_faces):
+                recognition_values['cosine_drift'].append(1 - float(numpy.dot(fp32_face.normed_embedding, int8_face.normed_embedding)))
+
+            if source_face:
+                target_faces = [(face, frame) for face in fp32_faces]
+                fp32_swapped_faces = self.__timed('swapper', 'fp32', fp32_face_swapper.swap_faces, source_face, target_faces)
+                int8_swapped_faces = self.__timed('swapper', 'int8', int8_face_swapper.swap_faces, source_face, target_faces)
+                for (fp32_swapped_face, _, _), (int8_swapped_face, _, _) in zip(fp32_swapped_faces, int8_swapped_faces):
+                    swapper_values['psnr'].append(compute_psnr(fp32_swapped_face, int8_swapped_face))
+                    swapper_values['ssim'].append(compute_ssim(fp32_swapped_face, int8_swapped_face))
+
+        report = {
+            'input_file': str(self.configuration.input_file),
+            'quantization_mode': self.configuration.quantization_mode,
+            'quantized_stages': self.configuration.quantized_stages,
+            'execution_provider': self.configuration.execution_provider,
+            'frame_count': len(frames),
+            'detection': dict(self.__summarize('detection', detection_values), fp32_faces = fp32_face_count, int8_faces = int8_face_count),
+            'recognition': self.__summarize('recognition', recognition_values),
+            'swapper': self.__summarize('swapper', swapper_values)
+        }
+
+        for stage in ('detection', 'recognition', 'swapper'):
+            log.info(f'Quantization report of stage {stage}: {report[stage]}')
+
+        self.configuration.quantization_report_file.parent.mkdir(parents = True, exist_ok = True)
+        self.configuration.quantization_report_file.write_text(json.dumps(report, indent = 4))
+        log.info(f'Quantization report is written to file {self.configuration.quantization_report_file}')
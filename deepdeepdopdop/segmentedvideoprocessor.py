@@ -0,0 +1,128 @@
+import logging as log
+
+import copy
+import multiprocessing
+import os
+import tempfile
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional, Union
+
+from .configuration import Configuration
+from .fileprocessor import FileProcessor
+from .faceprocessor import FaceProcessor, create_face_processor
+from .types import Face, create_face
+from .videoio import AVVideoReader
+from .videoio import probe_keyframe_times, concatenate_videos
+from .videoprocessor import VideoProcessor
+from .metrics import metrics
+
+# Every worker process loads its own models once and renders several segments by them.
+_video_processor : Optional[VideoProcessor] = None
+
+def _initialize_worker(configuration : Configuration) -> None:
+    global _video_processor
+
+    log.basicConfig(level = configuration.log_level, format = f'%(processName)s   {configuration.log_format}')
+    _video_processor = VideoProcessor(configuration, create_face_processor(configuration))
+
+def _render_segment(segment_file_path : Path, start_time : float, end_time : Optional[float], source_face : Union[dict, list[dict]], reference_face : Optional[dict]) -> tuple[int, dict]:
+    log.info(f'Render segment from {start_time} sec to {end_time} sec into {segment_file_path}')
+
+    # Metrics of every segment are returned to the main process.
+    metrics.reset()
+
+    # Faces are passed as plain dicts because insightface faces do not survive unpickling,
+    # the reference gallery is not passed at all, workers load it from the source face cache.
+    source_face = [create_face(face) for face in source_face] if isinstance(source_face, list) else create_face(source_face)
+    reference_face = create_face(reference_face) if reference_face else None
+
+    configuration = _video_processor.configuration
+    with AVVideoReader(configuration.input_file, start_time, end_time, configuration.video_decoder_threads) as video_reader:
+        if not video_reader:
+            raise RuntimeError(f'Failed to open video file {configuration.input_file}')
+
+        codec_name = configuration.video_codec or configuration.segment_codec
+        with _video_processor.create_av_video_writer(segment_file_path, codec_name, video_reader) as video_writer:
+            if not video_writer:
+                raise RuntimeError(f'Failed to open video file {segment_file_path}')
+
+            _video_processor.render(video_reader, video_writer, source_face, reference_face)
+            return video_writer.frame_count, metrics.to_dict()
+
+def split_into_segments(keyframe_times : list[float], segment_count : int, duration : float) -> list[tuple[float, Optional[float]]]:
+    # Segment boundaries are the keyframes closest to equal parts of the video.
+    boundaries : list[float] = []
+    for index in range(1, segment_count):
+        time = min(keyframe_times, key = lambda keyframe_time: abs(keyframe_time - duration * index / segment_count))
+        if time > 0 and (not boundaries or time > boundaries[-1]):
+            boundaries.append(time)
+
+    start_times = [0.0] + boundaries
+    end_times : list[Optional[float]] = boundaries + [None]
+    return list(zip(start_times, end_times))
+
+class SegmentedVideoProcessor(FileProcessor):
+    def __init__(self, configuration : Configuration, face_processor : FaceProcessor):
+        super().__init__(configuration, face_processor)
+
+    def run(self) -> None:
+        log.info(f'Process input video file {self.configuration.input_file} in {self.configuration.video_segments} segments')
+
+        self.report_progress('finding faces')
+        source_face = self.face_processor.find_source_face()
+        if not source_face:
+            return
+
+        reference_face : Face = None
+        if self.configuration.reference_frame_time >= 0:
+            reference_face = self.face_processor.find_reference_face_in_video()
+            if not reference_face:
+                return
+
+        with AVVideoReader(self.configuration.input_file) as video_reader:
+            if not video_reader:
+                return
+            fps = video_reader.fps
+            duration = video_reader.duration
+
+        keyframe_times = probe_keyframe_times(self.configuration.input_file)
+        segments = split_into_segments(keyframe_times, self.configuration.video_segments, duration)
+        log.info(f'Video is split into {len(segments)} segments at keyframes: {segments}')
+
+        # The analysis cache is indexed by frames from the start of the video, segments start in the middle.
+        worker_configuration = copy.copy(self.configuration)
+        worker_configuration.analysis_cache = False
+
+        # Workers share the cores of the host, by default every session of every worker would start a thread per core.
+        cpu_count = os.cpu_count() or 1
+        worker_count = min(len(segments), cpu_count)
+        if worker_configuration.intra_op_threads is None:
+            worker_configuration.intra_op_threads = max(cpu_count // worker_count, 1)
+        if worker_configuration.inter_op_threads is None:
+            worker_configuration.inter_op_threads = 1
+        log.info(f'Render segments by {worker_count} workers: intra_op_threads={worker_configuration.intra_op_threads}, inter_op_threads={worker_configuration.inter_op_threads}')
+
+        with tempfile.TemporaryDirectory(prefix = 'deepdeepdopdop-segments-') as directory:
+            segment_file_paths = [Path(directory) / f'segment-{index:04d}.mp4' for index in range(len(segments))]
+
+            source_face_dict = [dict(face) for face in source_face] if isinstance(source_face, list) else dict(source_face)
+            reference_face_dict = dict(reference_face) if isinstance(reference_face, dict) else None
+
+            # Spawned processes do not inherit CUDA or ONNX Runtime state of this process.
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers = worker_count, mp_context = context, initializer = _initialize_worker, initargs = (worker_configuration,)) as executor:
+                futures = [executor.submit(_render_segment, segment_file_path, start_time, end_time, source_face_dict, reference_face_dict) for segment_file_path, (start_time, end_time) in zip(segment_file_paths, segments)]
+                frame_counts : list[int] = []
+                for future in futures:
+                    frame_count, segment_metrics = future.result()
+                    frame_counts.append(frame_count)
+                    metrics.merge(segment_metrics)
+                    self.report_progress('rendering segments', len(frame_counts), len(futures))
+
+            log.info(f'Segments are rendered: frame_counts={frame_counts}')
+
+            # Audio of the input is copied while the segments are concatenated.
+            self.report_progress('concatenating segments')
+            concatenate_videos(segment_file_paths, frame_counts, fps, self.configuration.output_file, self.configuration.input_file)
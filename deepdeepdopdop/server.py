@@ -0,0 +1,347 @@
+import logging as log
+
+import argparse
+import copy
+import itertools
+import json
+import queue
+import socketserver
+import threading
+import time
+import uuid
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Optional
+
+from .configuration import Configuration
+from .fileprocessor import FileProcessor
+from .faceprocessor import FaceProcessor
+from .batchprocessor import create_file_processor
+from .metrics import metrics
+from .utils import is_image, is_video
+
+# Options which a job may change, the others are fixed by the models loaded by the server.
+JOB_OPTIONS : list[str] = [
+    'restore_face',
+    'reference_face_position',
+    'reference_frame_time',
+    'similar_face_distance',
+    'process_video_in_memory',
+    'process_video_in_pipeline',
+    'video_segments',
+    'smart_render',
+    'detection_interval',
+    'reuse_static_frames',
+    'static_frame_threshold',
+    'video_codec',
+    'video_preset',
+    'video_crf',
+    'video_bitrate',
+    'video_gop'
+]
+
+# Finished jobs are kept for their status up to this number, older ones are forgotten, so the server does not grow.
+FINISHED_JOB_LIMIT : int = 1000
+
+def parse_job_option(action : argparse.Action, value : Any) -> Any:
+    # Options of a job are converted like the same command line options, JSON types must fit them.
+    if value is None:
+        if action.default is not None:
+            raise ValueError(f'Option {action.dest} must not be null')
+        return None
+
+    if action.nargs == 0:
+        if not isinstance(value, bool):
+            raise ValueError(f'Option {action.dest} must be true or false')
+        return value
+
+    if isinstance(value, (bool, list, dict)):
+        raise ValueError(f'Option {action.dest} must be a string or a number')
+
+    try:
+        value = action.type(str(value)) if action.type else str(value)
+    except (TypeError, ValueError, argparse.ArgumentTypeError) as error:
+        raise ValueError(f'Option {action.dest} has invalid value {value}: {error}')
+
+    if action.choices and value not in action.choices:
+        raise ValueError(f'Option {action.dest} must be one of {list(action.choices)}')
+    return value
+
+class Job:
+    def __init__(self, request : dict, priority : int):
+        self.id : str = uuid.uuid4().hex
+        self.request = request
+        self.priority = priority
+        self.status : str = 'queued'
+        self.stage : Optional[str] = None
+        self.done : int = 0
+        self.total : int = 0
+        self.error : Optional[str] = None
+        self.output_file : Optional[Path] = None
+        self.configuration : Optional[Configuration] = None
+        self.created_time : float = time.time()
+        self.started_time : Optional[float] = None
+        self.finished_time : Optional[float] = None
+        # Seconds spent in every stage reported by the file processor.
+        self.stage_times : dict[str, float] = {}
+        self.stage_start_time : float = 0
+
+    def report_progress(self, stage : str, done : int, total : int) -> None:
+        now = time.perf_counter()
+        if stage != self.stage:
+            self.__finish_stage(now)
+            self.stage = stage
+            self.stage_start_time = now
+        self.done = done
+        self.total = total
+
+    def __finish_stage(self, now : float) -> None:
+        if self.stage:
+            self.stage_times[self.stage] = round(self.stage_times.get(self.stage, 0.0) + now - self.stage_start_time, 3)
+
+    def finish(self, status : str, error : Optional[str] = None) -> None:
+        self.__finish_stage(time.perf_counter())
+        self.stage = None
+        self.status = status
+        self.error = error
+        self.finished_time = time.time()
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'priority': self.priority,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': { 'done': self.done, 'total': self.total },
+            'stage_times': self.stage_times,
+            'error': self.error,
+            'output_file': str(self.output_file) if self.output_file else None,
+            'created_time': self.created_time,
+            'started_time': self.started_time,
+            'finished_time': self.finished_time
+        }
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class Server(FileProcessor):
+    # Models are loaded once and jobs are taken over a local HTTP API, instead of a process per file.
+    def __init__(self, configuration : Configuration, face_processor : FaceProcessor):
+        super().__init__(configuration, face_processor)
+
+        self.jobs : dict[str, Job] = {}
+        self.jobs_lock = threading.Lock()
+
+        # Jobs with lower priority run first, jobs with the same priority run in order of arrival.
+        self.queue : queue.PriorityQueue = queue.PriorityQueue(maxsize = self.configuration.server_queue_size)
+        self.sequence = itertools.count()
+
+        self.option_actions : dict[str, argparse.Action] = {action.dest: action for action in Configuration.create_argument_parser()._actions if action.dest in JOB_OPTIONS}
+
+    def __create_job_configuration(self, job : Job) -> Configuration:
+        request = job.request
+        configuration = copy.copy(self.configuration)
+
+        configuration.source_face_image_file = Path(request['source_face_image_file'])
+        configuration.input_file = Path(request['input_file'])
+        configuration.output_file = Path(request['output_file']) if request.get('output_file') else configuration.get_default_output_file(configuration.input_file)
+
+        options = request.get('options', {})
+        if not isinstance(options, dict):
+            raise ValueError('Options of a job must be an object')
+
+        for name, value in options.items():
+            if name not in JOB_OPTIONS:
+                raise ValueError(f'Option {name} can not be changed by a job')
+            setattr(configuration, name, parse_job_option(self.option_actions[name], value))
+
+        if not configuration.source_face_image_file.exists() or not is_image(configuration.source_face_image_file):
+            raise ValueError(f'Source face image file {configuration.source_face_image_file} does not exist or is not image')
+        if not is_image(configuration.input_file) and not is_video(configuration.input_file):
+            raise ValueError(f'Input file {configuration.input_file} does not exist or is not image or video')
+        if configuration.output_file.exists():
+            raise ValueError(f'Output file {configuration.output_file} already exists')
+
+        # A job is validated like a command line of a single file, so invalid options fail before it is queued.
+        configuration.serve = False
+        if not configuration.validate():
+            raise ValueError('Job options are not valid, see the server log')
+
+        return configuration
+
+    def __run_job(self, job : Job) -> None:
+        log.info(f'Start job {job.id}: {job.request}')
+        job.status = 'running'
+        job.started_time = time.time()
+
+        try:
+            configuration = job.configuration
+
+            file_processor = create_file_processor(configuration, self.face_processor.with_configuration(configuration))
+            file_processor.progress_callback = job.report_progress
+            file_processor.run()
+
+            if configuration.output_file.exists():
+                job.finish('done')
+            else:
+                job.finish('failed', 'No output file is written, see the server log')
+        except Exception as error:
+            log.exception(f'Job {job.id} failed')
+            job.finish('failed', str(error))
+
+        log.info(f'Finish job {job.id}: status={job.status}, stage_times={job.stage_times}')
+        self.__forget_finished_jobs()
+        metrics.write(self.configuration.metrics_file, self.configuration.prometheus_file)
+
+    def __forget_finished_jobs(self) -> None:
+        with self.jobs_lock:
+            finished_jobs = sorted((job for job in self.jobs.values() if job.finished_time is not None), key = lambda job: job.finished_time)
+            for job in finished_jobs[: max(len(finished_jobs) - FINISHED_JOB_LIMIT, 0)]:
+                del self.jobs[job.id]
+
+    def __work(self) -> None:
+        while True:
+            _, _, job = self.queue.get()
+            if job is None:
+                break
+            self.__run_job(job)
+
+    def submit(self, request : dict) -> Job:
+        if not isinstance(request, dict):
+            raise TypeError('Job must be a JSON object')
+        for name in ('source_face_image_file', 'input_file'):
+            if not request.get(name):
+                raise ValueError(f'Job has no {name}')
+
+        job = Job(request, int(request.get('priority', 0)))
+        job.configuration = self.__create_job_configuration(job)
+        job.output_file = job.configuration.output_file
+
+        with self.jobs_lock:
+            self.jobs[job.id] = job
+
+        try:
+            self.queue.put_nowait((job.priority, next(self.sequence), job))
+        except queue.Full:
+            with self.jobs_lock:
+                del self.jobs[job.id]
+            raise
+
+        metrics.observe('server_queue_depth', self.queue.qsize())
+        log.info(f'Job {job.id} is queued with priority {job.priority}, {self.queue.qsize()} jobs are queued')
+        return job
+
+    def get_job(self, job_id : str) -> Optional[Job]:
+        with self.jobs_lock:
+            return self.jobs.get(job_id)
+
+    def get_jobs(self) -> list[Job]:
+        with self.jobs_lock:
+            return list(self.jobs.values())
+
+    def __create_http_server(self) -> socketserver.BaseServer:
+        handler_class = type('ServerRequestHandler', (RequestHandler,), { 'server_application': self })
+
+        if self.configuration.server_socket:
+            if self.configuration.server_socket.exists():
+                self.configuration.server_socket.unlink()
+            log.info(f'Listen on Unix socket {self.configuration.server_socket}')
+            return UnixHTTPServer(str(self.configuration.server_socket), handler_class)
+
+        log.info(f'Listen on http://{self.configuration.server_host}:{self.configuration.server_port}')
+        return ThreadingHTTPServer((self.configuration.server_host, self.configuration.server_port), handler_class)
+
+    def run(self) -> None:
+        # Models are loaded before the first job comes, so its latency is only the inference time.
+        self.face_processor.face_analyser
+        self.face_processor.face_swapper
+        if self.configuration.restore_face:
+            self.face_processor.face_restorer
+
+        workers = [threading.Thread(target = self.__work, name = f'job-worker-{index}', daemon = True) for index in range(self.configuration.server_workers)]
+        for worker in workers:
+            worker.start()
+
+        http_server = self.__create_http_server()
+        try:
+            http_server.serve_forever()
+        except KeyboardInterrupt:
+            log.info('Stop server')
+        finally:
+            http_server.server_close()
+            if self.configuration.server_socket and self.configuration.server_socket.exists():
+                self.configuration.server_socket.unlink()
+
+        # Running jobs are finished, queued jobs are dropped.
+        for _ in workers:
+            self.queue.put((float('-inf'), next(self.sequence), None))
+        for worker in workers:
+            worker.join()
+
+class RequestHandler(BaseHTTPRequestHandler):
+    server_application : Server = None
+
+    def log_message(self, format : str, *args) -> None:
+        # Clients of Unix sockets have no address.
+        log.debug(f'HTTP {format % args}')
+
+    def __send(self, status : int, body : Any) -> None:
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def __send_text(self, status : int, text : str) -> None:
+        content = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self) -> None:
+        path = self.path.rstrip('/')
+        if path == '/health':
+            self.__send(200, { 'status': 'ok', 'queued_jobs': self.server_application.queue.qsize() })
+        elif path == '/metrics':
+            self.__send_text(200, metrics.to_prometheus())
+        elif path == '/jobs':
+            self.__send(200, [job.to_dict() for job in self.server_application.get_jobs()])
+        elif path.startswith('/jobs/'):
+            job = self.server_application.get_job(path[len('/jobs/') :])
+            if job:
+                self.__send(200, job.to_dict())
+            else:
+                self.__send(404, { 'error': 'Job not found' })
+        else:
+            self.__send(404, { 'error': 'Not found' })
+
+    def do_POST(self) -> None:
+        if self.path.rstrip('/') != '/jobs':
+            self.__send(404, { 'error': 'Not found' })
+            return
+
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(content_length) or b'{}')
+        except json.JSONDecodeError as error:
+            self.__send(400, { 'error': f'Job is not valid JSON: {error}' })
+            return
+        except ValueError as error:
+            self.__send(400, { 'error': str(error) })
+            return
+
+        if not isinstance(request, dict):
+            self.__send(400, { 'error': 'Job must be a JSON object' })
+            return
+
+        try:
+            job = self.server_application.submit(request)
+            self.__send(202, job.to_dict())
+        except queue.Full:
+            self.__send(503, { 'error': 'Job queue is full' })
+        except (ValueError, TypeError) as error:
+            self.__send(400, { 'error': str(error) })
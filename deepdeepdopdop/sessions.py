@@ -0,0 +1,213 @@
+import logging as log
+
+import numpy
+import onnx
+
+import json
+import os
+import threading
+
+import warnings
+warnings.filterwarnings('ignore', category = FutureWarning, module = 'insightface')
+
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, Union
+
+from .configuration import Configuration
+
+# onnxruntime and insightface are imported when the first session is created, so commands which load no model do not wait for them.
+if TYPE_CHECKING:
+    import onnxruntime
+
+# Names of members of onnxruntime.GraphOptimizationLevel and onnxruntime.ExecutionMode by option values.
+GRAPH_OPTIMIZATION_LEVELS : dict[str, str] = {
+    'disable': 'ORT_DISABLE_ALL',
+    'basic': 'ORT_ENABLE_BASIC',
+    'extended': 'ORT_ENABLE_EXTENDED',
+    'all': 'ORT_ENABLE_ALL'
+}
+
+EXECUTION_MODES : dict[str, str] = {
+    'sequential': 'ORT_SEQUENTIAL',
+    'parallel': 'ORT_PARALLEL'
+}
+
+class BoundSession:
+    # Runs a session like InferenceSession.run, but with outputs bound to arrays of known shapes, which ONNX Runtime
+    # writes into without allocating its own tensors and copying them. Every run gets new output arrays, because
+    # callers keep outputs of several runs, only buffers of inputs on the device are reused.
+    def __init__(self, session : 'onnxruntime.InferenceSession', device : str):
+        self.session = session
+        self.device = device
+        # Models are shared between threads of the pipeline, batch and server, every thread has its own buffers.
+        self.local = threading.local()
+
+    def __getattr__(self, name : str):
+        return getattr(self.session, name)
+
+    def run(self, output_names : Optional[list[str]], input_feed : dict[str, numpy.ndarray], run_options = None) -> list[numpy.ndarray]:
+        if not hasattr(self.local, 'io_binding'):
+            self.local.io_binding = self.session.io_binding()
+            self.local.buffers = {}
+
+        output_names = output_names or [output.name for output in self.session.get_outputs()]
+        key = (tuple(output_names), tuple((name, value.shape, value.dtype.str) for name, value in input_feed.items()))
+
+        buffers = self.local.buffers.get(key)
+        if buffers is None:
+            # The first run with these shapes tells shapes and types of outputs, inputs are copied
+            # to buffers on the device if it is not CPU, CPU inputs are bound as they are.
+            outputs = self.session.run(output_names, input_feed, run_options)
+            input_values = {}
+            if self.device != 'cpu':
+                import onnxruntime
+
+                input_values = {name: onnxruntime.OrtValue.ortvalue_from_shape_and_type(value.shape, value.dtype, self.device, 0) for name, value in input_feed.items()}
+            self.local.buffers[key] = (input_values, [(output.shape, output.dtype) for output in outputs])
+            return outputs
+
+        input_values, output_types = buffers
+        outputs = [numpy.empty(shape, dtype) for shape, dtype in output_types]
+        io_binding = self.local.io_binding
+        io_binding.clear_binding_inputs()
+        io_binding.clear_binding_outputs()
+
+        for name, value in input_feed.items():
+            value = numpy.ascontiguousarray(value)
+            if name in input_values:
+                input_values[name].update_inplace(value)
+                io_binding.bind_ortvalue_input(name, input_values[name])
+            else:
+                io_binding.bind_cpu_input(name, value)
+
+        for name, output in zip(output_names, outputs):
+            io_binding.bind_output(name, 'cpu', 0, output.dtype.type, output.shape, output.ctypes.data)
+
+        self.session.run_with_iobinding(io_binding, run_options)
+        return outputs
+
+def get_optimized_model_file_path(model_file_path : Path, configuration : Configuration) -> Path:
+    # Optimizations depend on the execution provider, the level and ONNX Runtime version, so they are parts of the name.
+    import onnxruntime
+
+    model_stat = model_file_path.stat()
+    name = f'{model_file_path.stem}-{model_stat.st_size}-{int(model_stat.st_mtime)}.{configuration.execution_provider}.{configuration.graph_optimization_level}.ort-{onnxruntime.__version__}.onnx'
+    return configuration.cache_directory / 'models' / name
+
+def load_session_tuning(configuration : Configuration) -> dict:
+    # Thread counts are tuned for the execution provider and the number of CPUs of the host.
+    if not configuration.session_tuning_file or not configuration.session_tuning_file.exists():
+        return {}
+
+    try:
+        session_tuning = json.loads(configuration.session_tuning_file.read_text())
+    except (OSError, ValueError) as error:
+        log.warning(f'Failed to read session tuning file {configuration.session_tuning_file}: {error}')
+        return {}
+
+    if session_tuning.get('execution_provider') != configuration.execution_provider or session_tuning.get('cpu_count') != os.cpu_count():
+        log.warning(f'Session tuning file {configuration.session_tuning_file} is made for another host or execution provider, it is not used')
+        return {}
+    return session_tuning
+
+def create_session_options(configuration : Configuration) -> 'onnxruntime.SessionOptions':
+    import onnxruntime
+
+    session_options = onnxruntime.SessionOptions()
+    session_options.log_severity_level = configuration.onnxruntime_logging_severity
+
+    intra_op_threads = configuration.intra_op_threads
+    inter_op_threads = configuration.inter_op_threads
+    if intra_op_threads is None or inter_op_threads is None:
+        session_tuning = load_session_tuning(configuration)
+        intra_op_threads = session_tuning.get('intra_op_threads', 0) if intra_op_threads is None else intra_op_threads
+        inter_op_threads = session_tuning.get('inter_op_threads', 0) if inter_op_threads is None else inter_op_threads
+
+    session_options.intra_op_num_threads = intra_op_threads
+    session_options.inter_op_num_threads = inter_op_threads
+    session_options.execution_mode = getattr(onnxruntime.ExecutionMode, EXECUTION_MODES[configuration.execution_mode])
+    session_options.enable_cpu_mem_arena = configuration.cpu_memory_arena
+    session_options.enable_mem_pattern = configuration.memory_pattern
+    if not configuration.thread_spinning:
+        session_options.add_session_config_entry('session.intra_op.allow_spinning', '0')
+        session_options.add_session_config_entry('session.inter_op.allow_spinning', '0')
+
+    log.info(f'Session options: intra_op_threads={intra_op_threads}, inter_op_threads={inter_op_threads}, execution_mode={configuration.execution_mode}, graph_optimization_level={configuration.graph_optimization_level}, cpu_memory_arena={configuration.cpu_memory_arena}, memory_pattern={configuration.memory_pattern}, thread_spinning={configuration.thread_spinning}, io_binding={configuration.io_binding}')
+    return session_options
+
+def create_session(model_file_path : Path, configuration : Configuration) -> Union['onnxruntime.InferenceSession', BoundSession]:
+    import onnxruntime
+
+    onnxruntime.set_default_logger_severity(configuration.onnxruntime_logging_severity)
+
+    session_options = create_session_options(configuration)
+
+    optimized_model_file_path = get_optimized_model_file_path(model_file_path, configuration)
+    if configuration.graph_optimization_level == 'disable':
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
+        session_model_file_path = model_file_path
+    elif optimized_model_file_path.exists():
+        # The graph was optimized and saved by a previous run, so optimization is skipped.
+        log.info(f'Load optimized model {optimized_model_file_path} of {model_file_path}')
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
+        session_model_file_path = optimized_model_file_path
+    else:
+        log.info(f'Optimize model {model_file_path} and save it to {optimized_model_file_path}')
+        optimized_model_file_path.parent.mkdir(parents = True, exist_ok = True)
+        session_options.graph_optimization_level = getattr(onnxruntime.GraphOptimizationLevel, GRAPH_OPTIMIZATION_LEVELS[configuration.graph_optimization_level])
+        session_options.optimized_model_filepath = str(optimized_model_file_path)
+        session_model_file_path = model_file_path
+
+    session = onnxruntime.InferenceSession(str(session_model_file_path), sess_options = session_options, providers = [configuration.execution_provider])
+    if configuration.io_binding:
+        return BoundSession(session, 'cuda' if configuration.execution_provider == 'CUDAExecutionProvider' else 'cpu')
+    return session
+
+def has_dynamic_batch(session) -> bool:
+    # ONNX Runtime gives dynamic dimensions by their names or as None, fixed ones as numbers.
+    return all(not isinstance(session_input.shape[0], int) for session_input in session.get_inputs() if session_input.shape)
+
+def get_model_taskname(model_file_path : Path) -> Optional[str]:
+    # The same rules as insightface ModelRouter uses, but without creating a session.
+    model = onnx.load(str(model_file_path), load_external_data = False)
+
+    initializer_names = set(initializer.name for initializer in model.graph.initializer)
+    inputs = [value for value in model.graph.input if value.name not in initializer_names]
+    input_shape = [dim.dim_value for dim in inputs[0].type.tensor_type.shape.dim]
+
+    if len(model.graph.output) >= 5:
+        return 'detection'
+    elif input_shape[2] == 192 and input_shape[3] == 192:
+        return 'landmark'
+    elif input_shape[2] == 96 and input_shape[3] == 96:
+        return 'genderage'
+    elif len(inputs) == 2 and input_shape[2] == 128 and input_shape[3] == 128:
+        return 'inswapper'
+    elif input_shape[2] == input_shape[3] and input_shape[2] >= 112 and input_shape[2] % 16 == 0:
+        return 'recognition'
+    return None
+
+def load_model(model_file_path : Path, configuration : Configuration, session_model_file_path : Optional[Path] = None):
+    # insightface models read mean, std or emap from the original model file,
+    # while the session may run a derived one, like a batched or an optimized copy.
+    from insightface.model_zoo.arcface_onnx import ArcFaceONNX
+    from insightface.model_zoo.attribute import Attribute
+    from insightface.model_zoo.inswapper import INSwapper
+    from insightface.model_zoo.landmark import Landmark
+    from insightface.model_zoo.retinaface import RetinaFace
+
+    taskname = get_model_taskname(model_file_path)
+    session = create_session(session_model_file_path or model_file_path, configuration)
+
+    if taskname == 'detection':
+        return RetinaFace(model_file = str(model_file_path), session = session)
+    elif taskname == 'landmark':
+        return Landmark(model_file = str(model_file_path), session = session)
+    elif taskname == 'genderage':
+        return Attribute(model_file = str(model_file_path), session = session)
+    elif taskname == 'inswapper':
+        return INSwapper(model_file = str(model_file_path), session = session)
+    elif taskname == 'recognition':
+        return ArcFaceONNX(model_file = str(model_file_path), session = session)
+
+    raise ValueError(f'Model {model_file_path} is not recognized')
@@ -0,0 +1,97 @@
+import logging as log
+
+import copy
+import json
+import os
+import time
+
+import numpy
+
+from pathlib import Path
+
+from .configuration import Configuration
+from .fileprocessor import FileProcessor
+from .sessions import create_session
+
+TENSOR_TYPES : dict[str, type] = {
+    'tensor(float)': numpy.float32,
+    'tensor(float16)': numpy.float16,
+    'tensor(int64)': numpy.int64
+}
+
+# Runs of a model before measuring, which let ONNX Runtime allocate memory and start threads.
+WARMUP_RUN_COUNT : int = 3
+MEASURED_RUN_COUNT : int = 20
+
+# The smallest thread count which is slower than the fastest one by at most this fraction is chosen,
+# so cores which give almost nothing stay free for other jobs of the host.
+THREAD_COUNT_TOLERANCE : float = 0.05
+
+def get_thread_counts(cpu_count : int) -> list[int]:
+    thread_counts = [1]
+    while thread_counts[-1] * 2 < cpu_count:
+        thread_counts.append(thread_counts[-1] * 2)
+    if thread_counts[-1] != cpu_count:
+        thread_counts.append(cpu_count)
+    return thread_counts
+
+class SessionTuner(FileProcessor):
+    # Models of the face analyser and the face swapper run with random inputs and different numbers of intra-op threads,
+    # the chosen number is written to the session tuning file, which sessions of later runs read.
+    def __create_inputs(self, session) -> dict[str, numpy.ndarray]:
+        # Dynamic dimensions are a single item and the face detection size.
+        detection_width, detection_height = self.configuration.face_detection_size
+        inputs : dict[str, numpy.ndarray] = {}
+        for session_input in session.get_inputs():
+            shape = [dim if isinstance(dim, int) else (1, 3, detection_height, detection_width)[index] for index, dim in enumerate(session_input.shape)]
+            inputs[session_input.name] = numpy.random.default_rng(0).standard_normal(shape).astype(TENSOR_TYPES.get(session_input.type, numpy.float32))
+        return inputs
+
+    def __measure(self, model_file_path : Path, configuration : Configuration) -> float:
+        session = create_session(model_file_path, configuration)
+        inputs = self.__create_inputs(session)
+
+        for _ in range(WARMUP_RUN_COUNT):
+            session.run(None, inputs)
+
+        start_time = time.perf_counter()
+        for _ in range(MEASURED_RUN_COUNT):
+            session.run(None, inputs)
+        return (time.perf_counter() - start_time) / MEASURED_RUN_COUNT
+
+    def run(self) -> None:
+        cpu_count = os.cpu_count() or 1
+        thread_counts = get_thread_counts(cpu_count)
+
+        # Models are prepared and downloaded by the processors, sessions are created again for every thread count.
+        self.face_processor.face_swapper
+        model_file_paths = [Path(model.model_file) for model in self.face_processor.face_analyser.models.values()]
+        model_file_paths.append(self.configuration.face_swapper_model_file_path)
+
+        log.info(f'Tune sessions on {cpu_count} CPUs: provider={self.configuration.execution_provider}, thread_counts={thread_counts}, models={[str(model_file_path) for model_file_path in model_file_paths]}')
+
+        results : dict[str, dict[str, float]] = {}
+        total_times : dict[int, float] = {}
+        for thread_count in thread_counts:
+            configuration = copy.copy(self.configuration)
+            configuration.intra_op_threads = thread_count
+            configuration.inter_op_threads = 1
+            configuration.io_binding = False
+
+            model_times = { model_file_path.name: self.__measure(model_file_path, configuration) for model_file_path in model_file_paths }
+            results[str(thread_count)] = { name: round(model_time * 1000, 3) for name, model_time in model_times.items() }
+            total_times[thread_count] = sum(model_times.values())
+            log.info(f'Intra-op threads {thread_count}: total={total_times[thread_count] * 1000:.1f} msec, models={results[str(thread_count)]}')
+
+        best_time = min(total_times.values())
+        intra_op_threads = min(thread_count for thread_count, total_time in total_times.items() if total_time <= best_time * (1 + THREAD_COUNT_TOLERANCE))
+
+        session_tuning = {
+            'execution_provider': self.configuration.execution_provider,
+            'cpu_count': cpu_count,
+            'intra_op_threads': intra_op_threads,
+            'results': results
+        }
+        self.configuration.session_tuning_file.parent.mkdir(parents = True, exist_ok = True)
+        self.configuration.session_tuning_file.write_text(json.dumps(session_tuning, indent = 4))
+        log.info(f'Intra-op threads {intra_op_threads} are chosen, session tuning is written to file {self.configuration.session_tuning_file}')
@@ -0,0 +1,192 @@
+import logging as log
+
+import bisect
+import copy
+import tempfile
+
+from tqdm import tqdm
+from pathlib import Path
+from typing import Optional, Union
+
+from .configuration import Configuration
+from .fileprocessor import FileProcessor
+from .faceprocessor import FaceProcessor
+from .types import Face
+from .videoio import AVVideoReader, AVVideoWriter
+from .videoio import VideoStitcher
+from .videoio import check_stitchable, get_encoder_profile_options, get_profile_level
+from .videoio import probe_keyframe_times, probe_open_gops, probe_video_encoder_name, probe_video_extradata
+from .videoprocessor import VideoProcessor
+
+# Codecs whose parameter sets can be carried in band, so copied and rendered GOPs can be stitched.
+SMART_RENDER_CODECS : list[str] = ['h264', 'hevc']
+
+def plan_video_ranges(keyframe_times : list[float], changed_frame_times : list[float], margin : float) -> list[tuple[float, Optional[float], bool]]:
+    # A GOP from a keyframe to the next one is rendered if a changed frame is in it or within the margin around it,
+    # neighbouring GOPs which are both rendered or both copied are merged into one range.
+    keyframe_times = sorted(set(keyframe_times))
+    changed_frame_times = sorted(changed_frame_times)
+
+    video_ranges : list[tuple[float, Optional[float], bool]] = []
+    for start_time, end_time in zip(keyframe_times, keyframe_times[1:] + [None]):
+        index = bisect.bisect_left(changed_frame_times, start_time - margin)
+        render = index < len(changed_frame_times) and (end_time is None or changed_frame_times[index] < end_time + margin)
+
+        if video_ranges and video_ranges[-1][2] == render:
+            video_ranges[-1] = (video_ranges[-1][0], end_time, render)
+        else:
+            video_ranges.append((start_time, end_time, render))
+
+    return video_ranges
+
+class SmartVideoProcessor(FileProcessor):
+    # Only GOPs with target faces are decoded and encoded again, other GOPs are copied from the input as they are,
+    # which is faster and keeps their original quality.
+    def __init__(self, configuration : Configuration, face_processor : FaceProcessor):
+        super().__init__(configuration, face_processor)
+
+        # Ranges start in the middle of the video, where the analysis cache indexed from its start does not fit.
+        render_configuration = copy.copy(self.configuration)
+        render_configuration.analysis_cache = False
+        self.video_processor = VideoProcessor(render_configuration, self.face_processor.with_configuration(render_configuration))
+
+        # Options of the encoder of ranges on top of the encoder options of the configuration.
+        self.range_encoder_options : dict[str, str] = {}
+
+    def __find_changed_frame_times(self, reference_face : Optional[Face]) -> list[float]:
+        # Presence of target faces is checked in every Nth frame only, frames are decoded but not swapped or encoded.
+        interval = self.configuration.smart_render_interval
+        changed_frame_times : list[float] = []
+
+        with AVVideoReader(self.configuration.input_file, thread_count = self.configuration.video_decoder_threads) as video_reader:
+            if not video_reader:
+                return changed_frame_times
+
+            with tqdm(desc = 'Finding changed frames', total = video_reader.frame_count, unit = 'frames') as progress:
+                for frame_index, frame in enumerate(video_reader):
+                    if frame_index % interval == 0:
+                        frame_analysis = self.face_processor.face_analyser.analyze_frame(frame)
+                        frame_reference_face = self.face_processor.find_reference_face_in_video_frame(frame_analysis, reference_face)
+                        if frame_reference_face and self.face_processor.find_target_faces(frame_analysis, frame_reference_face):
+                            changed_frame_times.append(video_reader.timestamp / 1000)
+
+                    progress.update(1)
+                    self.report_progress('finding changed frames', progress.n, video_reader.frame_count)
+
+        return changed_frame_times
+
+    def __create_range_writer(self, segment_file_path : Path, encoder_name : str, pixel_format : str, video_reader : AVVideoReader) -> AVVideoWriter:
+        # The encoder of the input codec with its pixel format, profile and level, without B-frames decoding timestamps
+        # of a rendered range do not go back before the copied range in front of it.
+        video_writer = self.video_processor.create_av_video_writer(segment_file_path, encoder_name, video_reader)
+        video_writer.pixel_format = pixel_format
+
+        options = dict(video_writer.options)
+        for name, value in self.range_encoder_options.items():
+            options[name] = f'{options[name]}:{value}' if name == 'x265-params' and name in options else value
+        video_writer.options = options
+        return video_writer
+
+    def __check_range_encoder(self, segment_file_path : Path, encoder_name : str, pixel_format : str, codec_name : str, extradata : Optional[bytes]) -> None:
+        # The first frame of the input is encoded like ranges before any range is rendered,
+        # so a video whose ranges can not be stitched is rendered entirely right away.
+        with AVVideoReader(self.configuration.input_file, thread_count = self.configuration.video_decoder_threads) as video_reader:
+            if not video_reader:
+                raise RuntimeError(f'Failed to open video file {self.configuration.input_file}')
+
+            with self.__create_range_writer(segment_file_path, encoder_name, pixel_format, video_reader) as video_writer:
+                if not video_writer:
+                    raise RuntimeError(f'Failed to open video file {segment_file_path}')
+                # The encoder is opened by the first frame, options it rejects raise ValueError of PyAV.
+                for frame in video_reader:
+                    video_writer.write(frame)
+                    break
+
+        check_stitchable(codec_name, extradata, probe_video_extradata(segment_file_path))
+
+    def __render_range(self, segment_file_path : Path, start_time : float, end_time : Optional[float], encoder_name : str, pixel_format : str, source_face : Union[Face, list[Face]], reference_face : Optional[Face]) -> None:
+        log.info(f'Render range from {start_time} sec to {end_time} sec into {segment_file_path}')
+
+        with AVVideoReader(self.configuration.input_file, start_time, end_time, self.configuration.video_decoder_threads) as video_reader:
+            if not video_reader:
+                raise RuntimeError(f'Failed to open video file {self.configuration.input_file}')
+
+            with self.__create_range_writer(segment_file_path, encoder_name, pixel_format, video_reader) as video_writer:
+                if not video_writer:
+                    raise RuntimeError(f'Failed to open video file {segment_file_path}')
+                self.video_processor.render(video_reader, video_writer, source_face, reference_face)
+
+    def run(self) -> None:
+        log.info(f'Process input video file {self.configuration.input_file} by smart render')
+        self.video_processor.progress_callback = self.progress_callback
+
+        with AVVideoReader(self.configuration.input_file) as video_reader:
+            if not video_reader:
+                return
+            codec_name = video_reader.stream.codec_context.name
+            pixel_format = video_reader.stream.codec_context.pix_fmt
+            extradata = video_reader.stream.codec_context.extradata
+            fps = video_reader.fps
+
+        if codec_name not in SMART_RENDER_CODECS or probe_open_gops(self.configuration.input_file):
+            log.warning(f'Smart render supports only {SMART_RENDER_CODECS} video with closed GOPs, video of codec {codec_name} is rendered entirely')
+            self.video_processor.run()
+            return
+
+        encoder_name = probe_video_encoder_name(self.configuration.input_file)
+        if self.configuration.video_codec and self.configuration.video_codec != encoder_name:
+            log.warning(f'Smart render encodes video by the encoder {encoder_name} of the input codec instead of {self.configuration.video_codec}')
+
+        self.range_encoder_options = dict(get_encoder_profile_options(encoder_name, get_profile_level(codec_name, extradata)), bf = '0')
+        with tempfile.TemporaryDirectory(prefix = 'deepdeepdopdop-smart-render-') as directory:
+            try:
+                self.__check_range_encoder(Path(directory) / 'probe.mp4', encoder_name, pixel_format, codec_name, extradata)
+            except ValueError as error:
+                log.warning(f'Ranges encoded by {encoder_name} can not be stitched with copied ones, video is rendered entirely: {error}')
+                self.video_processor.run()
+                return
+
+        self.report_progress('finding faces')
+        source_face = self.face_processor.find_source_face()
+        if not source_face:
+            return
+
+        reference_face : Face = None
+        if self.configuration.reference_frame_time >= 0:
+            reference_face = self.face_processor.find_reference_face_in_video()
+            if not reference_face:
+                return
+
+        changed_frame_times = self.__find_changed_frame_times(reference_face)
+        keyframe_times = probe_keyframe_times(self.configuration.input_file)
+        if not keyframe_times:
+            log.warning('Video has no keyframes, it is rendered entirely')
+            self.video_processor.run()
+            return
+
+        # Frames between the checked ones may have target faces too.
+        margin = self.configuration.smart_render_interval / fps if fps else 0
+        video_ranges = plan_video_ranges(keyframe_times, changed_frame_times, margin)
+
+        rendered_ranges = [(start_time, end_time) for start_time, end_time, render in video_ranges if render]
+        log.info(f'Video has {len(keyframe_times)} GOPs, {len(changed_frame_times)} checked frames with target faces, {len(rendered_ranges)} of {len(video_ranges)} ranges are rendered: {video_ranges}')
+
+        with tempfile.TemporaryDirectory(prefix = 'deepdeepdopdop-smart-render-') as directory:
+            segment_file_paths : dict[float, Path] = {}
+            for index, (start_time, end_time) in enumerate(rendered_ranges):
+                self.report_progress('rendering ranges', index, len(rendered_ranges))
+                segment_file_paths[start_time] = Path(directory) / f'range-{index:04d}.mp4'
+                self.__render_range(segment_file_paths[start_time], start_time, end_time, encoder_name, pixel_format, source_face, reference_face)
+
+            self.report_progress('stitching ranges')
+            try:
+                with VideoStitcher(self.configuration.input_file, self.configuration.output_file) as video_stitcher:
+                    for start_time, end_time, render in video_ranges:
+                        if render:
+                            video_stitcher.append(segment_file_paths[start_time], start_time)
+                        else:
+                            video_stitcher.copy(start_time, end_time)
+            except ValueError as error:
+                log.warning(f'Rendered ranges can not be stitched with copied ones, video is rendered entirely: {error}')
+                self.configuration.output_file.unlink(missing_ok = True)
+                self.video_processor.run()
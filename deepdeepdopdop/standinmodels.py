@@ -0,0 +1,124 @@
+import logging as log
+
+import numpy
+import onnx
+
+from onnx import TensorProto, helper, numpy_helper
+from pathlib import Path
+
+# Tiny models with the same inputs and outputs as the models of the application, so the whole
+# processing runs offline and its overhead is measured without the cost of real inference.
+
+# Feature maps of RetinaFace of the buffalo_l pack, every point of them has two anchors.
+DETECTION_STRIDES : list[int] = [8, 16, 32]
+DETECTION_ANCHOR_COUNT : int = 2
+
+def save_model(graph : onnx.GraphProto, file_path : Path) -> None:
+    model = helper.make_model(graph, opset_imports = [helper.make_opsetid('', 13)])
+    model.ir_version = 8
+    onnx.checker.check_model(model)
+
+    log.info(f'Save stand-in model {file_path}')
+    file_path.parent.mkdir(parents = True, exist_ok = True)
+    onnx.save(model, str(file_path))
+
+def create_detection_model(file_path : Path, input_size : tuple[int, int], faces : list[tuple[numpy.ndarray, numpy.ndarray]]) -> None:
+    # The detector always finds the given faces, bounding boxes and keypoints are in coordinates of its input.
+    input_width, input_height = input_size
+
+    scores, bboxes, kpss = [], [], []
+    for stride in DETECTION_STRIDES:
+        anchor_count = (input_height // stride) * (input_width // stride) * DETECTION_ANCHOR_COUNT
+        scores.append(numpy.zeros((anchor_count, 1), numpy.float32))
+        bboxes.append(numpy.zeros((anchor_count, 4), numpy.float32))
+        kpss.append(numpy.zeros((anchor_count, 10), numpy.float32))
+
+    # Every face is predicted by the anchor of the coarsest feature map nearest to its center,
+    # distances are in strides like RetinaFace predicts them.
+    stride = DETECTION_STRIDES[-1]
+    feature_width, feature_height = input_width // stride, input_height // stride
+    for bbox, kps in faces:
+        column = min(int(round((bbox[0] + bbox[2]) / 2 / stride)), feature_width - 1)
+        row = min(int(round((bbox[1] + bbox[3]) / 2 / stride)), feature_height - 1)
+        anchor = numpy.array([column * stride, row * stride], numpy.float32)
+        index = (row * feature_width + column) * DETECTION_ANCHOR_COUNT
+
+        scores[-1][index] = 0.99
+        bboxes[-1][index] = numpy.concatenate([anchor - bbox[:2], bbox[2:4] - anchor]) / stride
+        kpss[-1][index] = (kps - anchor).flatten() / stride
+
+    # Outputs depend on the input, so ONNX Runtime does not fold the graph into constants.
+    nodes = [
+        helper.make_node('ReduceMean', ['input.1'], ['input_mean'], name = 'ReduceMean_0', keepdims = 0),
+        helper.make_node('Mul', ['input_mean', 'zero'], ['input_zero'], name = 'Mul_0')
+    ]
+    initializers = [numpy_helper.from_array(numpy.array(0, numpy.float32), 'zero')]
+    outputs = []
+    for name, predictions in (('score', scores), ('bbox', bboxes), ('kps', kpss)):
+        for stride, prediction in zip(DETECTION_STRIDES, predictions):
+            output_name = f'{name}_{stride}'
+            initializers.append(numpy_helper.from_array(prediction, f'{output_name}_constant'))
+            nodes.append(helper.make_node('Add', [f'{output_name}_constant', 'input_zero'], [output_name], name = f'Add_{output_name}'))
+            outputs.append(helper.make_tensor_value_info(output_name, TensorProto.FLOAT, list(prediction.shape)))
+
+    inputs = [helper.make_tensor_value_info('input.1', TensorProto.FLOAT, [1, 3, input_height, input_width])]
+    save_model(helper.make_graph(nodes, 'stand-in-detection', inputs, outputs, initializers), file_path)
+
+def create_recognition_model(file_path : Path, input_size : int = 112, embedding_size : int = 512, seed : int = 0) -> None:
+    # Embeddings are a random projection of the average colors of a grid over the aligned face.
+    pool_size = 16
+    feature_size = 3 * (input_size // pool_size) ** 2
+    projection = numpy.random.default_rng(seed).standard_normal((feature_size, embedding_size)).astype(numpy.float32)
+
+    nodes = [
+        helper.make_node('AveragePool', ['input.1'], ['pooled'], name = 'AveragePool_0', kernel_shape = [pool_size, pool_size], strides = [pool_size, pool_size]),
+        helper.make_node('Flatten', ['pooled'], ['features'], name = 'Flatten_0', axis = 1),
+        helper.make_node('MatMul', ['features', 'projection'], ['683'], name = 'MatMul_0')
+    ]
+    initializers = [numpy_helper.from_array(projection, 'projection')]
+    inputs = [helper.make_tensor_value_info('input.1', TensorProto.FLOAT, ['None', 3, input_size, input_size])]
+    outputs = [helper.make_tensor_value_info('683', TensorProto.FLOAT, ['None', embedding_size])]
+    save_model(helper.make_graph(nodes, 'stand-in-recognition', inputs, outputs, initializers), file_path)
+
+def create_swapper_model(file_path : Path, input_size : int = 128, latent_size : int = 512, seed : int = 0) -> None:
+    # The target face is tinted by a color derived from the latent of the source face.
+    rng = numpy.random.default_rng(seed)
+    color_projection = rng.standard_normal((latent_size, 3)).astype(numpy.float32)
+
+    nodes = [
+        helper.make_node('MatMul', ['source', 'color_projection'], ['source_color'], name = 'MatMul_0'),
+        helper.make_node('Reshape', ['source_color', 'color_shape'], ['source_color_map'], name = 'Reshape_0'),
+        helper.make_node('Sigmoid', ['source_color_map'], ['source_tint'], name = 'Sigmoid_0'),
+        helper.make_node('Mul', ['target', 'half'], ['target_half'], name = 'Mul_0'),
+        helper.make_node('Mul', ['source_tint', 'half'], ['source_tint_half'], name = 'Mul_1'),
+        helper.make_node('Add', ['target_half', 'source_tint_half'], ['output'], name = 'Add_0')
+    ]
+    # INSwapper reads the matrix mapping embeddings to latents from the last initializer.
+    initializers = [
+        numpy_helper.from_array(color_projection, 'color_projection'),
+        numpy_helper.from_array(numpy.array([-1, 3, 1, 1], numpy.int64), 'color_shape'),
+        numpy_helper.from_array(numpy.array(0.5, numpy.float32), 'half'),
+        numpy_helper.from_array(numpy.eye(latent_size, dtype = numpy.float32), 'emap')
+    ]
+    inputs = [
+        helper.make_tensor_value_info('target', TensorProto.FLOAT, [1, 3, input_size, input_size]),
+        helper.make_tensor_value_info('source', TensorProto.FLOAT, [1, latent_size])
+    ]
+    outputs = [helper.make_tensor_value_info('output', TensorProto.FLOAT, [1, 3, input_size, input_size])]
+    save_model(helper.make_graph(nodes, 'stand-in-swapper', inputs, outputs, initializers), file_path)
+
+def create_restorer_model(file_path : Path, input_size : int = 512) -> None:
+    # A pointwise convolution slightly mixing color channels, in range [-1, 1] like GFPGAN.
+    weights = (numpy.eye(3, dtype = numpy.float32) * 0.9 + 0.05).reshape((3, 3, 1, 1))
+
+    nodes = [
+        helper.make_node('Conv', ['input', 'weights', 'bias'], ['mixed'], name = 'Conv_0'),
+        helper.make_node('Tanh', ['mixed'], ['output'], name = 'Tanh_0')
+    ]
+    initializers = [
+        numpy_helper.from_array(weights, 'weights'),
+        numpy_helper.from_array(numpy.zeros(3, numpy.float32), 'bias')
+    ]
+    inputs = [helper.make_tensor_value_info('input', TensorProto.FLOAT, [1, 3, input_size, input_size])]
+    outputs = [helper.make_tensor_value_info('output', TensorProto.FLOAT, [1, 3, input_size, input_size])]
+    save_model(helper.make_graph(nodes, 'stand-in-restorer', inputs, outputs, initializers), file_path)
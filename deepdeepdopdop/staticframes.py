@@ -0,0 +1,70 @@
+import logging as log
+
+import cv2
+import numpy
+
+from typing import Optional, List, Union
+
+from .configuration import Configuration
+from .types import Frame
+from .faceanalyser import FaceAnalyser, FrameAnalysis
+from .facetracker import FaceTracker
+from .metrics import metrics
+
+class StaticFrameDetector:
+    # Frames are compared by small grayscale thumbnails, every pixel of which is the mean of a block of the frame,
+    # so a local change is found while noise of encoding is averaged out.
+    THUMBNAIL_SIZE : tuple[int, int] = (64, 36)
+
+    def __init__(self, threshold : float):
+        self.threshold = threshold
+        self.key_thumbnail : Optional[numpy.ndarray] = None
+
+    def is_static(self, frame : Frame) -> bool:
+        # A frame is compared with the last changed frame, not with the previous one, so a slow drift is not missed.
+        thumbnail = cv2.cvtColor(cv2.resize(frame, self.THUMBNAIL_SIZE, interpolation = cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        if self.key_thumbnail is not None and cv2.absdiff(thumbnail, self.key_thumbnail).max() <= self.threshold:
+            return True
+
+        self.key_thumbnail = thumbnail
+        return False
+
+class StaticFrameAnalyzer:
+    # A frame which does not differ from the last changed frame gets the same analysis object,
+    # so processors know that they may reuse the output of that frame too.
+    def __init__(self, configuration : Configuration, frame_analyzer : Union[FaceAnalyser, FaceTracker]):
+        self.configuration = configuration
+        self.frame_analyzer = frame_analyzer
+        self.static_frame_detector = StaticFrameDetector(self.configuration.static_frame_threshold)
+        self.frame_analysis : Optional[FrameAnalysis] = None
+
+        self.analyzed_frame_count : int = 0
+        self.reused_frame_count : int = 0
+
+        log.info(f'Prepare static frame detector: threshold={self.configuration.static_frame_threshold}')
+
+    def analyze_frame(self, frame : Frame) -> FrameAnalysis:
+        return self.analyze_frames([frame])[0]
+
+    def analyze_frames(self, frames : List[Frame]) -> List[FrameAnalysis]:
+        # Changed frames are analyzed together, static frames get the analysis of the changed frame before them.
+        static_frames = [self.static_frame_detector.is_static(frame) for frame in frames]
+        changed_frame_analyses = iter(self.frame_analyzer.analyze_frames([frame for frame, static_frame in zip(frames, static_frames) if not static_frame]))
+
+        frame_analyses : List[FrameAnalysis] = []
+        for static_frame in static_frames:
+            if not static_frame:
+                self.frame_analysis = next(changed_frame_analyses)
+            frame_analyses.append(self.frame_analysis)
+
+        reused_frame_count = sum(static_frames)
+        self.reused_frame_count += reused_frame_count
+        self.analyzed_frame_count += len(frames) - reused_frame_count
+        metrics.count('frames_reused', reused_frame_count)
+        metrics.count('frames_analyzed', len(frames) - reused_frame_count)
+
+        return frame_analyses
+
+    def finish(self) -> None:
+        self.frame_analyzer.finish()
+        log.info(f'Static frame statistics: analyzed_frames={self.analyzed_frame_count}, reused_frames={self.reused_frame_count}')
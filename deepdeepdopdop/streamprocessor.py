@@ -0,0 +1,242 @@
+import logging as log
+
+import copy
+import queue
+import threading
+import time
+
+from typing import Optional, Union
+
+from .configuration import Configuration
+from .fileprocessor import FileProcessor
+from .faceprocessor import FaceProcessor
+from .types import Frame, Face
+from .videoio import AVStreamReader, AVStreamWriter
+from .metrics import metrics
+
+# Steps of degradation taken one by one while frames are late, options of every step override the configuration.
+DEGRADATION_STEPS : list[dict] = [
+    {},
+    { 'restore_face': False },
+    { 'restore_face': False, 'detection_interval': 3 },
+    { 'restore_face': False, 'detection_interval': 6 }
+]
+
+# Statistics of the stream are logged every this number of seconds.
+STATISTICS_INTERVAL : float = 10.0
+
+class StreamProcessor(FileProcessor):
+    # Frames of a live stream are processed as they come, the latest frames are kept and older ones are dropped,
+    # gaps in the output are filled by the previous output frame, so the output keeps the frame rate of the input.
+    def __init__(self, configuration : Configuration, face_processor : FaceProcessor):
+        super().__init__(configuration, face_processor)
+
+        # There is no file to cache the analysis of and no frame to find the reference face in before the stream.
+        self.configuration = copy.copy(self.configuration)
+        self.configuration.analysis_cache = False
+        self.face_processor = self.face_processor.with_configuration(self.configuration)
+
+        self.latency_budget : float = self.configuration.stream_latency_budget / 1000
+        self.queue : queue.Queue = queue.Queue(maxsize = self.configuration.stream_queue_size)
+
+        self.degradation_step : int = 0
+        self.step_face_processor : FaceProcessor = self.face_processor
+        self.step_frame_analyzer = None
+        self.frames_since_step : int = 0
+        self.average_latency : float = 0
+
+        self.fps : float = 0
+        self.start_time : Optional[float] = None
+        self.written_frame_count : int = 0
+        self.previous_output_frame : Optional[Frame] = None
+
+        self.read_frame_count : int = 0
+        self.processed_frame_count : int = 0
+        self.dropped_frame_count : int = 0
+        self.duplicated_frame_count : int = 0
+        self.statistics_time : float = 0
+
+    def __drop_frame(self) -> None:
+        self.dropped_frame_count += 1
+        metrics.count('frames_dropped')
+
+    def __read(self, stream_reader : AVStreamReader) -> None:
+        # Frames are put with the time of their arrival, if processing falls behind the oldest waiting frame is dropped.
+        try:
+            for frame in stream_reader:
+                self.read_frame_count += 1
+                item = (frame, stream_reader.time, time.perf_counter())
+                while True:
+                    try:
+                        self.queue.put_nowait(item)
+                        break
+                    except queue.Full:
+                        try:
+                            self.queue.get_nowait()
+                            self.__drop_frame()
+                        except queue.Empty:
+                            pass
+        except Exception:
+            log.exception('Failed to read video stream')
+        finally:
+            self.queue.put(None)
+
+    def __set_degradation_step(self, degradation_step : int) -> None:
+        log.info(f'Stream degradation step {self.degradation_step} -> {degradation_step}: {DEGRADATION_STEPS[degradation_step]}, average_latency={self.average_latency * 1000:.1f} msec')
+
+        step_configuration = copy.copy(self.configuration)
+        for name, value in DEGRADATION_STEPS[degradation_step].items():
+            if name == 'detection_interval':
+                value = max(value, self.configuration.detection_interval)
+            setattr(step_configuration, name, value)
+
+        if self.step_frame_analyzer is not None:
+            self.step_frame_analyzer.finish()
+
+        self.degradation_step = degradation_step
+        self.step_face_processor = self.face_processor.with_configuration(step_configuration)
+        self.step_frame_analyzer = self.step_face_processor.create_frame_analyzer()
+        self.frames_since_step = 0
+
+    def __adapt(self, latency : float) -> None:
+        # The step is changed by the average latency, at most once a second, and is lowered back only with a margin,
+        # so processing does not switch back and forth around the budget.
+        self.average_latency = latency if self.processed_frame_count == 1 else 0.9 * self.average_latency + 0.1 * latency
+        self.frames_since_step += 1
+        if self.frames_since_step < max(self.fps, 1):
+            return
+
+        if self.average_latency > self.latency_budget and self.degradation_step < len(DEGRADATION_STEPS) - 1:
+            self.__set_degradation_step(self.degradation_step + 1)
+        elif self.average_latency < self.latency_budget / 2 and self.degradation_step > 0:
+            self.__set_degradation_step(self.degradation_step - 1)
+
+    def __process_frame(self, frame : Frame, source_face : Union[Face, list[Face]]) -> Frame:
+        frame_analysis = self.step_frame_analyzer.analyze_frame(frame)
+        metrics.observe('faces_per_frame', len(frame_analysis))
+
+        reference_face = self.step_face_processor.find_reference_face_in_video_frame(frame_analysis, None)
+        if reference_face:
+            return self.step_face_processor.process(source_face, reference_face, frame, frame_analysis)
+        return frame
+
+    def __write(self, stream_writer : AVStreamWriter, output_frame : Frame, frame_time : float) -> None:
+        # The frame is written at its position by the time of the stream, missing positions get the previous frame.
+        frame_index = int(round((frame_time - self.start_time) * self.fps))
+
+        if frame_index < self.written_frame_count:
+            # The input comes faster than the frame rate of the output.
+            self.__drop_frame()
+            return
+
+        if self.previous_output_frame is not None:
+            while self.written_frame_count < frame_index:
+                stream_writer.write(self.previous_output_frame)
+                self.written_frame_count += 1
+                self.duplicated_frame_count += 1
+                metrics.count('frames_duplicated')
+
+        stream_writer.write(output_frame)
+        self.written_frame_count += 1
+        self.previous_output_frame = output_frame
+
+    def __log_statistics(self) -> None:
+        latency = metrics.to_dict()['stages'].get('stream_latency')
+        drop_rate = self.dropped_frame_count / self.read_frame_count if self.read_frame_count else 0
+        log.info(f'Stream statistics: read_frames={self.read_frame_count}, processed_frames={self.processed_frame_count}, written_frames={self.written_frame_count}, dropped_frames={self.dropped_frame_count}, duplicated_frames={self.duplicated_frame_count}, drop_rate={drop_rate:.3f}, degradation_step={self.degradation_step}'
+                 + (f', mean_latency={latency["mean"] * 1000:.1f} msec, p95_latency<={latency["p95"] * 1000:.1f} msec, max_latency={latency["max"] * 1000:.1f} msec' if latency else ''))
+
+    def __process(self, stream_reader : AVStreamReader, stream_writer : AVStreamWriter, source_face : Union[Face, list[Face]]) -> None:
+        reader = threading.Thread(target = self.__read, args = (stream_reader,), name = 'stream-reader', daemon = True)
+        reader.start()
+
+        self.statistics_time = time.perf_counter()
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            frame, frame_time, arrival_time = item
+            if frame_time is None:
+                frame_time = arrival_time
+            if self.start_time is None:
+                self.start_time = frame_time
+
+            # A frame which waited longer than the budget is dropped if a fresher frame is already waiting.
+            if time.perf_counter() - arrival_time > self.latency_budget and not self.queue.empty():
+                self.__drop_frame()
+                continue
+
+            output_frame = self.__process_frame(frame, source_face)
+            self.__write(stream_writer, output_frame, frame_time)
+
+            latency = time.perf_counter() - arrival_time
+            metrics.observe_stage('stream_latency', latency)
+            metrics.count('frames_processed')
+            self.processed_frame_count += 1
+            self.__adapt(latency)
+
+            if time.perf_counter() - self.statistics_time >= STATISTICS_INTERVAL:
+                self.__log_statistics()
+                self.statistics_time = time.perf_counter()
+
+        reader.join()
+        self.step_frame_analyzer.finish()
+        self.__log_statistics()
+
+    def __create_stream_reader(self) -> AVStreamReader:
+        # Raw frames have no header, their size, pixel format and rate are given.
+        options : dict[str, str] = {}
+        if self.configuration.stream_frame_size:
+            options['video_size'] = '{}x{}'.format(*self.configuration.stream_frame_size)
+            options['pixel_format'] = self.configuration.stream_pixel_format
+        if self.configuration.stream_fps and self.configuration.stream_input_format == 'rawvideo':
+            options['framerate'] = str(self.configuration.stream_fps)
+
+        return AVStreamReader(self.configuration.stream_input, self.configuration.stream_input_format, options, self.configuration.video_decoder_threads)
+
+    def __create_stream_writer(self, stream_reader : AVStreamReader) -> AVStreamWriter:
+        if self.configuration.stream_output_format == 'rawvideo':
+            return AVStreamWriter(self.configuration.stream_output, 'rawvideo', 'rawvideo', self.fps, stream_reader.frame_width, stream_reader.frame_height, self.configuration.stream_pixel_format)
+
+        # Encoded output is tuned for latency unless the encoder settings are given.
+        codec_name = self.configuration.video_codec or 'libx264'
+        options = self.configuration.video_encoder_options
+        if codec_name == 'libx264' and not self.configuration.video_preset:
+            options.update({ 'preset': 'ultrafast', 'tune': 'zerolatency' })
+        if self.configuration.video_gop:
+            options['g'] = str(self.configuration.video_gop)
+        return AVStreamWriter(self.configuration.stream_output, self.configuration.stream_output_format, codec_name, self.fps, stream_reader.frame_width, stream_reader.frame_height, self.configuration.video_pixel_format, options)
+
+    def run(self) -> None:
+        log.info(f'Process video stream {self.configuration.stream_input} into {self.configuration.stream_output}: latency_budget={self.configuration.stream_latency_budget} msec')
+
+        source_face = self.face_processor.find_source_face()
+        if not source_face:
+            return
+
+        # Models are loaded before the stream is opened, so first frames are not late.
+        self.face_processor.face_analyser
+        self.face_processor.face_swapper
+        if self.configuration.restore_face:
+            self.face_processor.face_restorer
+
+        with self.__create_stream_reader() as stream_reader:
+            if not stream_reader:
+                return
+
+            self.fps = self.configuration.stream_fps or stream_reader.fps
+            if not self.fps:
+                log.error('Frame rate of video stream is unknown, it must be set')
+                return
+
+            with self.__create_stream_writer(stream_reader) as stream_writer:
+                if not stream_writer:
+                    return
+
+                self.__set_degradation_step(0)
+                try:
+                    self.__process(stream_reader, stream_writer, source_face)
+                except KeyboardInterrupt:
+                    log.info('Stop video stream')
+                    self.__log_statistics()
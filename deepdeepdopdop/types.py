@@ -1,8 +1,20 @@
+from collections.abc import MutableSequence
 from cv2 import Mat
-from insightface.app.common import Face as InsightFace
+from typing import TYPE_CHECKING, Optional
+
+# insightface imports onnxruntime and its models, so it is imported only when faces are created,
+# annotations refer to its face type by name.
+if TYPE_CHECKING:
+    from insightface.app.common import Face
+else:
+    Face = 'insightface.app.common.Face'
 
 Frame = Mat
-Frames = list[Frame]
+Frames = MutableSequence[Frame]
 
-Face = InsightFace
 TargetFaces = list[tuple[int, list[Face]]]
+
+def create_face(face : Optional[dict] = None, **kwargs) -> Face:
+    from insightface.app.common import Face as InsightFace
+
+    return InsightFace(face, **kwargs)
@@ -1,14 +1,39 @@
 import logging as log
 
 import cv2
+import numpy
 import av
+from av.video.reformatter import VideoReformatter
+
+import sys
 
 from contextlib import ContextDecorator
+from fractions import Fraction
 from pathlib import Path
 from typing import Optional
 from tqdm import tqdm
 
 from .types import Frame, Frames
+from .metrics import metrics
+
+# Tags of sample entries which let parameter sets change in band, by codec.
+IN_BAND_CODEC_TAGS : dict[str, str] = {
+    'h264': 'avc3',
+    'hevc': 'hev1'
+}
+
+# Profile indications of a codec in the order of their tools, a decoder of a profile decodes streams of the profiles
+# before it. Baseline is the constrained baseline which libx264 encodes, Main Still Picture is a subset of Main.
+PROFILE_ORDERS : dict[str, list[int]] = {
+    'h264': [66, 77, 100, 110, 122, 244],
+    'hevc': [3, 1, 2]
+}
+
+# Profile names of encoders by profile indications.
+ENCODER_PROFILES : dict[str, dict[int, str]] = {
+    'libx264': { 66: 'baseline', 77: 'main', 100: 'high', 110: 'high10', 122: 'high422', 244: 'high444' },
+    'libx265': { 1: 'main', 2: 'main10', 3: 'mainstillpicture' }
+}
 
 class VideoReader(ContextDecorator):
     def __init__(self, file_path : Path):
@@ -20,6 +45,7 @@ class VideoReader(ContextDecorator):
         self.frame_width : int = 0
         self.frame_height : int = 0
         self.frame : Frame = None
+        self.timestamp : float = 0
 
     def __enter__(self):
         log.info(f'Open video file {self.file_path} for reading')
@@ -44,7 +70,7 @@ class VideoReader(ContextDecorator):
         if self.video_capture != None:
             self.video_capture.release()
 
-    def __bool_(self) -> bool:
+    def __bool__(self) -> bool:
         return self.video_capture != None and self.video_capture.isOpened()
 
     def __iter__(self):
@@ -59,21 +85,27 @@ class VideoReader(ContextDecorator):
     def get_position(self) -> int:
         return int(self.video_capture.get(cv2.CAP_PROP_POS_MSEC))
 
-    def set_position(self, time : int) -> None:
+    def set_position(self, time : int) -> bool:
         if not self.video_capture.set(cv2.CAP_PROP_POS_MSEC, time):
-            log.error(f'CAP_PROP_POS_MSEC property is supported by OpenCV backend {self.video_capture.getBackendName()}')
+            log.error(f'CAP_PROP_POS_MSEC property is not supported by OpenCV backend {self.video_capture.getBackendName()}')
+            return False
+        return True
 
+    @metrics.measured('decode')
     def read(self) -> bool:
         result, self.frame = self.video_capture.read()
+        if result:
+            self.timestamp = self.video_capture.get(cv2.CAP_PROP_POS_MSEC)
         return result
 
     def read_at(self, time : int) -> bool:
         if self.set_position(time):
             return self.read()
-        return false
+        return False
 
-    def read_all(self) -> Frames:
-        frames : Frames = []
+    def read_all(self, frames : Optional[Frames] = None) -> Frames:
+        if frames is None:
+            frames = []
 
         with tqdm(desc = 'Read video frames', total = self.frame_count, unit = 'frames') as progress:
             for frame in self:
@@ -120,9 +152,10 @@ class VideoWriter(ContextDecorator):
         if self.video_writer != None:
             self.video_writer.release()
 
-    def __bool_(self) -> bool:
+    def __bool__(self) -> bool:
         return self.video_writer != None and self.video_writer.isOpened()
 
+    @metrics.measured('encode')
     def write(self, frame : Frame) -> None:
         self.video_writer.write(frame)
 
@@ -132,6 +165,630 @@ class VideoWriter(ContextDecorator):
                 self.write(frame)
                 progress.update(1)
 
+class AVVideoReader(ContextDecorator):
+    # Decodes frames with presentation time in range [start_time, end_time) seconds by PyAV.
+    def __init__(self, file_path : Path, start_time : float = 0.0, end_time : Optional[float] = None, thread_count : int = 0):
+        self.file_path = file_path
+        self.start_time = start_time
+        self.end_time = end_time
+        self.thread_count = thread_count
+        self.container : av.container.InputContainer = None
+        self.stream : av.video.stream.VideoStream = None
+        self.frames = None
+        self.reformatter : VideoReformatter = VideoReformatter()
+        self.fourcc : int = 0
+        self.fps : float = 0
+        self.duration : float = 0
+        self.frame_count : int = 0
+        self.frame_width : int = 0
+        self.frame_height : int = 0
+        self.frame : Frame = None
+        self.timestamp : float = 0
+
+    def __enter__(self):
+        log.info(f'Open video file {self.file_path} for reading from {self.start_time} sec to {self.end_time} sec')
+
+        try:
+            self.container = av.open(str(self.file_path), mode = 'r')
+        except av.AVError as error:
+            log.error(f'Failed to open video file: {error}')
+            return self
+
+        self.stream = self.container.streams.video[0]
+
+        # Frame and slice threading, the number of threads is chosen by FFmpeg if it is 0.
+        self.stream.thread_type = 'AUTO'
+        self.stream.codec_context.thread_count = self.thread_count
+
+        codec_tag = self.stream.codec_context.codec_tag
+        self.fourcc = cv2.VideoWriter_fourcc(*codec_tag) if codec_tag and len(codec_tag) == 4 else 0
+        self.fps = float(self.stream.average_rate or self.stream.guessed_rate or 0)
+        self.frame_width = self.stream.codec_context.width
+        self.frame_height = self.stream.codec_context.height
+
+        self.duration = float(self.stream.duration * self.stream.time_base) if self.stream.duration else float(self.container.duration or 0) / av.time_base
+        end_time = self.end_time if self.end_time is not None else self.duration
+        self.frame_count = max(int(round((end_time - self.start_time) * self.fps)), 0)
+
+        self.__seek(self.start_time)
+
+        log.info(f'Video file was opened by PyAV: codec={self.stream.codec_context.name}, fourcc={self.fourcc}, fps={self.fps}, frame_count={self.frame_count}, frame_width={self.frame_width}, frame_height={self.frame_height}, thread_count={self.stream.codec_context.thread_count}')
+        return self
+
+    def __exit__(self, *args):
+        if self.container != None:
+            self.container.close()
+
+    def __bool__(self) -> bool:
+        return self.container != None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.read():
+            return self.frame
+        else:
+            raise StopIteration
+
+    def __seek(self, time : float) -> None:
+        # Seeking lands on the keyframe before the time, frames before it are decoded and skipped by read().
+        if time > 0:
+            self.container.seek(int(time / self.stream.time_base), stream = self.stream, backward = True, any_frame = False)
+        self.frames = self.container.decode(self.stream)
+
+    def __to_ndarray(self, frame : av.VideoFrame) -> Frame:
+        # The reformatter keeps its conversion context between frames and the array is a view
+        # over the plane of the converted frame, it lives as long as the array is referenced.
+        bgr_frame = self.reformatter.reformat(frame, format = 'bgr24')
+        plane = bgr_frame.planes[0]
+        buffer = numpy.frombuffer(plane, numpy.uint8).reshape(bgr_frame.height, plane.line_size)
+        return buffer[:, : bgr_frame.width * 3].reshape(bgr_frame.height, bgr_frame.width, 3)
+
+    def get_position(self) -> int:
+        return int(self.timestamp)
+
+    @metrics.measured('decode')
+    def read(self) -> bool:
+        for frame in self.frames:
+            if frame.time is not None and frame.time < self.start_time:
+                continue
+            # The decoder outputs frames in presentation order, so no frame before the end time follows.
+            if self.end_time is not None and frame.time is not None and frame.time >= self.end_time:
+                return False
+            self.frame = self.__to_ndarray(frame)
+            # The true presentation time in milliseconds, frames of variable frame rate video are not evenly spaced.
+            self.timestamp = frame.time * 1000 if frame.time is not None else self.timestamp
+            return True
+        return False
+
+    def read_at(self, time : int) -> bool:
+        # The first frame with presentation time not earlier than the given time in milliseconds.
+        self.start_time = time / 1000
+        self.__seek(self.start_time)
+        return self.read()
+
+    def read_all(self, frames : Optional[Frames] = None) -> Frames:
+        if frames is None:
+            frames = []
+
+        with tqdm(desc = 'Read video frames', total = self.frame_count, unit = 'frames') as progress:
+            for frame in self:
+                frames.append(frame)
+                progress.update(1)
+
+        return frames
+
+    @staticmethod
+    def read_frame(file_path : Path, time : int) -> Optional[Frame]:
+        log.info(f'Read frame from video file {file_path} at {time} msec')
+
+        with AVVideoReader(file_path) as video_reader:
+            if video_reader:
+                if video_reader.read_at(time):
+                    return video_reader.frame
+                else:
+                    log.error(f'Video has no frame at {time} msec')
+
+        return None
+
+class AVStreamReader(ContextDecorator):
+    # Decodes frames of a live stream by PyAV, from stdin if the URL is -, from a pipe, a device or a network stream otherwise.
+    def __init__(self, url : str, format : Optional[str] = None, options : Optional[dict[str, str]] = None, thread_count : int = 0):
+        self.url = url
+        self.format = format
+        self.options : dict[str, str] = options or {}
+        self.thread_count = thread_count
+        self.container : av.container.InputContainer = None
+        self.stream : av.video.stream.VideoStream = None
+        self.frames = None
+        self.fps : float = 0
+        self.frame_width : int = 0
+        self.frame_height : int = 0
+        self.frame : Frame = None
+        # The presentation time of the frame in seconds, None if the stream has no timestamps.
+        self.time : Optional[float] = None
+
+    def __enter__(self):
+        log.info(f'Open video stream {self.url} for reading by PyAV: format={self.format}, options={self.options}')
+
+        try:
+            self.container = av.open(sys.stdin.buffer if self.url == '-' else self.url, mode = 'r', format = self.format, options = self.options)
+        except av.AVError as error:
+            log.error(f'Failed to open video stream: {error}')
+            return self
+
+        self.stream = self.container.streams.video[0]
+
+        # Frame threading delays every frame by the number of threads, slice threading does not.
+        self.stream.thread_type = 'SLICE'
+        self.stream.codec_context.thread_count = self.thread_count
+
+        self.fps = float(self.stream.average_rate or self.stream.guessed_rate or 0)
+        self.frame_width = self.stream.codec_context.width
+        self.frame_height = self.stream.codec_context.height
+        self.frames = self.container.decode(self.stream)
+
+        log.info(f'Video stream was opened by PyAV: codec={self.stream.codec_context.name}, fps={self.fps}, frame_width={self.frame_width}, frame_height={self.frame_height}')
+        return self
+
+    def __exit__(self, *args):
+        if self.container != None:
+            self.container.close()
+
+    def __bool__(self) -> bool:
+        return self.container != None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.read():
+            return self.frame
+        else:
+            raise StopIteration
+
+    @metrics.measured('decode')
+    def read(self) -> bool:
+        frame = next(self.frames, None)
+        if frame is None:
+            return False
+        self.frame = frame.to_ndarray(format = 'bgr24')
+        self.time = frame.time
+        return True
+
+class AVStreamWriter(ContextDecorator):
+    # Encodes frames into a live stream by PyAV, to stdout if the URL is -, raw frames are written as they are.
+    def __init__(self, url : str, format : str, codec_name : str, fps : float, frame_width : int, frame_height : int, pixel_format : str = 'yuv420p', options : Optional[dict[str, str]] = None):
+        self.url = url
+        self.format = format
+        self.codec_name = codec_name
+        self.fps = fps
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        self.pixel_format = pixel_format
+        self.options : dict[str, str] = options or {}
+        self.container : av.container.OutputContainer = None
+        self.stream : av.video.stream.VideoStream = None
+        self.frame_count : int = 0
+
+    def __enter__(self):
+        log.info(f'Open video stream {self.url} for writing by PyAV: format={self.format}, codec={self.codec_name}, fps={self.fps}, frame_width={self.frame_width}, frame_height={self.frame_height}, pixel_format={self.pixel_format}, options={self.options}')
+
+        try:
+            # Packets are written out as soon as they are muxed, not when the buffer of the muxer is full.
+            self.container = av.open(sys.stdout.buffer if self.url == '-' else self.url, mode = 'w', format = self.format, options = { 'flush_packets': '1' })
+            self.stream = self.container.add_stream(self.codec_name, rate = Fraction(self.fps).limit_denominator(100000))
+            self.stream.width = self.frame_width
+            self.stream.height = self.frame_height
+            self.stream.pix_fmt = self.pixel_format
+            self.stream.options = self.options
+        except (av.AVError, ValueError) as error:
+            log.error(f'Failed to open video stream: {error}')
+            if self.container != None:
+                self.container.close()
+            self.container = None
+
+        return self
+
+    def __exit__(self, *args):
+        if self.container != None:
+            for packet in self.stream.encode():
+                self.container.mux(packet)
+            self.container.close()
+
+    def __bool__(self) -> bool:
+        return self.container != None
+
+    @metrics.measured('encode')
+    def write(self, frame : Frame) -> None:
+        video_frame = av.VideoFrame.from_ndarray(frame, format = 'bgr24')
+        for packet in self.stream.encode(video_frame):
+            self.container.mux(packet)
+        self.frame_count += 1
+
+class AudioPacketCopier:
+    # Copies audio packets of an input file into an output container interleaved with video packets.
+    def __init__(self, audio_input_file_path : Path, output_container : av.container.OutputContainer):
+        self.output_container = output_container
+        self.input_container : av.container.InputContainer = av.open(str(audio_input_file_path), mode = 'r')
+        self.output_stream = None
+        self.packets = None
+        self.packet : av.Packet = None
+
+        if self.input_container.streams.audio:
+            input_stream = self.input_container.streams.audio[0]
+            self.output_stream = self.output_container.add_stream(template = input_stream)
+            self.packets = self.input_container.demux(input_stream)
+        else:
+            log.info(f'Input file {audio_input_file_path} has no audio stream')
+
+    def copy(self, end_time : Optional[float] = None) -> None:
+        # Packets up to the given time in seconds are copied, all remaining ones if it is not given.
+        while self.packets is not None:
+            if self.packet is None:
+                self.packet = next(self.packets, None)
+                if self.packet is None:
+                    self.packets = None
+                    return
+
+            # We need to skip the "flushing" packets that `demux` generates.
+            if self.packet.dts is None:
+                self.packet = None
+                continue
+
+            if end_time is not None and self.packet.dts * self.packet.time_base > end_time:
+                return
+
+            # We need to assign the packet to the new stream.
+            self.packet.stream = self.output_stream
+            self.output_container.mux(self.packet)
+            self.packet = None
+
+    def close(self) -> None:
+        self.input_container.close()
+
+class AVVideoWriter(ContextDecorator):
+    def __init__(self, file_path : Path, codec_name : str, fps : float, frame_width : int, frame_height : int, audio_input_file_path : Optional[Path] = None,
+                 options : Optional[dict[str, str]] = None, thread_count : int = 0, gop_size : Optional[int] = None, bit_rate : Optional[int] = None, pixel_format : str = 'yuv420p'):
+        self.file_path = file_path
+        self.audio_input_file_path = audio_input_file_path
+        self.audio_packet_copier : AudioPacketCopier = None
+        self.codec_name = codec_name
+        self.options : dict[str, str] = options or {}
+        self.thread_count : int = thread_count
+        self.gop_size : Optional[int] = gop_size
+        self.bit_rate : Optional[int] = bit_rate
+        self.pixel_format : str = pixel_format
+        self.fps : float = fps
+        self.frame_width : int = frame_width
+        self.frame_height : int = frame_height
+        self.container : av.container.OutputContainer = None
+        self.stream : av.video.stream.VideoStream = None
+        self.frame_count : int = 0
+
+    def __enter__(self):
+        log.info(f'Open video file {self.file_path} for writing by PyAV: codec={self.codec_name}, fps={self.fps}, frame_width={self.frame_width}, frame_height={self.frame_height}, pixel_format={self.pixel_format}, options={self.options}, thread_count={self.thread_count}, gop_size={self.gop_size}, bit_rate={self.bit_rate}')
+
+        try:
+            self.container = av.open(str(self.file_path), mode = 'w')
+            self.stream = self.container.add_stream(self.codec_name, rate = Fraction(self.fps).limit_denominator(100000))
+            self.stream.width = self.frame_width
+            self.stream.height = self.frame_height
+            self.stream.pix_fmt = self.pixel_format
+            self.stream.options = self.options
+
+            # Frame and slice threading, the number of threads is chosen by FFmpeg if it is 0.
+            self.stream.thread_type = 'AUTO'
+            self.stream.codec_context.thread_count = self.thread_count
+            if self.gop_size:
+                self.stream.codec_context.gop_size = self.gop_size
+            if self.bit_rate:
+                self.stream.codec_context.bit_rate = self.bit_rate
+
+            # Audio of the input is copied in the same pass, so no remuxing is needed afterwards.
+            if self.audio_input_file_path:
+                self.audio_packet_copier = AudioPacketCopier(self.audio_input_file_path, self.container)
+        except (av.AVError, ValueError) as error:
+            log.error(f'Failed to open video file: {error}')
+            if self.container != None:
+                self.container.close()
+            self.container = None
+
+        return self
+
+    def __exit__(self, *args):
+        if self.container != None:
+            # Flush frames buffered in the encoder.
+            self.__mux(self.stream.encode())
+            if self.audio_packet_copier:
+                self.audio_packet_copier.copy()
+                self.audio_packet_copier.close()
+            self.container.close()
+
+    def __bool__(self) -> bool:
+        return self.container != None
+
+    def __mux(self, packets : list[av.Packet]) -> None:
+        for packet in packets:
+            self.container.mux(packet)
+            if self.audio_packet_copier and packet.dts is not None:
+                self.audio_packet_copier.copy(float(packet.dts * packet.time_base))
+
+    @metrics.measured('encode')
+    def write(self, frame : Frame) -> None:
+        video_frame = av.VideoFrame.from_ndarray(frame, format = 'bgr24')
+        self.__mux(self.stream.encode(video_frame))
+        self.frame_count += 1
+
+    def write_all(self, frames: Frames) -> None:
+        with tqdm(desc = 'Write video frames', total = len(frames), unit = 'frames') as progress:
+            for frame in frames:
+                self.write(frame)
+                progress.update(1)
+
+def probe_video_encoder_name(file_path : Path, default_encoder_name : str = 'libx264') -> str:
+    # The input video codec is used if there is an encoder for it, like the input fourcc is used by OpenCV.
+    with av.open(str(file_path), mode = 'r') as container:
+        codec_name = container.streams.video[0].codec_context.name
+    try:
+        return av.codec.Codec(codec_name, 'w').name
+    except (av.AVError, ValueError):
+        log.warning(f'There is no encoder for video codec {codec_name}, {default_encoder_name} is used instead of it')
+        return default_encoder_name
+
+def probe_video_extradata(file_path : Path) -> Optional[bytes]:
+    with av.open(str(file_path), mode = 'r') as container:
+        return container.streams.video[0].codec_context.extradata
+
+def probe_keyframe_times(file_path : Path) -> list[float]:
+    # Only packets are demuxed, nothing is decoded.
+    with av.open(str(file_path), mode = 'r') as container:
+        stream = container.streams.video[0]
+        return [float(packet.pts * packet.time_base) for packet in container.demux(stream) if packet.is_keyframe and packet.pts is not None]
+
+def probe_open_gops(file_path : Path) -> bool:
+    # A GOP is open if frames decoded after its keyframe are shown before it, they refer to frames of the GOP before it.
+    with av.open(str(file_path), mode = 'r') as container:
+        stream = container.streams.video[0]
+        keyframe_pts : Optional[int] = None
+        for packet in container.demux(stream):
+            if packet.pts is None:
+                continue
+            if packet.is_keyframe:
+                keyframe_pts = packet.pts
+            elif keyframe_pts is not None and packet.pts < keyframe_pts:
+                return True
+    return False
+
+def get_parameter_sets(codec_name : str, extradata : Optional[bytes]) -> Optional[tuple[bytes, int]]:
+    # Parameter sets of avcC or hvcC extradata as NAL units prefixed by their length like in packets,
+    # and the size of the length prefix.
+    if not extradata or extradata[0] != 1:
+        return None
+
+    nal_units : list[bytes] = []
+    if codec_name == 'h264':
+        length_size = (extradata[4] & 3) + 1
+        position = 5
+        # Sequence parameter sets and then picture parameter sets.
+        for count_mask in (0x1f, 0xff):
+            count = extradata[position] & count_mask
+            position += 1
+            for _ in range(count):
+                size = int.from_bytes(extradata[position : position + 2], 'big')
+                nal_units.append(extradata[position + 2 : position + 2 + size])
+                position += 2 + size
+    elif codec_name == 'hevc':
+        length_size = (extradata[21] & 3) + 1
+        position = 23
+        # Arrays of video, sequence and picture parameter sets and SEI.
+        for _ in range(extradata[22]):
+            count = int.from_bytes(extradata[position + 1 : position + 3], 'big')
+            position += 3
+            for _ in range(count):
+                size = int.from_bytes(extradata[position : position + 2], 'big')
+                nal_units.append(extradata[position + 2 : position + 2 + size])
+                position += 2 + size
+    else:
+        return None
+
+    return b''.join(len(nal_unit).to_bytes(length_size, 'big') + nal_unit for nal_unit in nal_units), length_size
+
+def get_profile_level(codec_name : str, extradata : Optional[bytes]) -> Optional[tuple[int, int]]:
+    # Profile and level of avcC or hvcC extradata, which the sample entry declares for the whole stream.
+    if not extradata or extradata[0] != 1:
+        return None
+
+    if codec_name == 'h264':
+        return extradata[1], extradata[3]
+    if codec_name == 'hevc':
+        return extradata[1] & 0x1f, extradata[12]
+    return None
+
+def get_encoder_profile_options(encoder_name : str, profile_level : Optional[tuple[int, int]]) -> dict[str, str]:
+    # Options which let libx264 or libx265 encode at most the profile and the level of the input, other encoders choose them.
+    if profile_level is None or profile_level[0] not in ENCODER_PROFILES.get(encoder_name, {}):
+        return {}
+
+    profile, level = profile_level
+    if encoder_name == 'libx264':
+        return { 'profile': ENCODER_PROFILES[encoder_name][profile], 'level': '1b' if level == 9 else f'{level // 10}.{level % 10}' }
+    # Levels of HEVC are 30 times their number.
+    return { 'profile': ENCODER_PROFILES[encoder_name][profile], 'x265-params': f'level-idc={level / 30:g}' }
+
+def check_stitchable(codec_name : str, extradata : Optional[bytes], segment_extradata : Optional[bytes]) -> None:
+    # Segments are stitched under the sample entry of the input, so their NAL units have sizes of the same length
+    # and their profile and level do not exceed the ones of the input, otherwise ValueError is raised.
+    parameter_sets = get_parameter_sets(codec_name, extradata)
+    segment_parameter_sets = get_parameter_sets(codec_name, segment_extradata)
+    if parameter_sets and segment_parameter_sets and segment_parameter_sets[1] != parameter_sets[1]:
+        raise ValueError(f'Segment has NAL units with length of {segment_parameter_sets[1]} bytes, the input has {parameter_sets[1]} bytes')
+
+    profile_level = get_profile_level(codec_name, extradata)
+    segment_profile_level = get_profile_level(codec_name, segment_extradata)
+    if profile_level is None or segment_profile_level is None:
+        if profile_level != segment_profile_level:
+            raise ValueError(f'Segment has profile and level {segment_profile_level}, the input has {profile_level}')
+        return
+
+    (profile, level), (segment_profile, segment_level) = profile_level, segment_profile_level
+    profile_order = PROFILE_ORDERS.get(codec_name, [])
+    if segment_profile != profile and (segment_profile not in profile_order or profile not in profile_order or profile_order.index(segment_profile) > profile_order.index(profile)):
+        raise ValueError(f'Segment has profile {segment_profile}, which decoders of profile {profile} of the input do not support')
+    if segment_level > level:
+        raise ValueError(f'Segment has level {segment_level}, which exceeds level {level} of the input')
+
+class VideoStitcher(ContextDecorator):
+    # Stitches ranges of GOPs copied from the input with segments rendered from other ranges into one output
+    # without re-encoding. Decoders switch between the parameter sets of the input encoder and the segment encoder,
+    # so the first packet after every switch carries them in band and the output is tagged as avc3 or hev1,
+    # whose sample entries allow parameter sets in band, unlike avc1 or hvc1 of the input.
+    def __init__(self, input_file_path : Path, output_file_path : Path):
+        self.input_file_path = input_file_path
+        self.output_file_path = output_file_path
+        self.input_container : av.container.InputContainer = None
+        self.input_stream : av.video.stream.VideoStream = None
+        self.output_container : av.container.OutputContainer = None
+        self.output_stream : av.video.stream.VideoStream = None
+        self.audio_packet_copier : AudioPacketCopier = None
+        self.time_base : Fraction = None
+        self.parameter_sets : Optional[tuple[bytes, int]] = None
+        self.last_dts : Optional[int] = None
+        self.encoder_switched : bool = False
+        self.copied_packet_count : int = 0
+        self.rendered_packet_count : int = 0
+
+    def __enter__(self):
+        log.info(f'Open video file {self.output_file_path} for stitching ranges of video file {self.input_file_path}')
+
+        self.input_container = av.open(str(self.input_file_path), mode = 'r')
+        self.input_stream = self.input_container.streams.video[0]
+        self.time_base = self.input_stream.time_base
+        self.parameter_sets = get_parameter_sets(self.input_stream.codec_context.name, self.input_stream.codec_context.extradata)
+
+        self.output_container = av.open(str(self.output_file_path), mode = 'w')
+        self.output_stream = self.output_container.add_stream(template = self.input_stream)
+        if self.input_stream.codec_context.name in IN_BAND_CODEC_TAGS:
+            self.output_stream.codec_context.codec_tag = IN_BAND_CODEC_TAGS[self.input_stream.codec_context.name]
+        self.audio_packet_copier = AudioPacketCopier(self.input_file_path, self.output_container)
+        return self
+
+    def __exit__(self, *args):
+        if self.audio_packet_copier:
+            self.audio_packet_copier.copy()
+            self.audio_packet_copier.close()
+        if self.output_container:
+            self.output_container.close()
+        if self.input_container:
+            self.input_container.close()
+
+        log.info(f'Video is stitched: copied_packets={self.copied_packet_count}, rendered_packets={self.rendered_packet_count}')
+
+    def __mux(self, packet : av.Packet, pts : int, dts : int, parameter_sets : Optional[bytes] = None) -> None:
+        if parameter_sets:
+            is_keyframe = packet.is_keyframe
+            packet = av.Packet(parameter_sets + bytes(packet))
+            packet.is_keyframe = is_keyframe
+
+        # Decoding timestamps of the input are before presentation timestamps by the delay of B-frames,
+        # so the first packets after a rendered range may go back, they are moved forward by a tick.
+        if self.last_dts is not None and dts <= self.last_dts:
+            dts = self.last_dts + 1
+        self.last_dts = dts
+
+        packet.pts = pts
+        packet.dts = dts
+        packet.time_base = self.time_base
+        packet.stream = self.output_stream
+        self.output_container.mux(packet)
+
+        self.audio_packet_copier.copy(float(dts * self.time_base))
+
+    def copy(self, start_time : float, end_time : Optional[float]) -> None:
+        # GOPs from the keyframe at the start time to the keyframe at the end time.
+        start_pts = int(round(start_time / self.time_base))
+        end_pts = int(round(end_time / self.time_base)) if end_time is not None else None
+
+        self.input_container.seek(start_pts, stream = self.input_stream, backward = True, any_frame = False)
+        parameter_sets = self.parameter_sets[0] if self.encoder_switched and self.parameter_sets else None
+
+        for packet in self.input_container.demux(self.input_stream):
+            # We need to skip the "flushing" packets that `demux` generates.
+            if packet.dts is None or packet.pts is None:
+                continue
+            if packet.pts < start_pts:
+                continue
+            if end_pts is not None and packet.is_keyframe and packet.pts >= end_pts:
+                break
+
+            self.__mux(packet, packet.pts, packet.dts, parameter_sets)
+            parameter_sets = None
+            self.copied_packet_count += 1
+
+        self.encoder_switched = False
+
+    def append(self, segment_file_path : Path, start_time : float) -> None:
+        # Packets of a segment rendered from the start time, its timestamps start from zero.
+        start_pts = int(round(start_time / self.time_base))
+
+        with av.open(str(segment_file_path), mode = 'r') as segment_container:
+            segment_stream = segment_container.streams.video[0]
+            check_stitchable(self.input_stream.codec_context.name, self.input_stream.codec_context.extradata, segment_stream.codec_context.extradata)
+            segment_parameter_sets = get_parameter_sets(segment_stream.codec_context.name, segment_stream.codec_context.extradata)
+
+            parameter_sets = segment_parameter_sets[0] if segment_parameter_sets else None
+            segment_time_base = segment_stream.time_base
+            for packet in segment_container.demux(segment_stream):
+                if packet.dts is None or packet.pts is None:
+                    continue
+
+                pts = start_pts + int(round(packet.pts * segment_time_base / self.time_base))
+                dts = start_pts + int(round(packet.dts * segment_time_base / self.time_base))
+                self.__mux(packet, pts, dts, parameter_sets)
+                parameter_sets = None
+                self.rendered_packet_count += 1
+
+        self.encoder_switched = True
+
+def concatenate_videos(input_file_paths : list[Path], frame_counts : list[int], fps : float, output_file_path : Path, audio_input_file_path : Optional[Path] = None) -> None:
+    log.info(f'Concatenate {len(input_file_paths)} video files to {output_file_path}')
+
+    with av.open(str(output_file_path), mode = 'w') as output_container:
+        output_stream = None
+        audio_packet_copier : AudioPacketCopier = None
+        offset_time = Fraction(0)
+
+        for input_file_path, frame_count in zip(input_file_paths, frame_counts):
+            with av.open(str(input_file_path), mode = 'r') as input_container:
+                input_stream = input_container.streams.video[0]
+                if output_stream is None:
+                    output_stream = output_container.add_stream(template = input_stream)
+                    if audio_input_file_path:
+                        audio_packet_copier = AudioPacketCopier(audio_input_file_path, output_container)
+
+                # Packets are copied without re-encoding, only their timestamps are shifted.
+                offset = int(round(offset_time / input_stream.time_base))
+                for packet in input_container.demux(input_stream):
+                    # We need to skip the "flushing" packets that `demux` generates.
+                    if packet.dts is None:
+                        continue
+
+                    packet.pts += offset
+                    packet.dts += offset
+                    packet.stream = output_stream
+
+                    output_container.mux(packet)
+
+                    if audio_packet_copier:
+                        audio_packet_copier.copy(float(packet.dts * packet.time_base))
+
+            offset_time += Fraction(frame_count) / Fraction(fps).limit_denominator(100000)
+
+        if audio_packet_copier:
+            audio_packet_copier.copy()
+            audio_packet_copier.close()
+
 class AudioVideoMixer(ContextDecorator):
     def __init__(self, audio_input_file_path : Path, video_input_file_path : Path):
         self.audio_input_file_path = audio_input_file_path
@@ -156,7 +813,7 @@ class AudioVideoMixer(ContextDecorator):
         if self.output_container:
             self.output_container.close()
 
-    def __bool_(self) -> bool:
+    def __bool__(self) -> bool:
         return self.audio_input_container != None and self.video_input_container != None and self.output_container != None
 
     def mix(self) -> None:
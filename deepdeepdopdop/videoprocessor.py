@@ -3,69 +3,159 @@ import logging as log
 import numpy
 
 from tqdm import tqdm
+from pathlib import Path
+from typing import Optional, Union
 
 from .configuration import Configuration
 from .fileprocessor import FileProcessor
 from .faceprocessor import FaceProcessor
+from .faceanalyser import FrameAnalysis
+from .framestore import FrameStore
+from .metrics import metrics
+from .pipeline import Pipeline
 from .types import Frame, Frames, Face, TargetFaces
 from .videoio import VideoReader
+from .videoio import AVVideoReader
 from .videoio import VideoWriter
+from .videoio import AVVideoWriter
 from .videoio import AudioVideoMixer
+from .videoio import probe_video_encoder_name
 
 class VideoProcessor(FileProcessor):
     def __init__(self, configuration : Configuration, face_processor : FaceProcessor):
         super().__init__(configuration, face_processor)
 
+        # A static frame has the same analysis object as the changed frame before it, so the output of that frame is reused.
+        self.previous_frame_analysis : Optional[FrameAnalysis] = None
+        self.previous_output_frame : Optional[Frame] = None
+
+    def __process_frame(self, input_frame : Frame, frame_analysis : FrameAnalysis, source_face : Face, reference_face : Face) -> Frame:
+        metrics.observe('faces_per_frame', len(frame_analysis))
+
+        if frame_analysis is self.previous_frame_analysis:
+            return self.previous_output_frame
+
+        output_frame = input_frame
+        reference_face = self.face_processor.find_reference_face_in_video_frame(frame_analysis, reference_face)
+        if reference_face:
+            output_frame = self.face_processor.process(source_face, reference_face, input_frame, frame_analysis)
+
+        self.previous_frame_analysis = frame_analysis
+        self.previous_output_frame = output_frame
+        return output_frame
+
     def __process(self, video_reader : VideoReader, video_writer : VideoWriter, source_face : Face, reference_face : Face) -> None:
+        frame_analyzer = self.face_processor.create_frame_analyzer()
+
         with tqdm(desc = 'Processing frames', total = video_reader.frame_count, unit = 'frames') as progress:
             for input_frame in video_reader:
-                if self.configuration.reference_frame_time < 0:
-                    reference_face = self.face_processor.face_analyser.find_reference_face_in_video_frame(input_frame)
+                # The latency of a frame from its analysis to its encoding, decoding is measured by the reader.
+                with metrics.measure('frame'):
+                    frame_analysis = frame_analyzer.analyze_frame(input_frame)
 
-                if reference_face:
-                    output_frame = self.face_processor.process(source_face, reference_face, input_frame)
+                    output_frame = self.__process_frame(input_frame, frame_analysis, source_face, reference_face)
                     video_writer.write(output_frame)
-                else:
-                    video_writer.write(input_frame)
 
                 progress.update(1)
+                self.report_progress('processing', progress.n, video_reader.frame_count)
 
-    def __process_in_memory(self, video_reader : VideoReader, video_writer : VideoWriter, source_face : Face, reference_face : Face) -> None:
-        frames = video_reader.read_all()
+        frame_analyzer.finish()
+
+    def __process_in_pipeline(self, video_reader : VideoReader, video_writer : VideoWriter, source_face : Face, reference_face : Face) -> None:
+        # Decoding, analysis, swapping with restoration and encoding run on separate threads
+        # connected by bounded queues, ONNX Runtime and OpenCV release the GIL while working.
+        pipeline = Pipeline(self.configuration.pipeline_queue_size)
+        frame_analyzer = self.face_processor.create_frame_analyzer()
+
+        pipeline.add_stage('analyze', lambda input_frame: (input_frame, frame_analyzer.analyze_frame(input_frame)))
+        pipeline.add_stage('process', lambda item: self.__process_frame(item[0], item[1], source_face, reference_face))
 
-        target_faces = self.face_processor.analyze(frames, reference_face)
+        with tqdm(desc = 'Processing frames', total = video_reader.frame_count, unit = 'frames') as progress:
+            def write(output_frame : Frame) -> None:
+                video_writer.write(output_frame)
+                progress.update(1)
+                self.report_progress('processing', progress.n, video_reader.frame_count)
 
-        self.face_processor.swap(frames, target_faces, source_face)
+            pipeline.run(video_reader, write)
 
-        if self.configuration.restore_face:
-            self.face_processor.restore(frames, target_faces)
+        frame_analyzer.finish()
 
-        video_writer.write_all(frames)
+    def __process_in_memory(self, video_reader : VideoReader, video_writer : VideoWriter, source_face : Face, reference_face : Face) -> None:
+        # Only a window of frames is kept in RAM, the rest is spilled to a memory-mapped file.
+        with FrameStore(video_reader.frame_width, video_reader.frame_height, video_reader.frame_count, self.configuration.frame_store_window_size, self.configuration.frame_store_directory) as frames:
+            self.report_progress('reading', 0, video_reader.frame_count)
+            video_reader.read_all(frames)
+
+            self.report_progress('analyzing', 0, len(frames))
+            reused_frames : list[tuple[int, int]] = []
+            target_faces = self.face_processor.analyze(frames, reference_face, reused_frames)
+
+            self.report_progress('swapping', 0, len(target_faces))
+            self.face_processor.swap(frames, target_faces, source_face)
+
+            if self.configuration.restore_face:
+                self.report_progress('restoring', 0, len(target_faces))
+                self.face_processor.restore(frames, target_faces)
+
+            # Static frames are copies of the output of the changed frames before them, which are processed by now.
+            for frame_index, key_frame_index in reused_frames:
+                frames[frame_index] = frames[key_frame_index]
+
+            self.report_progress('writing', 0, len(frames))
+            video_writer.write_all(frames)
+
+    def render(self, video_reader : VideoReader, video_writer : VideoWriter, source_face : Face, reference_face : Face) -> None:
+        self.previous_frame_analysis = None
+        self.previous_output_frame = None
+
+        if self.configuration.process_video_in_memory:
+            self.__process_in_memory(video_reader, video_writer, source_face, reference_face)
+        elif self.configuration.process_video_in_pipeline:
+            self.__process_in_pipeline(video_reader, video_writer, source_face, reference_face)
+        else:
+            self.__process(video_reader, video_writer, source_face, reference_face)
+
+    def __create_video_reader(self) -> Union[VideoReader, AVVideoReader]:
+        if self.configuration.video_reader == 'av':
+            return AVVideoReader(self.configuration.input_file, thread_count = self.configuration.video_decoder_threads)
+        return VideoReader(self.configuration.input_file)
+
+    def create_av_video_writer(self, file_path : Path, codec_name : str, video_reader : Union[VideoReader, AVVideoReader], audio_input_file_path : Optional[Path] = None) -> AVVideoWriter:
+        configuration = self.configuration
+        bit_rate = configuration.video_bitrate * 1000 if configuration.video_bitrate else None
+        return AVVideoWriter(file_path, codec_name, video_reader.fps, video_reader.frame_width, video_reader.frame_height, audio_input_file_path,
+                             configuration.video_encoder_options, configuration.video_encoder_threads, configuration.video_gop, bit_rate, configuration.video_pixel_format)
+
+    def __create_video_writer(self, video_reader : VideoReader) -> Union[VideoWriter, AVVideoWriter]:
+        if self.configuration.video_writer == 'av':
+            # Frames are encoded and the audio is copied into the output file in a single pass.
+            codec_name = self.configuration.video_codec or probe_video_encoder_name(self.configuration.input_file)
+            return self.create_av_video_writer(self.configuration.output_file, codec_name, video_reader, self.configuration.input_file)
+
+        return VideoWriter(self.configuration.output_file, video_reader.fourcc, video_reader.fps, video_reader.frame_width, video_reader.frame_height)
 
     def run(self) -> None:
         log.info(f'Process input video file {self.configuration.input_file}')
 
-        source_face = self.face_processor.face_analyser.find_source_face_in_image()
+        self.report_progress('finding faces')
+        source_face = self.face_processor.find_source_face()
         if not source_face:
             return
 
         reference_face : Face = None
         if self.configuration.reference_frame_time >= 0:
-            reference_face = elf.face_processor.face_analyser.find_reference_face_in_video()
+            reference_face = self.face_processor.find_reference_face_in_video()
             if not reference_face:
                 return
 
         restore_audio : bool = False
 
-        with VideoReader(self.configuration.input_file) as video_reader:
+        with self.__create_video_reader() as video_reader:
             if video_reader:
-                with VideoWriter(self.configuration.output_file, video_reader.fourcc, video_reader.fps, video_reader.frame_width, video_reader.frame_height) as video_writer:
+                with self.__create_video_writer(video_reader) as video_writer:
                     if video_writer:
-                        if self.configuration.process_video_in_memory:
-                            self.__process_in_memory(video_reader, video_writer, source_face, reference_face)
-                        else:
-                            self.__process(video_reader, video_writer, source_face, reference_face)
-                        restore_audio = True
+                        self.render(video_reader, video_writer, source_face, reference_face)
+                        restore_audio = not isinstance(video_writer, AVVideoWriter)
 
         if restore_audio:
             with AudioVideoMixer(self.configuration.input_file, self.configuration.output_file) as audio_video_mixer:
@@ -0,0 +1,51 @@
+import numpy
+
+from pathlib import Path
+
+from deepdeepdopdop.configuration import Configuration
+from deepdeepdopdop.types import create_face
+from deepdeepdopdop.faceanalyser import FrameAnalysis
+from deepdeepdopdop.analysiscache import AnalysisCache
+
+def create_configuration(tmp_path : Path) -> Configuration:
+    configuration = Configuration()
+    configuration.input_file = tmp_path / 'input.mp4'
+    configuration.input_file.write_bytes(b'video')
+    configuration.analysis_cache_directory = tmp_path
+    return configuration
+
+def create_test_face(left : float, embedding : list[float]):
+    return create_face(bbox = numpy.array([left, 10, left + 20, 30], dtype = numpy.float32), kps = numpy.full((5, 2), left, dtype = numpy.float32), det_score = 0.9, embedding = numpy.array(embedding, dtype = numpy.float32))
+
+def test_save_and_load(tmp_path : Path):
+    analysis_cache = AnalysisCache(create_configuration(tmp_path))
+    assert not analysis_cache.exists()
+
+    # The second frame is static and has the analysis of the first one, the third frame has no faces.
+    frame_analysis = FrameAnalysis([create_test_face(0, [3, 4, 0]), create_test_face(50, [0, 0, 2])])
+    analysis_cache.save([frame_analysis, frame_analysis, FrameAnalysis([])])
+    assert analysis_cache.exists()
+
+    reader = analysis_cache.load()
+    assert len(reader) == 3
+    assert [reader.get_key_frame_index(frame_index) for frame_index in range(3)] == [0, 0, 2]
+    assert len(reader.get(2).faces) == 0
+
+    faces = reader.get(1).faces
+    assert [face.bbox.tolist() for face in faces] == [[0, 10, 20, 30], [50, 10, 70, 30]]
+    assert faces[1].kps.tolist() == [[50, 50]] * 5
+    # Embeddings are stored normed in half precision.
+    assert numpy.allclose(faces[0].embedding, [0.6, 0.8, 0], atol = 1e-3)
+    assert numpy.allclose(faces[1].embedding, [0, 0, 1], atol = 1e-3)
+
+def test_key_depends_on_analysis_options(tmp_path : Path):
+    configuration = create_configuration(tmp_path)
+    directory_path = AnalysisCache(configuration).directory_path
+    assert AnalysisCache(configuration).directory_path == directory_path
+
+    configuration.detection_interval = 5
+    assert AnalysisCache(configuration).directory_path != directory_path
+
+    configuration.detection_interval = 1
+    configuration.tracking_iou_threshold = 0.7
+    assert AnalysisCache(configuration).directory_path != directory_path
@@ -0,0 +1,49 @@
+import numpy
+
+from deepdeepdopdop.types import create_face
+from deepdeepdopdop.facematcher import FaceMatcher
+
+def create_faces(*embeddings : list[float]) -> list:
+    return [create_face(embedding = numpy.array(embedding, dtype = numpy.float32)) for embedding in embeddings]
+
+def test_match_assigns_every_face_once():
+    reference_faces = create_faces([1, 0, 0], [0, 1, 0])
+    faces = create_faces([0, 1, 0], [1, 0, 0], [0.8, 0.6, 0])
+
+    # The third face is close to the first reference face too, but that one has an equal face already.
+    assert FaceMatcher(reference_faces, 1.0).match(faces) == [(0, faces[1]), (1, faces[0])]
+
+def test_match_one_face_to_one_reference_face():
+    reference_faces = create_faces([1, 0, 0], [1, 0, 0])
+    faces = create_faces([1, 0, 0])
+
+    matches = FaceMatcher(reference_faces, 1.0).match(faces)
+    assert len(matches) == 1
+    assert matches[0][1] is faces[0]
+
+def test_match_prefers_more_valid_pairs_over_a_shorter_total_distance():
+    # The first face equals the first reference face, the distance of the second face to it is 0.9 and to
+    # the second reference face 1.2. The shortest total distance pairs the first face with the first reference face
+    # and leaves the second face too far, the +4 penalty pairs both faces crosswise within the distance instead.
+    reference_faces = create_faces([1, 0, 0], [0.55, numpy.sqrt(1 - 0.55 ** 2), 0])
+    y = (0.4 - 0.55 ** 2) / numpy.sqrt(1 - 0.55 ** 2)
+    faces = create_faces([1, 0, 0], [0.55, y, numpy.sqrt(1 - 0.55 ** 2 - y ** 2)])
+
+    assert FaceMatcher(reference_faces, 1.0).match(faces) == [(0, faces[1]), (1, faces[0])]
+
+def test_match_distance_threshold():
+    # Orthogonal embeddings are at the squared distance of exactly 2, equal embeddings at 0.
+    reference_faces = create_faces([1, 0, 0])
+
+    assert FaceMatcher(reference_faces, 2.0).match(create_faces([0, 1, 0])) == []
+    assert len(FaceMatcher(reference_faces, 2.001).match(create_faces([0, 1, 0]))) == 1
+    assert FaceMatcher(reference_faces, 0.0).match(create_faces([1, 0, 0])) == []
+    assert len(FaceMatcher(reference_faces, 0.001).match(create_faces([1, 0, 0]))) == 1
+
+def test_match_without_faces():
+    reference_faces = create_faces([1, 0, 0])
+
+    assert FaceMatcher(reference_faces, 1.0).match([]) == []
+    assert FaceMatcher(reference_faces, 1.0).match([create_face()]) == []
+    assert FaceMatcher([], 1.0).match(create_faces([1, 0, 0])) == []
+    assert not FaceMatcher([], 1.0)
@@ -0,0 +1,17 @@
+import numpy
+import pytest
+
+from deepdeepdopdop.facetracker import bbox_iou
+
+def test_bbox_iou():
+    bbox = numpy.array([0, 0, 2, 2], dtype = numpy.float32)
+    assert bbox_iou(bbox, bbox) == 1.0
+    assert bbox_iou(bbox, numpy.array([1, 0, 3, 2], dtype = numpy.float32)) == pytest.approx(1 / 3)
+    assert bbox_iou(bbox, numpy.array([0.5, 0.5, 1.5, 1.5], dtype = numpy.float32)) == 0.25
+
+def test_bbox_iou_without_overlap():
+    bbox = numpy.array([0, 0, 2, 2], dtype = numpy.float32)
+    assert bbox_iou(bbox, numpy.array([3, 3, 4, 4], dtype = numpy.float32)) == 0.0
+    # Boxes which only touch have no common area.
+    assert bbox_iou(bbox, numpy.array([2, 0, 4, 2], dtype = numpy.float32)) == 0.0
+    assert bbox_iou(numpy.array([1, 1, 1, 1], dtype = numpy.float32), numpy.array([1, 1, 1, 1], dtype = numpy.float32)) == 0.0
@@ -0,0 +1,43 @@
+import numpy
+import pytest
+
+from pathlib import Path
+
+from deepdeepdopdop.framestore import FrameStore
+
+def create_frame(value : int) -> numpy.ndarray:
+    return numpy.full((2, 4, 3), value, numpy.uint8)
+
+def test_frames_are_kept_beyond_window_and_capacity(tmp_path : Path):
+    with FrameStore(4, 2, 2, 1, tmp_path) as frame_store:
+        for index in range(5):
+            frame_store.append(create_frame(index))
+
+        assert len(frame_store) == 5
+        assert [int(frame[0, 0, 0]) for frame in frame_store] == [0, 1, 2, 3, 4]
+        assert int(frame_store[-1][0, 0, 0]) == 4
+        with pytest.raises(IndexError):
+            frame_store[5]
+        with pytest.raises(IndexError):
+            frame_store[-6]
+
+def test_frames_are_modified_in_place(tmp_path : Path):
+    with FrameStore(4, 2, 3, 1, tmp_path) as frame_store:
+        for index in range(3):
+            frame_store.append(create_frame(index))
+
+        # A spilled frame is a view into the file, a frame in the window is the appended one.
+        frame = frame_store[0]
+        frame[:] = 200
+        frame_store[0] = frame
+        frame_store[1] = create_frame(201)
+        frame_store[2] = create_frame(202)
+
+        assert [int(frame[0, 0, 0]) for frame in frame_store] == [200, 201, 202]
+
+def test_close_removes_file(tmp_path : Path):
+    with FrameStore(4, 2, 1, 1, tmp_path) as frame_store:
+        frame_store.append(create_frame(0))
+        file_path = frame_store.file_path
+        assert file_path.exists()
+    assert not file_path.exists()
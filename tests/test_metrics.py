@@ -0,0 +1,52 @@
+from deepdeepdopdop.metrics import COUNT_BUCKETS, Histogram, Metrics
+
+def test_histogram_buckets_and_quantiles():
+    histogram = Histogram(COUNT_BUCKETS)
+    for value in (0, 1, 1, 5, 100):
+        histogram.observe(value)
+
+    # A value falls into the first bucket whose upper bound is not less than it, the last bucket has no bound.
+    assert histogram.bucket_counts == [1, 2, 0, 0, 0, 1, 0, 0, 0, 0, 0, 1]
+    summary = histogram.to_dict()
+    assert (summary['count'], summary['sum'], summary['min'], summary['max']) == (5, 107, 0, 100)
+    assert summary['p50'] == 1
+    assert summary['p95'] == 100
+
+def test_empty_histogram():
+    summary = Histogram(COUNT_BUCKETS).to_dict()
+    assert (summary['count'], summary['min'], summary['max'], summary['mean'], summary['p95']) == (0, 0, 0, 0, 0)
+
+def test_merge():
+    metrics = Metrics()
+    metrics.observe('faces', 1)
+    metrics.count('frames_reused', 2)
+
+    # Metrics of a worker process arrive as a dictionary.
+    other_metrics = Metrics()
+    other_metrics.observe('faces', 3)
+    other_metrics.observe_stage('swapping', 0.02)
+    other_metrics.count('frames_reused')
+    metrics.merge(other_metrics.to_dict())
+
+    summary = metrics.to_dict()
+    assert summary['distributions']['faces']['count'] == 2
+    assert summary['distributions']['faces']['max'] == 3
+    assert summary['stages']['swapping']['count'] == 1
+    assert summary['counters'] == { 'frames_reused': 3 }
+
+def test_to_prometheus():
+    metrics = Metrics()
+    metrics.observe('faces', 1)
+    metrics.observe('faces', 5)
+    metrics.count('frames_reused', 3)
+
+    lines = metrics.to_prometheus().splitlines()
+    assert '# TYPE deepdeepdopdop_distribution histogram' in lines
+    # Buckets are cumulative.
+    assert 'deepdeepdopdop_distribution_bucket{name="faces",le="0"} 0' in lines
+    assert 'deepdeepdopdop_distribution_bucket{name="faces",le="1"} 1' in lines
+    assert 'deepdeepdopdop_distribution_bucket{name="faces",le="6"} 2' in lines
+    assert 'deepdeepdopdop_distribution_bucket{name="faces",le="+Inf"} 2' in lines
+    assert 'deepdeepdopdop_distribution_sum{name="faces"} 6.0' in lines
+    assert 'deepdeepdopdop_distribution_count{name="faces"} 2' in lines
+    assert 'deepdeepdopdop_events_total{name="frames_reused"} 3' in lines
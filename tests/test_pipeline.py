@@ -0,0 +1,37 @@
+import itertools
+import pytest
+
+from deepdeepdopdop.pipeline import Pipeline
+
+def test_run_keeps_order():
+    results = []
+    Pipeline(2).add_stage('double', lambda item: item * 2).add_stage('increment', lambda item: item + 1).run(range(100), results.append)
+    assert results == [item * 2 + 1 for item in range(100)]
+
+def fail_on(failed_item : int):
+    def function(item : int) -> int:
+        if item == failed_item:
+            raise RuntimeError(f'Item {item} failed')
+        return item
+    return function
+
+def test_run_raises_error_of_stage():
+    # The source is endless, so the pipeline returns only when the error stops it.
+    results = []
+    with pytest.raises(RuntimeError, match = 'Item 5 failed'):
+        Pipeline(2).add_stage('first', lambda item: item).add_stage('second', fail_on(5)).run(itertools.count(), results.append)
+    # Items before the failed one may be dropped when the error stops the consumer, but never reordered.
+    assert len(results) <= 5
+    assert results == list(range(len(results)))
+
+def test_run_raises_error_of_source():
+    def items():
+        yield 0
+        raise RuntimeError('Source failed')
+
+    with pytest.raises(RuntimeError, match = 'Source failed'):
+        Pipeline(2).add_stage('first', lambda item: item).run(items(), lambda item: None)
+
+def test_run_raises_error_of_consumer():
+    with pytest.raises(RuntimeError, match = 'Item 3 failed'):
+        Pipeline(2).add_stage('first', lambda item: item).run(itertools.count(), fail_on(3))
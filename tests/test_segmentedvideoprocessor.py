@@ -0,0 +1,12 @@
+from deepdeepdopdop.segmentedvideoprocessor import split_into_segments
+
+def test_split_into_segments_at_closest_keyframes():
+    keyframe_times = [0.0, 2.0, 4.0, 6.0, 8.0]
+    assert split_into_segments(keyframe_times, 2, 9.0) == [(0.0, 4.0), (4.0, None)]
+    assert split_into_segments(keyframe_times, 3, 9.0) == [(0.0, 2.0), (2.0, 6.0), (6.0, None)]
+
+def test_split_into_segments_with_few_keyframes():
+    # Segments are merged when more of them start at the same keyframe or at the start of the video.
+    assert split_into_segments([0.0, 5.0], 4, 10.0) == [(0.0, 5.0), (5.0, None)]
+    assert split_into_segments([0.0], 4, 10.0) == [(0.0, None)]
+    assert split_into_segments([0.0, 2.0, 4.0], 1, 6.0) == [(0.0, None)]
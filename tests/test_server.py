@@ -0,0 +1,41 @@
+import argparse
+import pytest
+
+from deepdeepdopdop.configuration import Configuration
+from deepdeepdopdop.server import parse_job_option
+
+ACTIONS : dict[str, argparse.Action] = {action.dest: action for action in Configuration.create_argument_parser()._actions}
+
+def test_parse_job_option_flag():
+    assert parse_job_option(ACTIONS['restore_face'], True) is True
+    assert parse_job_option(ACTIONS['restore_face'], False) is False
+    with pytest.raises(ValueError):
+        parse_job_option(ACTIONS['restore_face'], 'true')
+    with pytest.raises(ValueError):
+        parse_job_option(ACTIONS['restore_face'], 1)
+
+def test_parse_job_option_typed_value():
+    # Numbers may be given as JSON numbers or as strings like on the command line.
+    assert parse_job_option(ACTIONS['reference_face_position'], 2) == 2
+    assert parse_job_option(ACTIONS['reference_face_position'], '2') == 2
+    assert parse_job_option(ACTIONS['similar_face_distance'], 0.5) == 0.5
+    assert parse_job_option(ACTIONS['video_preset'], 'slow') == 'slow'
+    with pytest.raises(ValueError):
+        parse_job_option(ACTIONS['reference_face_position'], 'first')
+    with pytest.raises(ValueError):
+        parse_job_option(ACTIONS['reference_face_position'], 1.5)
+    with pytest.raises(ValueError):
+        parse_job_option(ACTIONS['reference_face_position'], True)
+    with pytest.raises(ValueError):
+        parse_job_option(ACTIONS['video_preset'], ['slow'])
+
+def test_parse_job_option_null():
+    # Null resets an option without a default, other options must have a value.
+    assert parse_job_option(ACTIONS['video_crf'], None) is None
+    with pytest.raises(ValueError):
+        parse_job_option(ACTIONS['similar_face_distance'], None)
+
+def test_parse_job_option_choices():
+    assert parse_job_option(ACTIONS['video_reader'], 'av') == 'av'
+    with pytest.raises(ValueError):
+        parse_job_option(ACTIONS['video_reader'], 'gstreamer')
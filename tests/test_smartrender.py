@@ -0,0 +1,144 @@
+import av
+import numpy
+import pytest
+
+from pathlib import Path
+
+from deepdeepdopdop.videoio import AVVideoReader, VideoStitcher, check_stitchable, get_encoder_profile_options, get_parameter_sets, get_profile_level
+from deepdeepdopdop.smartvideoprocessor import plan_video_ranges
+
+SPS : bytes = bytes([0x67, 0x64, 0x00, 0x28, 0xac])
+PPS : bytes = bytes([0x68, 0xee, 0x3c, 0x80])
+
+def create_avcc(profile : int, level : int, length_size : int) -> bytes:
+    return bytes([1, profile, 0, level, 0xfc | (length_size - 1), 0xe0 | 1]) + len(SPS).to_bytes(2, 'big') + SPS + bytes([1]) + len(PPS).to_bytes(2, 'big') + PPS
+
+def create_hvcc(profile : int, level : int, length_size : int) -> bytes:
+    header = bytearray(23)
+    header[0] = 1
+    header[1] = profile
+    header[12] = level
+    header[21] = 0xfc | (length_size - 1)
+    header[22] = 2
+    arrays = b''
+    for nal_unit in (SPS, PPS):
+        arrays += bytes([nal_unit[0] & 0x3f]) + (1).to_bytes(2, 'big') + len(nal_unit).to_bytes(2, 'big') + nal_unit
+    return bytes(header) + arrays
+
+def test_get_parameter_sets_of_avcc():
+    parameter_sets, length_size = get_parameter_sets('h264', create_avcc(100, 40, 4))
+    assert length_size == 4
+    assert parameter_sets == len(SPS).to_bytes(4, 'big') + SPS + len(PPS).to_bytes(4, 'big') + PPS
+
+def test_get_parameter_sets_of_hvcc():
+    parameter_sets, length_size = get_parameter_sets('hevc', create_hvcc(1, 93, 2))
+    assert length_size == 2
+    assert parameter_sets == len(SPS).to_bytes(2, 'big') + SPS + len(PPS).to_bytes(2, 'big') + PPS
+
+def test_get_parameter_sets_of_annex_b():
+    # Extradata in Annex B format starts with a start code, its parameter sets are in band already.
+    assert get_parameter_sets('h264', bytes([0, 0, 0, 1]) + SPS) is None
+    assert get_parameter_sets('h264', None) is None
+    assert get_parameter_sets('vp9', create_avcc(100, 40, 4)) is None
+
+def test_get_profile_level():
+    assert get_profile_level('h264', create_avcc(100, 40, 4)) == (100, 40)
+    assert get_profile_level('hevc', create_hvcc(0x60 | 2, 120, 4)) == (2, 120)
+    assert get_profile_level('h264', None) is None
+
+def test_plan_video_ranges_merges_gops():
+    keyframe_times = [0.0, 2.0, 4.0, 6.0, 8.0]
+    assert plan_video_ranges(keyframe_times, [2.5, 4.5], 0) == [(0.0, 2.0, False), (2.0, 6.0, True), (6.0, None, False)]
+
+def test_plan_video_ranges_margin():
+    # A changed frame just before a keyframe may have unchecked changed frames after it.
+    keyframe_times = [0.0, 2.0, 4.0]
+    assert plan_video_ranges(keyframe_times, [1.9], 0) == [(0.0, 2.0, True), (2.0, None, False)]
+    assert plan_video_ranges(keyframe_times, [1.9], 0.2) == [(0.0, 4.0, True), (4.0, None, False)]
+
+def test_plan_video_ranges_without_changes():
+    assert plan_video_ranges([4.0, 0.0, 4.0], [], 0.5) == [(0.0, None, False)]
+    assert plan_video_ranges([0.0, 4.0], [5.0], 0) == [(0.0, 4.0, False), (4.0, None, True)]
+
+def test_check_stitchable_accepts_lower_level_and_profile():
+    check_stitchable('h264', create_avcc(100, 41, 4), create_avcc(100, 41, 4))
+    check_stitchable('h264', create_avcc(100, 41, 4), create_avcc(100, 30, 4))
+    check_stitchable('h264', create_avcc(77, 41, 4), create_avcc(66, 41, 4))
+    check_stitchable('hevc', create_hvcc(2, 123, 4), create_hvcc(1, 93, 4))
+
+def test_check_stitchable_rejects_higher_level_and_profile():
+    with pytest.raises(ValueError):
+        check_stitchable('h264', create_avcc(77, 41, 4), create_avcc(77, 42, 4))
+    with pytest.raises(ValueError):
+        check_stitchable('h264', create_avcc(77, 41, 4), create_avcc(100, 41, 4))
+    with pytest.raises(ValueError):
+        check_stitchable('hevc', create_hvcc(1, 123, 4), create_hvcc(2, 123, 4))
+    with pytest.raises(ValueError):
+        check_stitchable('h264', create_avcc(100, 41, 4), create_avcc(100, 41, 2))
+
+def test_get_encoder_profile_options():
+    assert get_encoder_profile_options('libx264', (77, 41)) == { 'profile': 'main', 'level': '4.1' }
+    assert get_encoder_profile_options('libx264', (66, 9)) == { 'profile': 'baseline', 'level': '1b' }
+    assert get_encoder_profile_options('libx265', (1, 123)) == { 'profile': 'main', 'x265-params': 'level-idc=4.1' }
+    assert get_encoder_profile_options('h264_nvenc', (77, 41)) == {}
+    assert get_encoder_profile_options('libx264', None) == {}
+
+FRAME_SIZE : int = 64
+FPS : int = 25
+
+def encode_clip(file_path : Path, frame_count : int, options : dict[str, str], first_value : int = 0) -> None:
+    # Frames of a flat color which changes every frame, with a keyframe every 10 frames and no scene cuts.
+    with av.open(str(file_path), mode = 'w') as container:
+        stream = container.add_stream('libx264', rate = FPS)
+        stream.width = FRAME_SIZE
+        stream.height = FRAME_SIZE
+        stream.pix_fmt = 'yuv420p'
+        stream.options = dict(options, g = '10', **{ 'x264-params': 'scenecut=0:open-gop=0' })
+        for index in range(frame_count):
+            frame = numpy.full((FRAME_SIZE, FRAME_SIZE, 3), (first_value + index * 8) % 256, numpy.uint8)
+            for packet in stream.encode(av.VideoFrame.from_ndarray(frame, format = 'bgr24')):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+
+def test_stitch_generated_clip(tmp_path : Path):
+    input_file_path = tmp_path / 'input.mp4'
+    encode_clip(input_file_path, 30, { 'profile': 'main' })
+
+    with av.open(str(input_file_path)) as container:
+        extradata = container.streams.video[0].codec_context.extradata
+    profile_level = get_profile_level('h264', extradata)
+    assert profile_level[0] == 77
+
+    # The middle GOP is rendered again like smart render encodes ranges.
+    segment_file_path = tmp_path / 'segment.mp4'
+    encode_clip(segment_file_path, 10, dict(get_encoder_profile_options('libx264', profile_level), bf = '0'), 128)
+
+    output_file_path = tmp_path / 'output.mp4'
+    with VideoStitcher(input_file_path, output_file_path) as video_stitcher:
+        video_stitcher.copy(0.0, 0.4)
+        video_stitcher.append(segment_file_path, 0.4)
+        video_stitcher.copy(0.8, None)
+
+    with av.open(str(output_file_path)) as container:
+        stream = container.streams.video[0]
+        assert stream.codec_context.codec_tag == 'avc3'
+        frames = [frame.to_ndarray(format = 'gray') for frame in container.decode(stream)]
+
+    assert len(frames) == 30
+    # Frames of the rendered range come from the segment, other frames from the input.
+    assert abs(frames[5].mean() - 5 * 8) < 8
+    assert abs(frames[15].mean() - (128 + 5 * 8)) < 8
+    assert abs(frames[25].mean() - 25 * 8) < 8
+
+def test_read_range_of_generated_clip(tmp_path : Path):
+    # The clip has B-frames, the range ends at the first frame presented at its end time.
+    input_file_path = tmp_path / 'input.mp4'
+    encode_clip(input_file_path, 30, { 'bf': '2' })
+
+    with AVVideoReader(input_file_path, 0.4, 0.8) as video_reader:
+        frames = list(video_reader)
+
+    assert len(frames) == 10
+    for index, frame in enumerate(frames, 10):
+        assert abs(frame.mean() - index * 8) < 8
@@ -0,0 +1,31 @@
+import numpy
+
+from deepdeepdopdop.staticframes import StaticFrameDetector
+
+def create_frame(value : int) -> numpy.ndarray:
+    return numpy.full((72, 128, 3), value, numpy.uint8)
+
+def test_is_static_within_threshold():
+    static_frame_detector = StaticFrameDetector(2.0)
+    assert not static_frame_detector.is_static(create_frame(100))
+    assert static_frame_detector.is_static(create_frame(100))
+    assert static_frame_detector.is_static(create_frame(102))
+    assert not static_frame_detector.is_static(create_frame(103))
+
+def test_is_static_compares_with_last_changed_frame():
+    # Every frame differs from the previous one within the threshold, but the drift from the changed frame does not.
+    static_frame_detector = StaticFrameDetector(2.0)
+    assert not static_frame_detector.is_static(create_frame(100))
+    assert static_frame_detector.is_static(create_frame(101))
+    assert static_frame_detector.is_static(create_frame(102))
+    assert not static_frame_detector.is_static(create_frame(103))
+    assert static_frame_detector.is_static(create_frame(104))
+
+def test_is_static_finds_local_change():
+    static_frame_detector = StaticFrameDetector(2.0)
+    assert not static_frame_detector.is_static(create_frame(100))
+
+    # A change of one block of the thumbnail is not averaged out by the rest of the frame.
+    frame = create_frame(100)
+    frame[10 : 12, 20 : 22] = 150
+    assert not static_frame_detector.is_static(frame)